@@ -0,0 +1,28 @@
+"""Composite indexes for paginated progress and laurel history
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-18 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0002'
+down_revision = '0001'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_index('ix_progress_logs_user_id_created_at', 'progress_logs', ['user_id', 'created_at', 'id'])
+    op.create_index('ix_laurels_user_id_created_at', 'laurels', ['user_id', 'created_at', 'id'])
+    op.create_index('ix_laurels_user_id_laurel_type', 'laurels', ['user_id', 'laurel_type'])
+
+
+def downgrade() -> None:
+    op.drop_index('ix_laurels_user_id_laurel_type', table_name='laurels')
+    op.drop_index('ix_laurels_user_id_created_at', table_name='laurels')
+    op.drop_index('ix_progress_logs_user_id_created_at', table_name='progress_logs')
@@ -0,0 +1,30 @@
+"""Idempotency key on progress logs for batch sync
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-18 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0003'
+down_revision = '0002'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table('progress_logs') as batch_op:
+        batch_op.add_column(sa.Column('idempotency_key', sa.String(), nullable=True))
+        batch_op.create_unique_constraint(
+            'uq_progress_logs_user_id_idempotency_key', ['user_id', 'idempotency_key']
+        )
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('progress_logs') as batch_op:
+        batch_op.drop_constraint('uq_progress_logs_user_id_idempotency_key', type_='unique')
+        batch_op.drop_column('idempotency_key')
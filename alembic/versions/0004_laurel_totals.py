@@ -0,0 +1,41 @@
+"""Materialized laurel point totals for the Arena leaderboard
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-18 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0004'
+down_revision = '0003'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'laurel_totals',
+        sa.Column('user_id', sa.String(), nullable=False),
+        sa.Column('points', sa.Integer(), nullable=False),
+        sa.Column('laurel_count', sa.Integer(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('user_id'),
+    )
+    op.create_index(
+        'ix_laurel_totals_points_user_id', 'laurel_totals', [sa.text('points DESC'), 'user_id']
+    )
+    # Backfill from existing laurels
+    op.execute(
+        "INSERT INTO laurel_totals (user_id, points, laurel_count, updated_at) "
+        "SELECT user_id, COALESCE(SUM(points), 0), COUNT(id), CURRENT_TIMESTAMP "
+        "FROM laurels GROUP BY user_id"
+    )
+
+
+def downgrade() -> None:
+    op.drop_index('ix_laurel_totals_points_user_id', table_name='laurel_totals')
+    op.drop_table('laurel_totals')
@@ -0,0 +1,44 @@
+"""Running exercise stats and worker cursors for the laurel engine
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-18 13:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0005'
+down_revision = '0004'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'exercise_stats',
+        sa.Column('user_id', sa.String(), nullable=False),
+        sa.Column('exercise', sa.String(), nullable=False),
+        sa.Column('best_weight', sa.Float(), nullable=False),
+        sa.Column('best_e1rm', sa.Float(), nullable=False),
+        sa.Column('last_volume', sa.Float(), nullable=False),
+        sa.Column('rolling_volume', sa.Float(), nullable=False),
+        sa.Column('sessions', sa.Integer(), nullable=False),
+        sa.Column('last_log_id', sa.Integer(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('user_id', 'exercise'),
+    )
+    op.create_table(
+        'engine_cursors',
+        sa.Column('name', sa.String(), nullable=False),
+        sa.Column('last_log_id', sa.Integer(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('name'),
+    )
+
+
+def downgrade() -> None:
+    op.drop_table('engine_cursors')
+    op.drop_table('exercise_stats')
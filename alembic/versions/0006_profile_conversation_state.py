@@ -0,0 +1,78 @@
+"""Conversation phase and pending field as profile columns
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-18 15:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0006'
+down_revision = '0005'
+branch_labels = None
+depends_on = None
+
+# Frozen copy of the rules in services/conversation_state.derive_phase as of this revision
+CORE_FIELDS = ["initial_goal", "knowledge_level", "experience_years",
+               "training_days_per_week", "session_length_min", "equipment_access"]
+NON_AUX_KEYS = {"user_id", *CORE_FIELDS, "auxiliary_opt_in", "plan", "plan_cache_opt_out"}
+
+profiles = sa.table(
+    'profiles',
+    sa.column('id', sa.Integer),
+    sa.column('profile_data', sa.JSON),
+    sa.column('phase', sa.String),
+    sa.column('pending_field', sa.String),
+)
+
+
+def _phase(data):
+    if not all(f in data for f in CORE_FIELDS):
+        return 'core_loop'
+    if data.get('auxiliary_opt_in') is None:
+        return 'aux_offer'
+    if data.get('auxiliary_opt_in') and len([k for k in data if k not in NON_AUX_KEYS]) < 2:
+        return 'aux_loop'
+    if 'plan' not in data:
+        return 'plan_gen'
+    return 'tweak_log'
+
+
+def upgrade() -> None:
+    with op.batch_alter_table('profiles') as batch_op:
+        batch_op.add_column(sa.Column('phase', sa.String(), server_default='core_loop', nullable=False))
+        batch_op.add_column(sa.Column('pending_field', sa.String(), nullable=True))
+        batch_op.add_column(sa.Column('phase_changed_at', sa.DateTime(), nullable=True))
+        batch_op.create_index('ix_profiles_phase_phase_changed_at', ['phase', 'phase_changed_at'])
+
+    # Move pending_question out of the JSON and store each profile's phase
+    bind = op.get_bind()
+    for row in bind.execute(sa.select(profiles.c.id, profiles.c.profile_data)).all():
+        data = dict(row.profile_data or {})
+        pending = data.pop('pending_question', None)
+        bind.execute(
+            profiles.update().where(profiles.c.id == row.id).values(
+                profile_data=data, phase=_phase(data), pending_field=pending,
+            )
+        )
+    op.execute(sa.text('UPDATE profiles SET phase_changed_at = updated_at'))
+
+
+def downgrade() -> None:
+    bind = op.get_bind()
+    rows = bind.execute(
+        sa.select(profiles.c.id, profiles.c.profile_data, profiles.c.pending_field)
+        .where(profiles.c.pending_field.is_not(None))
+    ).all()
+    for row in rows:
+        data = {**(row.profile_data or {}), 'pending_question': row.pending_field}
+        bind.execute(profiles.update().where(profiles.c.id == row.id).values(profile_data=data))
+
+    with op.batch_alter_table('profiles') as batch_op:
+        batch_op.drop_index('ix_profiles_phase_phase_changed_at')
+        batch_op.drop_column('phase_changed_at')
+        batch_op.drop_column('pending_field')
+        batch_op.drop_column('phase')
@@ -0,0 +1,50 @@
+"""Chat message store and rolling conversation summaries
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-18 16:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0007'
+down_revision = '0006'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        'chat_messages',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.String(), nullable=False),
+        sa.Column('role', sa.String(), nullable=False),
+        sa.Column('content', sa.Text(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+    )
+    op.create_index('ix_chat_messages_id', 'chat_messages', ['id'])
+    op.create_index('ix_chat_messages_user_id_created_at', 'chat_messages', ['user_id', 'created_at', 'id'])
+    op.create_table(
+        'conversation_summaries',
+        sa.Column('user_id', sa.String(), nullable=False),
+        sa.Column('summary', sa.Text(), nullable=False),
+        sa.Column('last_message_id', sa.Integer(), nullable=False),
+        sa.Column('summarized_count', sa.Integer(), nullable=False),
+        sa.Column('updated_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('user_id'),
+    )
+    with op.batch_alter_table('profiles') as batch_op:
+        batch_op.add_column(sa.Column('message_count', sa.Integer(), server_default='0', nullable=False))
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('profiles') as batch_op:
+        batch_op.drop_column('message_count')
+    op.drop_table('conversation_summaries')
+    op.drop_index('ix_chat_messages_user_id_created_at', table_name='chat_messages')
+    op.drop_index('ix_chat_messages_id', table_name='chat_messages')
+    op.drop_table('chat_messages')
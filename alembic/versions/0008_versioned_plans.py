@@ -0,0 +1,126 @@
+"""Versioned plans: plan revisions, one active plan per user, plan moved out of profile_data
+
+Revision ID: 0008
+Revises: 0007
+Create Date: 2026-10-18 18:00:00.000000
+
+"""
+from datetime import datetime
+
+from alembic import op
+import sqlalchemy as sa
+
+from empyre_backend.utils import json_patch
+
+
+# revision identifiers, used by Alembic.
+revision = '0008'
+down_revision = '0007'
+branch_labels = None
+depends_on = None
+
+profiles = sa.table(
+    'profiles',
+    sa.column('id', sa.Integer),
+    sa.column('user_id', sa.String),
+    sa.column('profile_data', sa.JSON),
+    sa.column('plan_id', sa.Integer),
+    sa.column('plan_version', sa.Integer),
+)
+plans = sa.table(
+    'plans',
+    sa.column('id', sa.Integer),
+    sa.column('user_id', sa.String),
+    sa.column('plan_data', sa.JSON),
+    sa.column('version', sa.Integer),
+    sa.column('is_active', sa.Boolean),
+    sa.column('created_at', sa.DateTime),
+    sa.column('updated_at', sa.DateTime),
+)
+plan_revisions = sa.table(
+    'plan_revisions',
+    sa.column('plan_id', sa.Integer),
+    sa.column('version', sa.Integer),
+    sa.column('patch', sa.JSON),
+)
+
+
+def upgrade() -> None:
+    op.create_table(
+        'plan_revisions',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('plan_id', sa.Integer(), nullable=False),
+        sa.Column('version', sa.Integer(), nullable=False),
+        sa.Column('patch', sa.JSON(), nullable=False),
+        sa.Column('created_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('plan_id', 'version', name='uq_plan_revisions_plan_id_version'),
+    )
+    op.create_index('ix_plan_revisions_id', 'plan_revisions', ['id'])
+    with op.batch_alter_table('plans') as batch_op:
+        batch_op.add_column(sa.Column('version', sa.Integer(), server_default='1', nullable=False))
+    with op.batch_alter_table('profiles') as batch_op:
+        batch_op.add_column(sa.Column('plan_id', sa.Integer(), nullable=True))
+        batch_op.add_column(sa.Column('plan_version', sa.Integer(), nullable=True))
+
+    # 1. Move each profile's plan into `plans` as its active plan
+    bind = op.get_bind()
+    now = datetime.utcnow()
+    rows = bind.execute(sa.select(profiles.c.id, profiles.c.user_id, profiles.c.profile_data)).all()
+    for row in rows:
+        data = dict(row.profile_data or {})
+        plan = data.pop('plan', None)
+        if not plan:
+            continue
+        bind.execute(plans.update().where(plans.c.user_id == row.user_id).values(is_active=False))
+        plan_id = bind.execute(
+            plans.insert().values(
+                user_id=row.user_id, plan_data=plan, version=1, is_active=True, created_at=now, updated_at=now,
+            ).returning(plans.c.id)
+        ).scalar_one()
+        bind.execute(
+            profiles.update().where(profiles.c.id == row.id).values(
+                profile_data=data, plan_id=plan_id, plan_version=1,
+            )
+        )
+
+    # 2. Keep only each user's newest active plan before enforcing one per user
+    newest = sa.select(sa.func.max(plans.c.id)).where(plans.c.is_active.is_(True)).group_by(plans.c.user_id)
+    bind.execute(
+        plans.update().where(plans.c.is_active.is_(True), plans.c.id.not_in(newest)).values(is_active=False)
+    )
+    op.create_index(
+        'uq_plans_user_id_active', 'plans', ['user_id'], unique=True,
+        postgresql_where=sa.text('is_active'), sqlite_where=sa.text('is_active'),
+    )
+
+
+def downgrade() -> None:
+    # Put the latest version of each active plan back into the profile JSON
+    bind = op.get_bind()
+    rows = bind.execute(
+        sa.select(profiles.c.id, profiles.c.profile_data, profiles.c.plan_id, profiles.c.plan_version)
+        .where(profiles.c.plan_id.is_not(None))
+    ).all()
+    for row in rows:
+        plan = bind.execute(sa.select(plans.c.plan_data).where(plans.c.id == row.plan_id)).scalar_one_or_none()
+        if plan is None:
+            continue
+        patches = bind.execute(
+            sa.select(plan_revisions.c.patch)
+            .where(plan_revisions.c.plan_id == row.plan_id, plan_revisions.c.version <= row.plan_version)
+            .order_by(plan_revisions.c.version)
+        ).scalars().all()
+        for patch in patches:
+            plan = json_patch.apply(plan, patch)
+        data = {**(row.profile_data or {}), 'plan': plan}
+        bind.execute(profiles.update().where(profiles.c.id == row.id).values(profile_data=data))
+
+    op.drop_index('uq_plans_user_id_active', table_name='plans')
+    with op.batch_alter_table('profiles') as batch_op:
+        batch_op.drop_column('plan_version')
+        batch_op.drop_column('plan_id')
+    with op.batch_alter_table('plans') as batch_op:
+        batch_op.drop_column('version')
+    op.drop_index('ix_plan_revisions_id', table_name='plan_revisions')
+    op.drop_table('plan_revisions')
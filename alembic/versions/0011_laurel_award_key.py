@@ -0,0 +1,28 @@
+"""Award key on laurels so the engine awards each laurel once
+
+Revision ID: 0011
+Revises: 0010
+Create Date: 2026-10-19 10:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0011'
+down_revision = '0010'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    with op.batch_alter_table('laurels') as batch_op:
+        batch_op.add_column(sa.Column('award_key', sa.String(), nullable=True))
+        batch_op.create_unique_constraint('uq_laurels_user_id_award_key', ['user_id', 'award_key'])
+
+
+def downgrade() -> None:
+    with op.batch_alter_table('laurels') as batch_op:
+        batch_op.drop_constraint('uq_laurels_user_id_award_key', type_='unique')
+        batch_op.drop_column('award_key')
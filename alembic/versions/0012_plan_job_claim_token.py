@@ -0,0 +1,24 @@
+"""Claim token on plan jobs so an expired lease cannot overwrite a newer run
+
+Revision ID: 0012
+Revises: 0011
+Create Date: 2026-10-19 11:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '0012'
+down_revision = '0011'
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    op.add_column('plan_jobs', sa.Column('claim_token', sa.String(), nullable=True))
+
+
+def downgrade() -> None:
+    op.drop_column('plan_jobs', 'claim_token')
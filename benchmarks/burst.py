@@ -0,0 +1,143 @@
+"""
+Retry storm against /chat: rate limits and single-flight on vs off.
+
+Every simulated user is put in the optional-questions phase (each turn costs
+LLM calls), then sends --retries copies of the same message --gap-ms apart,
+the way an impatient client double-submits and retries, in --rounds rounds.
+Copies that overlap the first are coalesced; later ones spend the user's
+rate budget. The fake LLM is capped at --llm-concurrency slots so the storm
+really queues.
+
+Reported per configuration: LLM calls made, turns answered (200), shed (429
+with Retry-After) or failed (anything else, e.g. DB pool timeouts), latency
+of answered and shed turns, and the deepest LLM wait queue.
+
+    python -m benchmarks.burst --users 20 --retries 5 --gap-ms 300 --rounds 4 --latency-ms 300
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from typing import Dict, List
+
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{os.path.join(tempfile.mkdtemp(), 'burst.db')}"
+os.environ["LLM_BACKEND"] = "fake"
+os.environ.setdefault("LAUREL_ENGINE_MODE", "off")
+os.environ.setdefault("PREFETCH_ENABLED", "0")
+
+import httpx  # noqa: E402
+
+from empyre_backend.db import Base, get_engine  # noqa: E402
+from empyre_backend.main import app  # noqa: E402
+from empyre_backend.routers import chat  # noqa: E402
+from empyre_backend.services import llm_client, rate_limit  # noqa: E402
+
+CORE = {
+    "initial_goal": "build muscle", "knowledge_level": "beginner", "experience_years": "2",
+    "training_days_per_week": "3", "session_length_min": "60", "equipment_access": "full gym",
+    "auxiliary_opt_in": True,
+}
+
+
+class NoFlight:
+    """Single-flight switched off: every call runs"""
+
+    async def do(self, key, fn):
+        return await fn()
+
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(int(round(pct / 100 * (len(ordered) - 1))), len(ordered) - 1)]
+
+
+def configure(limited: bool) -> None:
+    rate_limit._users.clear()
+    rate_limit._models.clear()
+    if limited:
+        chat._turns = rate_limit.SingleFlight("coalesce")
+        rate_limit.RATE_LIMIT_USER_PER_MIN, rate_limit.RATE_LIMIT_USER_BURST = 30, 6
+        rate_limit._MODEL_RPM = {"*": 1200}
+        llm_client.LLM_MAX_QUEUE, llm_client.LLM_QUEUE_TIMEOUT_S = 32, 2
+    else:
+        chat._turns = NoFlight()
+        rate_limit.RATE_LIMIT_USER_PER_MIN = 0
+        rate_limit._MODEL_RPM = {}
+        llm_client.LLM_MAX_QUEUE, llm_client.LLM_QUEUE_TIMEOUT_S = 10 ** 6, 3600
+
+
+async def run_config(limited: bool, users: int, retries: int, rounds: int, latency_ms: float, gap_ms: float) -> Dict:
+    engine = get_engine()
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    backend = llm_client.FakeBackend(latency_ms=latency_ms)
+    llm_client.set_backend(backend)
+    configure(limited)
+
+    latencies: Dict[int, List[float]] = {}
+    deepest = 0
+
+    async def send(client: httpx.AsyncClient, user_id: str, message: str, patch=None) -> None:
+        nonlocal deepest
+        start = time.perf_counter()
+        body = {"user_id": user_id, "message": message, **({"profile_patch": patch} if patch else {})}
+        resp = await client.post("/chat", json=body)
+        latencies.setdefault(resp.status_code, []).append(time.perf_counter() - start)
+        deepest = max(deepest, llm_client.queue_depth())
+
+    async def resend(client: httpx.AsyncClient, user_id: str, message: str, delay: float) -> None:
+        await asyncio.sleep(delay)
+        await send(client, user_id, message)
+
+    async def simulate(client: httpx.AsyncClient, user: int) -> None:
+        user_id = f"burst{user}"
+        await send(client, user_id, "hi", CORE)
+        for turn in range(rounds):
+            message = f"answer {turn}: my left knee is sore after squats"
+            await asyncio.gather(*(resend(client, user_id, message, copy * gap_ms / 1000) for copy in range(retries)))
+
+    # Without limits the storm can exhaust the DB pool: count those as errors
+    transport = httpx.ASGITransport(app=app, raise_app_exceptions=False)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        start = time.perf_counter()
+        await asyncio.gather(*(simulate(client, user) for user in range(users)))
+        wall = time.perf_counter() - start
+    return {"calls": backend.calls, "latencies": latencies, "deepest": deepest, "wall": wall}
+
+
+async def run(users: int, retries: int, rounds: int, latency_ms: float, gap_ms: float, llm_concurrency: int) -> None:
+    llm_client.LLM_MAX_CONCURRENCY = llm_concurrency
+    llm_client._semaphore = None
+    print(f"users {users}  copies per message {retries} every {gap_ms:.0f} ms  rounds {rounds}  "
+          f"fake LLM {latency_ms:.0f} ms x {llm_concurrency} slots")
+    print(f"{'config':<10}{'LLM calls':>10}{'200s':>7}{'429s':>7}{'errors':>8}{'200 p50/p95 ms':>18}{'429 p95 ms':>12}"
+          f"{'max queue':>11}{'wall s':>8}")
+    for name, limited in (("off", False), ("limits", True)):
+        report = await run_config(limited, users, retries, rounds, latency_ms, gap_ms)
+        ok, shed = report["latencies"].pop(200, []), report["latencies"].pop(429, [])
+        failed = sum(len(values) for values in report["latencies"].values())
+        print(f"{name:<10}{report['calls']:>10}{len(ok):>7}{len(shed):>7}{failed:>8}"
+              f"{percentile(ok, 50) * 1000:>9.0f}/{percentile(ok, 95) * 1000:<8.0f}"
+              f"{percentile(shed, 95) * 1000:>12.0f}{report['deepest']:>11}{report['wall']:>8.1f}")
+    print(f"rate limit stats: {rate_limit.stats()}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--retries", type=int, default=5, help="copies of each message sent")
+    parser.add_argument("--gap-ms", type=float, default=300, help="pause between copies")
+    parser.add_argument("--rounds", type=int, default=4)
+    parser.add_argument("--latency-ms", type=float, default=300, help="fake LLM latency per call")
+    parser.add_argument("--llm-concurrency", type=int, default=8)
+    args = parser.parse_args()
+    asyncio.run(run(args.users, args.retries, args.rounds, args.latency_ms, args.gap_ms, args.llm_concurrency))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,76 @@
+"""
+Offline throughput check for the async LLM client layer.
+
+Fires N concurrent llm_client.complete calls against the fake backend and
+reports throughput plus the worst event-loop stall observed while they ran.
+Calls go straight to the client, past ai_coach's local fast paths, so every
+one takes a concurrency slot: with --concurrency C the wall time is about
+ceil(N / C) x latency. With a blocking client the stall equals the full LLM
+latency; with the async layer it stays near zero.
+
+    python -m benchmarks.llm_concurrency --users 200 --latency-ms 300
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import time
+
+# Measure the concurrency cap alone, not the per-model rate limit
+os.environ.setdefault("RATE_LIMIT_MODEL_RPM", "")
+
+from empyre_backend.services import llm_client  # noqa: E402
+
+MODEL = "gpt-4o-mini"
+
+
+async def _loop_lag(stop: asyncio.Event, interval: float = 0.01) -> float:
+    worst = 0.0
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        worst = max(worst, time.perf_counter() - start - interval)
+    return worst
+
+
+async def run(users: int, latency_ms: float, concurrency: int) -> None:
+    backend = llm_client.FakeBackend(latency_ms=latency_ms)
+    llm_client.set_backend(backend)
+    llm_client._semaphore = asyncio.Semaphore(concurrency)
+    # Every call waits its turn instead of being shed by the bounded queue
+    llm_client.LLM_MAX_QUEUE, llm_client.LLM_QUEUE_TIMEOUT_S = users, 3600
+
+    def messages(user: int):
+        return [{"role": "system", "content": "v1.0.aux_loop"},
+                {"role": "user", "content": json.dumps({"profile_json": {"user_id": f"u{user}"}})}]
+
+    stop = asyncio.Event()
+    lag_task = asyncio.create_task(_loop_lag(stop))
+
+    start = time.perf_counter()
+    await asyncio.gather(*(llm_client.complete(MODEL, messages(i), flow="benchmark") for i in range(users)))
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    worst_lag = await lag_task
+
+    print(f"calls:            {users} ({backend.calls} reached the backend)")
+    print(f"fake latency:     {latency_ms:.0f} ms")
+    print(f"concurrency cap:  {concurrency}")
+    print(f"wall time:        {elapsed:.2f} s")
+    print(f"throughput:       {users / elapsed:.1f} calls/s")
+    print(f"worst loop stall: {worst_lag * 1000:.1f} ms")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--latency-ms", type=float, default=250)
+    parser.add_argument("--concurrency", type=int, default=llm_client.LLM_MAX_CONCURRENCY)
+    args = parser.parse_args()
+    asyncio.run(run(args.users, args.latency_ms, args.concurrency))
+
+
+if __name__ == "__main__":
+    main()
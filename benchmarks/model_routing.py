@@ -0,0 +1,131 @@
+"""
+Model routing: a pinned model vs failover vs failover plus hedging.
+
+The fake primary model answers most calls in --latency-ms but a --tail-rate
+share takes --tail-ms, and an --error-rate share fails; the fake fallback
+model is steady at --fallback-ms. --calls question turns (aux_loop) run
+--concurrency at a time under each routing setup. Reported per setup:
+latency percentiles, failed turns, calls per model, hedges and LLM cost.
+
+    python -m benchmarks.model_routing --calls 400 --concurrency 16 --tail-rate 0.05 --error-rate 0.05
+"""
+
+import argparse
+import asyncio
+import logging
+import os
+import random
+import time
+from typing import Dict, List
+
+os.environ.setdefault("RATE_LIMIT_MODEL_RPM", "")
+
+from empyre_backend.services import ai_coach, llm_client, model_router  # noqa: E402
+from empyre_backend.services.model_router import Route  # noqa: E402
+
+PRIMARY, FALLBACK = "gpt-4o-mini", "gpt-4o"
+
+
+class FlakyBackend(llm_client.FakeBackend):
+    """The primary has a slow tail and fails now and then; the fallback is steady"""
+
+    def __init__(self, latency_ms: float, tail_ms: float, tail_rate: float, error_rate: float,
+                 fallback_ms: float, seed: int = 7):
+        super().__init__(latency_ms=0)
+        self.primary = (latency_ms, tail_ms, tail_rate, error_rate)
+        self.fallback_ms = fallback_ms
+        self.random = random.Random(seed)
+        self.per_model: Dict[str, int] = {}
+
+    async def complete(self, model, messages, temperature, timeout, json_mode=False):
+        self.per_model[model] = self.per_model.get(model, 0) + 1
+        if model == PRIMARY:
+            latency_ms, tail_ms, tail_rate, error_rate = self.primary
+            roll = self.random.random()
+            if roll < error_rate:
+                await asyncio.sleep(latency_ms / 1000)
+                raise RuntimeError("primary model error")
+            delay = tail_ms if roll < error_rate + tail_rate else latency_ms
+        else:
+            delay = self.fallback_ms
+        await asyncio.sleep(delay * self.random.uniform(0.8, 1.2) / 1000)
+        return await super().complete(model, messages, temperature, timeout, json_mode)
+
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(int(round(pct / 100 * (len(ordered) - 1))), len(ordered) - 1)]
+
+
+def configure(setup: str) -> None:
+    for state in (model_router._errors, model_router._latency, model_router._tallies, model_router._events):
+        state.clear()
+    if setup == "pinned":
+        model_router._ROUTES = {"*": Route(PRIMARY)}
+    else:
+        model_router._ROUTES = {"*": Route(PRIMARY, FALLBACK)}
+    model_router._HEDGE_FLOWS = frozenset({"aux_loop"}) if setup == "hedged" else frozenset()
+
+
+async def run_setup(setup: str, args) -> Dict:
+    backend = FlakyBackend(args.latency_ms, args.tail_ms, args.tail_rate, args.error_rate, args.fallback_ms)
+    llm_client.set_backend(backend)
+    configure(setup)
+    slots = asyncio.Semaphore(args.concurrency)
+    latencies: List[float] = []
+    failed = 0
+
+    async def turn(user: int) -> None:
+        nonlocal failed
+        async with slots:
+            start = time.perf_counter()
+            try:
+                await ai_coach.aux_loop({"initial_goal": "build muscle", "auxiliary_opt_in": True})
+            except Exception:
+                failed += 1
+                return
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(turn(user) for user in range(args.calls)))
+    events = model_router.events()
+    return {
+        "latencies": latencies, "failed": failed, "per_model": backend.per_model,
+        "hedged": events.get(("aux_loop", "hedged"), 0), "hedge_won": events.get(("aux_loop", "hedge_won"), 0),
+        "cost": sum(value for (_, _, stat), value in model_router.stats().items() if stat == "cost_usd"),
+    }
+
+
+async def run(args) -> None:
+    logging.getLogger(model_router.__name__).setLevel(logging.ERROR)  # one failover warning per injected error
+    llm_client.LLM_MAX_CONCURRENCY = args.concurrency * 2
+    llm_client._semaphore = None
+    print(f"calls {args.calls}  concurrency {args.concurrency}  primary {args.latency_ms:.0f} ms "
+          f"({args.tail_rate:.0%} at {args.tail_ms:.0f} ms, {args.error_rate:.0%} errors)  "
+          f"fallback {args.fallback_ms:.0f} ms")
+    print(f"{'setup':<10}{'p50 ms':>8}{'p95 ms':>8}{'p99 ms':>8}{'failed':>8}{'primary':>9}{'fallback':>10}"
+          f"{'hedged':>8}{'won':>6}{'cost $':>10}")
+    for setup in ("pinned", "failover", "hedged"):
+        report = await run_setup(setup, args)
+        ms = [percentile(report["latencies"], pct) * 1000 for pct in (50, 95, 99)]
+        print(f"{setup:<10}{ms[0]:>8.0f}{ms[1]:>8.0f}{ms[2]:>8.0f}{report['failed']:>8}"
+              f"{report['per_model'].get(PRIMARY, 0):>9}{report['per_model'].get(FALLBACK, 0):>10}"
+              f"{report['hedged']:>8}{report['hedge_won']:>6}{report['cost']:>10.4f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--calls", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--latency-ms", type=float, default=300, help="usual primary latency")
+    parser.add_argument("--tail-ms", type=float, default=4000, help="primary latency on a slow call")
+    parser.add_argument("--tail-rate", type=float, default=0.05)
+    parser.add_argument("--error-rate", type=float, default=0.05)
+    parser.add_argument("--fallback-ms", type=float, default=600)
+    args = parser.parse_args()
+    asyncio.run(run(args))
+
+
+if __name__ == "__main__":
+    main()
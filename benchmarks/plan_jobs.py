@@ -0,0 +1,109 @@
+"""
+Plan hand-over: generating in the request vs the background plan queue.
+
+Every simulated user finishes onboarding at the same moment (one turn whose
+profile patch declines the optional questions), thinks for --think-ms, then
+sends the next message. With PLAN_JOBS_MODE=off the plan-ready turn waits
+for generation itself; with the queue it answers at once and a worker (at
+most --concurrency generations at a time) builds the plan while the user
+thinks. Reported per mode: latency of both turns and the time from the
+plan-ready message to having the plan.
+
+    python -m benchmarks.plan_jobs --users 40 --latency-ms 1500 --think-ms 4000
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+from typing import Dict, List
+
+os.environ["DATABASE_URL"] = f"sqlite+aiosqlite:///{os.path.join(tempfile.mkdtemp(), 'plan_jobs.db')}"
+os.environ["LLM_BACKEND"] = "fake"
+os.environ.setdefault("LAUREL_ENGINE_MODE", "off")
+# Rate limits are measured by benchmarks/burst.py
+os.environ.setdefault("RATE_LIMIT_USER_PER_MIN", "0")
+os.environ.setdefault("RATE_LIMIT_MODEL_RPM", "")
+
+import httpx  # noqa: E402
+
+from empyre_backend.db import AsyncSessionLocal, Base, get_engine  # noqa: E402
+from empyre_backend.main import app  # noqa: E402
+from empyre_backend.services import llm_client, plan_jobs  # noqa: E402
+
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    return ordered[min(int(round(pct / 100 * (len(ordered) - 1))), len(ordered) - 1)]
+
+
+def ready_patch(user: int) -> Dict:
+    return {
+        "initial_goal": "build muscle", "knowledge_level": "beginner", "experience_years": f"{user} years",
+        "training_days_per_week": "3", "session_length_min": "60", "equipment_access": "full gym",
+        "auxiliary_opt_in": False, "plan_cache_opt_out": True,
+    }
+
+
+async def run_mode(mode: str, users: int, concurrency: int, latency_ms: float, think_ms: float) -> Dict:
+    engine = get_engine()
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(Base.metadata.create_all)
+    llm_client.set_backend(llm_client.FakeBackend(latency_ms=latency_ms))
+    plan_jobs.PLAN_JOBS_MODE = mode
+    plan_jobs.PLAN_JOBS_CONCURRENCY = concurrency
+    plan_jobs._slots = None
+    worker = asyncio.create_task(plan_jobs.run_worker(AsyncSessionLocal, poll_s=0.05)) if mode == "worker" else None
+
+    timings: Dict[str, List[float]] = {"ready_turn": [], "next_turn": [], "time_to_plan": []}
+
+    async def simulate(client: httpx.AsyncClient, user: int) -> None:
+        user_id = f"bench{user}"
+        start = time.perf_counter()
+        resp = await client.post("/chat", json={"user_id": user_id, "message": "ready", "profile_patch": ready_patch(user)})
+        timings["ready_turn"].append(time.perf_counter() - start)
+        while resp.json().get("type") != "plan":
+            await asyncio.sleep(think_ms / 1000)
+            turn = time.perf_counter()
+            resp = await client.post("/chat", json={"user_id": user_id, "message": "is it ready?"})
+            timings["next_turn"].append(time.perf_counter() - turn)
+        timings["time_to_plan"].append(time.perf_counter() - start)
+
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        await asyncio.gather(*(simulate(client, user) for user in range(users)))
+    if worker is not None:
+        worker.cancel()
+    return {
+        kind: {f"p{pct}": round(percentile(values, pct) * 1000) for pct in (50, 95)}
+        for kind, values in timings.items()
+    }
+
+
+async def run(users: int, concurrency: int, latency_ms: float, think_ms: float) -> None:
+    print(f"users {users}  pool {concurrency}  fake LLM latency {latency_ms:.0f} ms  think {think_ms:.0f} ms")
+    print(f"{'mode':<8}{'ready turn p50/p95':>22}{'next turn p50/p95':>22}{'time to plan p50/p95':>24}")
+    for mode in ("off", "worker"):
+        report = await run_mode(mode, users, concurrency, latency_ms, think_ms)
+        cells = "".join(f"{report[kind]['p50']:>11}/{report[kind]['p95']:<10}"
+                        for kind in ("ready_turn", "next_turn", "time_to_plan"))
+        print(f"{mode:<8}{cells}")
+    print(f"queue stats: {plan_jobs.stats()}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=40)
+    parser.add_argument("--concurrency", type=int, default=plan_jobs.PLAN_JOBS_CONCURRENCY)
+    parser.add_argument("--latency-ms", type=float, default=1500, help="fake LLM latency per call")
+    parser.add_argument("--think-ms", type=float, default=4000, help="pause before the next message")
+    args = parser.parse_args()
+    asyncio.run(run(args.users, args.concurrency, args.latency_ms, args.think_ms))
+
+
+if __name__ == "__main__":
+    main()
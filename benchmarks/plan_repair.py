@@ -0,0 +1,111 @@
+"""
+Plan validation: section repair vs full regeneration.
+
+The fake backend corrupts a share of plan completions the way real models
+fail: output cut off mid-split, a syntax error inside one day, out-of-range
+sets, or protein under the floor. Each plan is then finished two ways:
+
+  full    any failure regenerates the whole plan (the old behaviour, with retries)
+  repair  ai_coach.finish_plan: salvage, validate, regenerate only the bad sections
+
+and the LLM calls and completion tokens each strategy spent are reported.
+
+    python -m benchmarks.plan_repair --plans 500 --fault-rate 0.3
+"""
+
+import argparse
+import asyncio
+import json
+import random
+from typing import Dict
+
+from empyre_backend.services import ai_coach, llm_client, plan_schema
+
+PROFILE = {
+    "user_id": "bench", "initial_goal": "build muscle", "knowledge_level": "beginner",
+    "experience_years": "2", "training_days_per_week": "3", "session_length_min": "60",
+    "equipment_access": "full gym", "weight_kg": "80",
+}
+FAULTS = ("truncated", "syntax", "sets", "protein")
+
+
+def corrupt(reply: str, fault: str, rng: random.Random) -> str:
+    plan = json.loads(reply)
+    if fault == "sets":
+        day = rng.choice(list(plan["split"]["days"].values()))
+        day[0]["sets"] = 9
+    elif fault == "protein":
+        plan["meals"]["target_macros"]["protein_g"] = 40
+    text = json.dumps(plan, indent=2)
+    if fault == "truncated":
+        return text[:rng.randint(len(text) // 3, len(text) - 20)]
+    if fault == "syntax":
+        return text.replace('"reps": 8', '"reps": 8,,', 1)
+    return text
+
+
+class FaultyBackend(llm_client.FakeBackend):
+    """Fake backend that corrupts a share of plan completions and counts spend"""
+
+    def __init__(self, fault_rate: float, seed: int):
+        super().__init__()
+        self.fault_rate = fault_rate
+        self.rng = random.Random(seed)
+        self.spend: Dict[str, int] = {}
+
+    def _count(self, key: str, amount: int = 1) -> None:
+        self.spend[key] = self.spend.get(key, 0) + amount
+
+    async def complete(self, model, messages, temperature, timeout, json_mode=False):
+        result = await super().complete(model, messages, temperature, timeout, json_mode)
+        kind = "repair" if "v1.0.plan_repair" in messages[0]["content"] else "plan"
+        text = result.text
+        if kind == "plan" and self.rng.random() < self.fault_rate:
+            text = corrupt(text, self.rng.choice(FAULTS), self.rng)
+        self._count(f"{kind}_calls")
+        self._count("completion_tokens", len(text) // 4)
+        return llm_client.Completion(text, result.prompt_tokens, len(text) // 4)
+
+
+async def full_regeneration(max_attempts: int = 5) -> bool:
+    for _ in range(max_attempts):
+        _, issues = plan_schema.check_text(await ai_coach._plan_completion(PROFILE), PROFILE)
+        if not issues:
+            return True
+    return False
+
+
+async def section_repair() -> bool:
+    try:
+        await ai_coach.finish_plan(await ai_coach._plan_completion(PROFILE), PROFILE)
+        return True
+    except plan_schema.InvalidPlan:
+        return False
+
+
+async def run(plans: int, fault_rate: float, seed: int) -> None:
+    print(f"plans {plans}  fault rate {fault_rate:.0%}")
+    print(f"{'strategy':<10}{'plan calls':>12}{'repair calls':>14}{'tokens':>10}{'failed':>8}")
+    for name, strategy in (("full", full_regeneration), ("repair", section_repair)):
+        backend = FaultyBackend(fault_rate, seed)
+        llm_client.set_backend(backend)
+        failed = 0
+        for _ in range(plans):
+            failed += not await strategy()
+        spend = backend.spend
+        print(f"{name:<10}{spend.get('plan_calls', 0):>12}{spend.get('repair_calls', 0):>14}"
+              f"{spend.get('completion_tokens', 0):>10}{failed:>8}")
+    print(f"repair stats: {plan_schema.stats()}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--plans", type=int, default=500)
+    parser.add_argument("--fault-rate", type=float, default=0.3)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    asyncio.run(run(args.plans, args.fault_rate, args.seed))
+
+
+if __name__ == "__main__":
+    main()
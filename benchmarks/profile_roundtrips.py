@@ -0,0 +1,112 @@
+"""
+DB round trips per chat turn: the old get_or_create/apply_patch/save calls
+(kept below for comparison) vs ProfileSession.
+
+Runs against an in-memory SQLite database and counts SQL statements and
+commits issued for the profile part of one /chat turn (load, patch, save).
+
+    python -m benchmarks.profile_roundtrips
+"""
+
+import asyncio
+
+from typing import Any, Dict
+
+from sqlalchemy import event, select
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from empyre_backend.db import Base, Profile
+from empyre_backend.services import profile_service
+
+
+class RoundTripCounter:
+    def __init__(self, sync_engine):
+        self.statements = 0
+        self.commits = 0
+        event.listen(sync_engine, "before_cursor_execute", self._on_execute)
+        event.listen(sync_engine, "commit", self._on_commit)
+
+    def _on_execute(self, *args):
+        self.statements += 1
+
+    def _on_commit(self, *args):
+        self.commits += 1
+
+    def reset(self):
+        self.statements = 0
+        self.commits = 0
+
+
+# The profile_service calls /chat made before ProfileSession, one commit each
+async def get_or_create(user_id: str, db: AsyncSession) -> Dict[str, Any]:
+    result = await db.execute(select(Profile).where(Profile.user_id == user_id))
+    profile = result.scalar_one_or_none()
+    if not profile:
+        profile = Profile(user_id=user_id, profile_data={"user_id": user_id})
+        db.add(profile)
+        await db.commit()
+        await db.refresh(profile)
+    return profile.profile_data
+
+
+async def apply_patch(profile_data: Dict[str, Any], patch: Dict[str, Any], user_id: str, db: AsyncSession) -> Dict[str, Any]:
+    profile_data.update(patch)
+    result = await db.execute(select(Profile).where(Profile.user_id == user_id))
+    profile = result.scalar_one_or_none()
+    if profile:
+        profile.profile_data = profile_data
+        await db.commit()
+    return profile_data
+
+
+async def save(profile_data: Dict[str, Any], user_id: str, db: AsyncSession) -> None:
+    result = await db.execute(select(Profile).where(Profile.user_id == user_id))
+    profile = result.scalar_one_or_none()
+    if profile:
+        profile.profile_data = profile_data
+    else:
+        db.add(Profile(user_id=user_id, profile_data=profile_data))
+    await db.commit()
+
+
+async def legacy_turn(user_id: str, db: AsyncSession, turn: int) -> None:
+    profile = await get_or_create(user_id, db)
+    profile = await apply_patch(profile, {"weight_kg": 80 + turn}, user_id, db)
+    profile["pending_question"] = f"field_{turn}"
+    await save(profile, user_id, db)
+
+
+async def unit_of_work_turn(user_id: str, db: AsyncSession, turn: int) -> None:
+    session = await profile_service.load_session(user_id, db)
+    session.apply_patch({"weight_kg": 80 + turn})
+    session.pending_field = f"field_{turn}"
+    await session.commit()
+
+
+async def measure(name, turn, Session, counter) -> None:
+    user_id = f"{name}-user"
+    for turn_no, label in enumerate(("new user", "existing user")):
+        counter.reset()
+        async with Session() as db:
+            await turn(user_id, db, turn_no)
+        print(f"  {label:<14} statements={counter.statements}  commits={counter.commits}")
+
+
+async def main() -> None:
+    engine = create_async_engine("sqlite+aiosqlite://", poolclass=StaticPool)
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    Session = sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
+    counter = RoundTripCounter(engine.sync_engine)
+
+    print("legacy get_or_create/apply_patch/save:")
+    await measure("legacy", legacy_turn, Session, counter)
+    print("ProfileSession (load_session/commit):")
+    await measure("uow", unit_of_work_turn, Session, counter)
+    await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,71 @@
+"""
+Prompt tokens per ai_coach flow: full-profile json.dumps vs prompt_context.
+
+Uses a post-onboarding profile with a few auxiliary answers and a generated
+plan that has accumulated `--updates` rounds of tweak data. The legacy payload
+has the plan inside the profile JSON, where it used to be stored.
+
+    python -m benchmarks.prompt_tokens --updates 10
+"""
+
+import argparse
+import copy
+import json
+
+from empyre_backend.services import prompt_context
+from empyre_backend.services.llm_client import FAKE_PLAN
+
+
+def sample_plan(updates: int) -> dict:
+    plan = copy.deepcopy(FAKE_PLAN)
+    for i in range(updates):
+        plan["split"]["days"][f"Day {i % 3 + 1}"].append(
+            {"exercise": f"Accessory movement {i}", "sets": 3, "reps": 12,
+             "note": "Added after a tweak request; keep rest under 90 seconds."}
+        )
+        plan.setdefault("history", []).append({"tweak": i, "reason": "User asked for more arm work " * 3})
+    return plan
+
+
+def sample_profile() -> dict:
+    return {
+        "user_id": "bench",
+        "initial_goal": "build muscle",
+        "knowledge_level": "intermediate",
+        "experience_years": "3",
+        "training_days_per_week": "3",
+        "session_length_min": "60",
+        "equipment_access": "full gym",
+        "auxiliary_opt_in": True,
+        "injury_history": "Old left shoulder impingement, avoids behind-the-neck pressing",
+        "food_preferences": "Mostly plant-based, eats fish twice a week",
+    }
+
+
+def legacy_payload(flow: str, profile: dict, plan: dict, message: str) -> str:
+    profile = {**profile, "plan": plan}
+    if flow == "core_loop":
+        return json.dumps({"profile_json": profile, "knowledge_level": profile.get("knowledge_level")})
+    if flow == "aux_loop":
+        return json.dumps({"profile_json": profile, "auxiliary_opt_in": True})
+    if flow == "tweak_log":
+        return json.dumps({"profile_json": profile, "message": message})
+    return json.dumps({"profile_json": profile})
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--updates", type=int, default=10)
+    args = parser.parse_args()
+
+    profile, plan = sample_profile(), sample_plan(args.updates)
+    message = "swap squats for leg press on day 1"
+    print(f"{'flow':<10} {'before':>8} {'after':>8} {'saved':>7}")
+    for flow in ("core_loop", "aux_offer", "aux_loop", "plan_gen", "tweak_log"):
+        before = prompt_context.count_tokens(legacy_payload(flow, profile, plan, message))
+        after = prompt_context.count_tokens(prompt_context.render(flow, profile, message, plan=plan))
+        print(f"{flow:<10} {before:>8} {after:>8} {1 - after / before:>6.0%}")
+
+
+if __name__ == "__main__":
+    main()
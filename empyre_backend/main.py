@@ -1,31 +1,141 @@
-from fastapi import FastAPI
+"""
+The Empyre API: one app factory for every entry point.
+
+`create_app()` builds the app (CORS, metrics, the rate-limit handler and all
+routers) with a lifespan that starts the background workers and, on
+shutdown, drains in-flight LLM calls before closing the LLM and database
+pools. `app` is a ready-made instance for `uvicorn empyre_backend.main:app`
+and in-process benchmarks; production runs `python -m empyre_backend.server`.
+"""
+
+import asyncio
+import logging
+import math
+from contextlib import asynccontextmanager
+
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse, PlainTextResponse
+
+from empyre_backend.db import AsyncSessionLocal, dispose_engines, init_db, pool_stats
 from empyre_backend.routers.chat import router as chat_router
 from empyre_backend.routers.laurels import router as laurels_router
 from empyre_backend.routers.progress import router as progress_router
-from empyre_backend.db import init_db
+from empyre_backend.services import (
+    conversation_memory, laurel_engine, laurel_service, llm_client, model_router, plan_cache, plan_jobs,
+    plan_schema, plan_store, profile_service, prompt_context, question_prefetch, rate_limit, response_cache,
+)
+from empyre_backend.utils import metrics
+from empyre_backend.utils.settings import get_settings
 
-app = FastAPI(title="Empyre API", description="AI-powered fitness coaching platform")
+logger = logging.getLogger(__name__)
 
-# Add CORS middleware
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["http://localhost:3000", "http://127.0.0.1:3000"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+# Gauges are per process, shared by every app instance
+def _pool_gauge():
+    return {
+        (name, state): stats.get(state, 0)
+        for name, stats in pool_stats().items()
+        for state in ("checked_out", "checked_in", "overflow")
+    }
+
+metrics.gauge("empyre_db_pool_connections", "Pooled DB connections by state", ["engine", "state"], _pool_gauge)
+metrics.gauge("empyre_plan_cache_events", "Plan cache lookups and stores since start", ["event"],
+              lambda: {(event,): count for event, count in plan_cache.stats().items() if event != "hit_rate"})
+metrics.gauge("empyre_response_cache", "Tweak/log reply cache lookups, stores and entries", ["event"],
+              lambda: {(event,): count for event, count in response_cache.stats().items() if event != "hit_rate"})
+metrics.gauge("empyre_conversation_memory", "Conversation memory cache hits, misses, compactions and users", ["event"],
+              lambda: {(event,): count for event, count in conversation_memory.stats().items()})
+metrics.gauge("empyre_plan_validation", "Generated plans: first-pass valid, repaired, repair calls, full regenerations, failures",
+              ["event"], lambda: {(event,): count for event, count in plan_schema.stats().items()})
+metrics.gauge("empyre_plan_store", "Materialized plan cache hits and misses, plans and revisions stored",
+              ["event"], lambda: {(event,): count for event, count in plan_store.stats().items()})
+metrics.gauge("empyre_plan_jobs", "Background plan generation: queued, claimed, done, retried, failed, delivered",
+              ["event"], lambda: {(event,): count for event, count in plan_jobs.stats().items()})
+metrics.gauge("empyre_rate_limit", "Requests rejected, delayed or coalesced by the rate limits", ["scope", "outcome"],
+              rate_limit.stats)
+metrics.gauge("empyre_llm_queue_depth", "LLM calls waiting for a concurrency slot", [],
+              lambda: {(): llm_client.queue_depth()})
+metrics.gauge("empyre_llm_in_flight", "LLM calls running or waiting in this worker", [],
+              lambda: {(): llm_client.in_flight()})
+metrics.gauge("empyre_model_route", "LLM calls, errors, hedges cancelled, seconds, tokens, cost and live p95/error rate "
+              "per flow and model", ["flow", "model", "stat"], model_router.stats)
+metrics.gauge("empyre_model_route_events", "Failovers, reroutes away from unhealthy models, hedges and hedge wins",
+              ["flow", "event"], model_router.events)
+metrics.gauge("empyre_question_prefetch", "Speculative onboarding questions started, used and wasted", ["phase", "outcome"],
+              question_prefetch.stats)
 
-@app.on_event("startup")
-async def startup_event():
-    """Initialize database on startup"""
-    await init_db()
+async def rate_limited(request: Request, exc: rate_limit.RateLimited):
+    """Over capacity: fail fast and tell the client when to come back"""
+    return JSONResponse(
+        status_code=429,
+        content={"detail": str(exc), "scope": exc.scope},
+        headers={"Retry-After": str(max(math.ceil(exc.retry_after), 1))},
+    )
 
-# Include routers
-app.include_router(chat_router)
-app.include_router(laurels_router)
-app.include_router(progress_router)
+async def profile_conflict(request: Request, exc: profile_service.ProfileConflict):
+    """A turn lost the race to another turn for the same user on every attempt"""
+    return JSONResponse(status_code=409, content={"detail": str(exc)})
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start background workers; on shutdown stop them, drain LLM calls and close the pools"""
+    # 1. Startup; the schema comes from `alembic upgrade head`
+    if get_settings().db_create_all:
+        await init_db()
+    # tiktoken may download its BPE file: do it now, off the event loop
+    await asyncio.to_thread(prompt_context.load_tokenizer)
+    workers = []
+    if laurel_service.LEADERBOARD_RECONCILE_S > 0:
+        workers.append(asyncio.create_task(laurel_service.run_reconciler(AsyncSessionLocal)))
+    if laurel_engine.LAUREL_ENGINE_MODE == "worker":
+        workers.append(asyncio.create_task(laurel_engine.run_worker(AsyncSessionLocal)))
+    if plan_jobs.PLAN_JOBS_MODE == "worker":
+        workers.append(asyncio.create_task(plan_jobs.run_worker(AsyncSessionLocal)))
+    try:
+        yield
+    finally:
+        # 2. The server has finished in-flight requests; background calls may still be running
+        for task in workers:
+            task.cancel()
+        left = await llm_client.drain()
+        if left:
+            logger.warning("Shutting down with %d LLM calls still running", left)
+        await llm_client.aclose()
+        await dispose_engines()
+
+def create_app() -> FastAPI:
+    """Build the API; `uvicorn --factory empyre_backend.main:create_app` calls this once per worker"""
+    app = FastAPI(title="Empyre API", description="AI-powered fitness coaching platform", lifespan=lifespan)
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["http://localhost:3000", "http://127.0.0.1:3000"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+        expose_headers=["X-Next-Cursor", "Retry-After"],
+    )
+    app.add_middleware(metrics.MetricsMiddleware)
+    app.add_exception_handler(rate_limit.RateLimited, rate_limited)
+    app.add_exception_handler(profile_service.ProfileConflict, profile_conflict)
+
+    @app.get("/metrics", response_class=PlainTextResponse)
+    async def prometheus_metrics():
+        """Prometheus text format: HTTP, phase, DB and LLM metrics"""
+        return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+    @app.get("/health/db")
+    async def db_health():
+        """Connection pool usage; saturation near 1.0 means requests queue for connections"""
+        return pool_stats()
+
+    app.include_router(chat_router)
+    app.include_router(laurels_router)
+    app.include_router(progress_router)
+    return app
+
+app = create_app()
 
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000) 
\ No newline at end of file
+    from empyre_backend.server import main
+
+    main()
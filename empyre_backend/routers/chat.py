@@ -1,10 +1,25 @@
-from fastapi import APIRouter, Depends
+import json
+import logging
+import math
+from contextlib import aclosing
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, Response
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
+from sqlalchemy import select
 from sqlalchemy.ext.asyncio import AsyncSession
-from empyre_backend.services import ai_coach, profile_service
-from empyre_backend.db import get_db
+from empyre_backend.services import (
+    ai_coach, conversation_memory, conversation_state, plan_jobs, plan_schema, plan_store, profile_service,
+    question_prefetch, rate_limit,
+)
+from empyre_backend.services.conversation_state import Phase
+from empyre_backend.db import AsyncSessionLocal, ChatMessage, get_db, get_read_db
+from empyre_backend.utils.pagination import DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, finish_page, keyset_page
+from empyre_backend.utils.metrics import span
 
 router = APIRouter(prefix="/chat", tags=["chat"])
+logger = logging.getLogger(__name__)
 
 class ChatRequest(BaseModel):
     user_id: str
@@ -12,58 +27,247 @@ class ChatRequest(BaseModel):
     profile_patch: dict = None
 
 class ChatResponse(BaseModel):
-    type: str                # "question", "plan", or "confirmation"
+    type: str                # "question", "plan", "plan_pending" or "confirmation"
     field: str = None        # only for questions
     text: str = None
-    plan: dict = None        # only for plans
+    plan: dict = None        # only for plans and plan tweaks
 
-@router.post("", response_model=ChatResponse)
-async def chat(req: ChatRequest, db: AsyncSession = Depends(get_db)):
-    # 1. Load or init profile
-    profile = await profile_service.get_or_create(req.user_id, db)
+async def _start_turn(req: ChatRequest, db: AsyncSession) -> profile_service.ProfileSession:
+    """Load the profile, apply any patch, and record the answer to the pending question"""
+    # 1. Load or init profile (no lock: the final commit checks the version read here)
+    with span("profile_load"):
+        session = await profile_service.load_session(req.user_id, db)
 
     # 2. Apply any incoming patch (for manual updates)
     if req.profile_patch:
-        profile = await profile_service.apply_patch(profile, req.profile_patch, req.user_id, db)
+        with span("patch"):
+            conversation_state.apply_patch(session, req.profile_patch)
 
     # 3. If we have a pending question, try to extract the answer from the message
-    if profile.get("pending_question") and req.message:
-        # Handle auxiliary opt-in specially
-        if profile.get("pending_question") == "auxiliary_opt_in":
-            if "yes" in req.message.lower() or "sure" in req.message.lower() or "ok" in req.message.lower():
-                profile["auxiliary_opt_in"] = True
-            else:
-                profile["auxiliary_opt_in"] = False
-            profile.pop("pending_question", None)
+    #    (the next question is speculatively generated meanwhile)
+    if session.pending_field and req.message:
+        if session.pending_field == conversation_state.OPT_IN_FIELD:
+            conversation_state.record_opt_in(session, req.message)
         else:
-            # Extract answer from user's message for other fields
-            answer = await ai_coach.extract_answer(profile.get("pending_question"), req.message)
+            question_prefetch.on_answer(session, req.message)
+            with span("extract"):
+                answer = await ai_coach.extract_answer(session.pending_field, req.message)
             if answer:
-                profile[profile.get("pending_question")] = answer
-                profile.pop("pending_question", None)  # Clear the pending question
-
-    # 4. Decide which AI flow to run
-    if not profile_service.is_core_complete(profile):
-        resp = await ai_coach.core_loop(profile)
-        # Mark the field as pending for next response
-        if resp.get("type") == "question":
-            profile["pending_question"] = resp.get("field")
-    elif profile.get("auxiliary_opt_in") is None:
-        resp = await ai_coach.aux_offer(profile)
-        # Mark auxiliary_opt_in as pending
-        profile["pending_question"] = "auxiliary_opt_in"
-    elif profile.get("auxiliary_opt_in") and not profile_service.is_aux_complete(profile):
-        resp = await ai_coach.aux_loop(profile)
-        # Mark the field as pending for next response
-        if resp.get("type") == "question":
-            profile["pending_question"] = resp.get("field")
-    elif not profile_service.has_plan(profile):
-        resp = await ai_coach.generate_plan_flow(profile)
-    else:
-        resp = await ai_coach.handle_tweak_or_log(profile, req.message)
-
-    # 5. Persist updates
-    await profile_service.save(profile, req.user_id, db)
+                conversation_state.record_answer(session, answer)
+            else:
+                question_prefetch.discard(req.user_id, "unanswered")
+
+    question_prefetch.settle(session)
+    return session
+
+async def _core_loop(session: profile_service.ProfileSession, message: str) -> dict:
+    resp = await question_prefetch.take(session) or await ai_coach.core_loop(session.data)
+    if resp.get("type") == "question":
+        conversation_state.ask(session, resp.get("field"))
+    return resp
+
+async def _aux_offer(session: profile_service.ProfileSession, message: str) -> dict:
+    resp = await question_prefetch.take(session) or await ai_coach.aux_offer(session.data)
+    conversation_state.ask(session, conversation_state.OPT_IN_FIELD)
+    question_prefetch.after_offer(session)
+    return resp
+
+async def _aux_loop(session: profile_service.ProfileSession, message: str) -> dict:
+    resp = await question_prefetch.take(session) or await ai_coach.aux_loop(session.data)
+    if resp.get("type") == "question":
+        conversation_state.ask(session, resp.get("field"))
+    return resp
+
+async def _plan_gen(session: profile_service.ProfileSession, message: str) -> dict:
+    try:
+        if plan_jobs.PLAN_JOBS_MODE == "off":
+            resp = await ai_coach.generate_plan_flow(session.data)
+        else:
+            # Generated in the background; handed over on the next message
+            resp = await plan_jobs.take(session)
+            if resp is None:
+                return plan_jobs.pending_reply()
+    except plan_schema.InvalidPlan as exc:
+        raise HTTPException(status_code=502, detail=f"Plan failed validation: {exc}")
+    await plan_store.create(session, resp["plan"])
+    conversation_state.plan_ready(session)
+    return resp
+
+async def _tweak_log(session: profile_service.ProfileSession, message: str) -> dict:
+    memory = await conversation_memory.load(session)
+    plan = await plan_store.load(session)
+    await session.release()
+    resp = await ai_coach.handle_tweak_or_log(session.data, plan, message, memory.context(), session.user_id)
+    # A tweak is stored as a patch revision; the updated plan goes back to the client
+    updated = await plan_store.apply_update(session, resp.pop("plan_update", None))
+    if updated is not None:
+        resp["plan"] = updated
+    return resp
+
+FLOWS = {
+    Phase.CORE_LOOP: _core_loop,
+    Phase.AUX_OFFER: _aux_offer,
+    Phase.AUX_LOOP: _aux_loop,
+    Phase.PLAN_GEN: _plan_gen,
+    Phase.TWEAK_LOG: _tweak_log,
+}
+
+async def _run_flow(session: profile_service.ProfileSession, message: str) -> dict:
+    """Run the AI flow for the session's current phase and return its response"""
+    return await FLOWS[conversation_state.current(session)](session, message)
+
+async def _finish_turn(session: profile_service.ProfileSession, req: ChatRequest, resp: dict,
+                       background_tasks: BackgroundTasks) -> None:
+    """Store the exchange and persist the turn in one write, then compact memory if due"""
+    conversation_memory.record(session, req.message, resp.get("text"))
+    with span("save"):
+        await session.commit()
+    if conversation_memory.needs_compaction(session):
+        background_tasks.add_task(conversation_memory.compact, AsyncSessionLocal, req.user_id)
+    if resp.get("type") == "plan_pending" and plan_jobs.PLAN_JOBS_MODE == "inline":
+        background_tasks.add_task(plan_jobs.run_pending, AsyncSessionLocal)
+
+# Identical turns in flight at once (client retries, double submits) run once
+_turns = rate_limit.SingleFlight("coalesce")
+
+@router.post("", response_model=ChatResponse)
+async def chat(req: ChatRequest, background_tasks: BackgroundTasks, db: AsyncSession = Depends(get_db)):
+    patch = json.dumps(req.profile_patch, sort_keys=True) if req.profile_patch else None
+    return await _turns.do((req.user_id, req.message, patch), lambda: _chat_turn(req, background_tasks, db))
+
+async def _chat_turn(req: ChatRequest, background_tasks: BackgroundTasks, db: AsyncSession) -> ChatResponse:
+    rate_limit.check_user(req.user_id)
+    for attempt in range(1, profile_service.PROFILE_TURN_ATTEMPTS + 1):
+        session = await _start_turn(req, db)
+        try:
+            # 4. Decide which AI flow to run (plan writes may already find a concurrent turn's rows)
+            with span("flow"):
+                resp = await _run_flow(session, req.message)
+
+            # 5. Persist updates (and the exchange) in one write; if another turn for
+            #    this user committed first, nothing was written and the turn runs again
+            await _finish_turn(session, req, resp, background_tasks)
+            break
+        except profile_service.ProfileConflict:
+            if attempt == profile_service.PROFILE_TURN_ATTEMPTS:
+                raise
 
     # 6. Return the AI response object
-    return ChatResponse(**resp) 
\ No newline at end of file
+    return ChatResponse(**resp)
+
+def _sse(event: str, data) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+@router.post("/stream")
+async def chat_stream(req: ChatRequest, background_tasks: BackgroundTasks):
+    """
+    Server-Sent Events variant of /chat. Plan generation runs inside the request
+    (unless a background job is already queued for the profile) and streams
+    `token` events as the model writes and a `section` event for each completed
+    plan part (split type, each Day N, meals, notes); every turn ends with one
+    `message` event carrying the usual ChatResponse, then `done`. A failed turn
+    ends with an `error` event instead.
+    """
+    rate_limit.check_user(req.user_id)
+
+    async def events():
+        # The session is owned by the generator so it outlives the handler
+        async with AsyncSessionLocal() as db:
+            try:
+                session = await _start_turn(req, db)
+                # The client is waiting on an open stream, so the plan is built here rather than queued
+                stream_plan = conversation_state.current(session) is Phase.PLAN_GEN and (
+                    plan_jobs.PLAN_JOBS_MODE == "off" or not await plan_jobs.queued(session)
+                )
+                if stream_plan:
+                    with span("flow"):
+                        async with aclosing(ai_coach.stream_plan_flow(session.data)) as plan_events:
+                            async for kind, payload in plan_events:
+                                if kind == "result":
+                                    resp = payload
+                                else:
+                                    yield _sse(kind, payload)
+                    if plan_jobs.PLAN_JOBS_MODE != "off":
+                        await plan_jobs.discard(session)
+                    await plan_store.create(session, resp["plan"])
+                    conversation_state.plan_ready(session)
+                else:
+                    with span("flow"):
+                        resp = await _run_flow(session, req.message)
+                # The final plan is persisted once, after the stream completes
+                await _finish_turn(session, req, resp, background_tasks)
+            except rate_limit.RateLimited as exc:
+                # Headers are already sent: the retry hint travels in the event
+                yield _sse("error", {"detail": str(exc), "scope": exc.scope,
+                                     "retry_after": max(math.ceil(exc.retry_after), 1)})
+                return
+            except profile_service.ProfileConflict as exc:
+                # Events may already be out, so the turn is not re-run here
+                yield _sse("error", {"detail": str(exc), "scope": "conflict"})
+                return
+            except HTTPException as exc:
+                yield _sse("error", {"detail": exc.detail})
+                return
+            except plan_schema.InvalidPlan as exc:
+                yield _sse("error", {"detail": f"Plan failed validation: {exc}"})
+                return
+            except Exception:
+                # Internal errors stay in the log; the client only learns that the turn failed
+                logger.exception("Streamed chat turn failed for %s", req.user_id)
+                yield _sse("error", {"detail": "Something went wrong on our side; please try again"})
+                return
+        yield _sse("message", ChatResponse(**resp).model_dump(exclude_none=True))
+        yield _sse("done", {})
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+class PhaseCountsResponse(BaseModel):
+    stuck_minutes: Optional[int] = None
+    phases: Dict[str, int]
+
+@router.get("/phases", response_model=PhaseCountsResponse)
+async def phase_counts(
+    stuck_minutes: Optional[int] = Query(None, ge=0, description="Only users who entered their phase at least this long ago"),
+    db: AsyncSession = Depends(get_read_db),
+):
+    """Users per conversation phase, e.g. how many are stuck in aux_loop"""
+    stuck_for = timedelta(minutes=stuck_minutes) if stuck_minutes is not None else None
+    phases = await conversation_state.phase_counts(db, stuck_for)
+    return PhaseCountsResponse(stuck_minutes=stuck_minutes, phases=phases)
+
+class ChatMessageResponse(BaseModel):
+    id: int
+    role: str
+    content: str
+    created_at: datetime
+
+@router.get("/{user_id}/history", response_model=List[ChatMessageResponse])
+async def get_history(
+    user_id: str,
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Page size"),
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor header from the previous page"),
+    db: AsyncSession = Depends(get_read_db),
+):
+    """Get a page of a user's chat messages, newest first"""
+    query = select(ChatMessage).where(ChatMessage.user_id == user_id)
+    result = await db.execute(keyset_page(query, ChatMessage, cursor, limit))
+    return finish_page(result.scalars().all(), ["id", "role", "content", "created_at"], limit, response)
+
+class PlanResponse(BaseModel):
+    plan_id: int
+    version: int
+    plan: dict
+
+@router.get("/{user_id}/plan", response_model=PlanResponse)
+async def get_plan(user_id: str, db: AsyncSession = Depends(get_read_db)):
+    """Get the user's active plan with every tweak applied"""
+    active = await plan_store.active_plan(user_id, db)
+    if active is None:
+        raise HTTPException(status_code=404, detail="No plan yet")
+    plan_id, version, plan = active
+    return PlanResponse(plan_id=plan_id, version=version, plan=plan)
@@ -1,30 +1,57 @@
-from fastapi import APIRouter, Depends, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Response
 from pydantic import BaseModel
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
-from empyre_backend.db import get_db, Laurel
-from typing import List
+from empyre_backend.db import get_db, get_read_db, Laurel
+from empyre_backend.services import laurel_service
+from empyre_backend.utils.helpers import naive_utc
+from empyre_backend.utils.pagination import (
+    DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, finish_page, keyset_page, parse_fields,
+)
+from typing import List, Optional
 from datetime import datetime
 
 router = APIRouter(prefix="/laurels", tags=["laurels"])
 
 class LaurelResponse(BaseModel):
-    id: int
-    user_id: str
-    laurel_type: str
-    points: int
-    description: str
-    created_at: datetime
+    # Optional so `fields=` projections can omit any of them
+    id: Optional[int] = None
+    user_id: Optional[str] = None
+    laurel_type: Optional[str] = None
+    points: Optional[int] = None
+    description: Optional[str] = None
+    created_at: Optional[datetime] = None
 
     class Config:
         from_attributes = True
 
-@router.get("/{user_id}", response_model=List[LaurelResponse])
-async def get_laurels(user_id: str, db: AsyncSession = Depends(get_db)):
-    """Get all laurels for a user"""
-    result = await db.execute(select(Laurel).where(Laurel.user_id == user_id))
-    laurels = result.scalars().all()
-    return laurels
+LAUREL_FIELDS = ["id", "user_id", "laurel_type", "points", "description", "created_at"]
+
+@router.get("/{user_id}", response_model=List[LaurelResponse], response_model_exclude_unset=True)
+async def get_laurels(
+    user_id: str,
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Page size"),
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor header from the previous page"),
+    laurel_type: Optional[str] = Query(None, description="Only laurels of this type"),
+    since: Optional[datetime] = Query(None, description="Only laurels awarded at or after this time"),
+    until: Optional[datetime] = Query(None, description="Only laurels awarded before this time"),
+    fields: Optional[str] = Query(None, description="Comma-separated fields to return"),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """Get a page of laurels for a user, newest first"""
+    selected = parse_fields(fields, LAUREL_FIELDS)
+    # id and created_at are always read to build the next cursor
+    columns = [getattr(Laurel, f) for f in dict.fromkeys([*selected, "id", "created_at"])]
+    query = select(*columns).where(Laurel.user_id == user_id)
+    if laurel_type:
+        query = query.where(Laurel.laurel_type == laurel_type)
+    if since:
+        query = query.where(Laurel.created_at >= naive_utc(since))
+    if until:
+        query = query.where(Laurel.created_at < naive_utc(until))
+    result = await db.execute(keyset_page(query, Laurel, cursor, limit))
+    return finish_page(result.all(), selected, limit, response)
 
 @router.post("/{user_id}/award")
 async def award_laurel(
@@ -35,13 +62,48 @@ async def award_laurel(
     db: AsyncSession = Depends(get_db)
 ):
     """Award a laurel to a user"""
-    laurel = Laurel(
-        user_id=user_id,
-        laurel_type=laurel_type,
-        points=points,
-        description=description
-    )
-    db.add(laurel)
-    await db.commit()
-    await db.refresh(laurel)
-    return {"message": "Laurel awarded!", "laurel": laurel} 
\ No newline at end of file
+    laurel = await laurel_service.award(user_id, laurel_type, points, description, db)
+    return {"message": "Laurel awarded!", "laurel": laurel}
+
+class ArenaEntry(BaseModel):
+    user_id: str
+    points: int
+    rank: int         # competition rank (ties share a rank)
+    position: int     # 1-based position in the ordered board
+
+class ArenaStanding(BaseModel):
+    user_id: str
+    points: int
+    rank: int
+    total_users: int
+
+@router.get("/arena/top", response_model=List[ArenaEntry])
+async def arena_top(
+    limit: int = Query(100, ge=1, le=1000, description="Number of legionaries"),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """Arena leaderboard: top users by laurel points"""
+    board = await laurel_service.ensure_leaderboard(db)
+    return board.top(limit)
+
+@router.get("/arena/rank/{user_id}", response_model=ArenaStanding)
+async def arena_rank(user_id: str, db: AsyncSession = Depends(get_read_db)):
+    """A user's points and rank in the Arena"""
+    board = await laurel_service.ensure_leaderboard(db)
+    rank = board.rank(user_id)
+    if rank is None:
+        raise HTTPException(status_code=404, detail="User has no laurels yet")
+    return ArenaStanding(user_id=user_id, points=board.points(user_id), rank=rank, total_users=len(board))
+
+@router.get("/arena/around/{user_id}", response_model=List[ArenaEntry])
+async def arena_around(
+    user_id: str,
+    radius: int = Query(5, ge=0, le=50, description="Neighbors on each side"),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """The slice of the leaderboard around a user"""
+    board = await laurel_service.ensure_leaderboard(db)
+    entries = board.around(user_id, radius)
+    if not entries:
+        raise HTTPException(status_code=404, detail="User has no laurels yet")
+    return entries
@@ -1,10 +1,16 @@
-from fastapi import APIRouter, Depends
+import json
+from fastapi import APIRouter, BackgroundTasks, Depends, HTTPException, Query, Request, Response
 from pydantic import BaseModel
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
-from empyre_backend.db import get_db, ProgressLog
-from typing import List, Dict, Any
-from datetime import datetime
+from empyre_backend.db import get_db, get_read_db, AsyncSessionLocal, ProgressLog
+from empyre_backend.services import laurel_engine, progress_service
+from empyre_backend.utils.helpers import naive_utc
+from empyre_backend.utils.pagination import (
+    DEFAULT_PAGE_SIZE, MAX_PAGE_SIZE, finish_page, keyset_page, parse_fields,
+)
+from typing import List, Dict, Any, Optional
+from datetime import date, datetime
 
 router = APIRouter(prefix="/progress", tags=["progress"])
 
@@ -14,14 +20,23 @@ class ProgressLogRequest(BaseModel):
     log_data: Dict[str, Any]
 
 class ProgressLogResponse(BaseModel):
-    id: int
-    user_id: str
-    log_type: str
-    log_data: Dict[str, Any]
-    created_at: datetime
+    # Optional so `fields=` projections can omit any of them
+    id: Optional[int] = None
+    user_id: Optional[str] = None
+    log_type: Optional[str] = None
+    log_data: Optional[Dict[str, Any]] = None
+    created_at: Optional[datetime] = None
+
+PROGRESS_FIELDS = ["id", "user_id", "log_type", "log_data", "created_at"]
+ANALYTICS_MAX_WEEKS = 104
+
+def _schedule_laurels(background_tasks: BackgroundTasks, log_ids: List[int]) -> None:
+    """Run the laurel engine on new logs after the response is sent"""
+    if laurel_engine.LAUREL_ENGINE_MODE == "inline" and log_ids:
+        background_tasks.add_task(laurel_engine.process_log_ids, AsyncSessionLocal, log_ids)
 
 @router.post("", response_model=ProgressLogResponse)
-async def log_progress(req: ProgressLogRequest, db: AsyncSession = Depends(get_db)):
+async def log_progress(req: ProgressLogRequest, background_tasks: BackgroundTasks, db: AsyncSession = Depends(get_db)):
     """Log progress (workout, measurements, etc.)"""
     progress_log = ProgressLog(
         user_id=req.user_id,
@@ -31,11 +46,148 @@ async def log_progress(req: ProgressLogRequest, db: AsyncSession = Depends(get_d
     db.add(progress_log)
     await db.commit()
     await db.refresh(progress_log)
+    if progress_log.log_type == "workout":
+        _schedule_laurels(background_tasks, [progress_log.id])
     return progress_log
 
-@router.get("/{user_id}", response_model=List[ProgressLogResponse])
-async def get_progress(user_id: str, db: AsyncSession = Depends(get_db)):
-    """Get all progress logs for a user"""
-    result = await db.execute(select(ProgressLog).where(ProgressLog.user_id == user_id).order_by(ProgressLog.created_at.desc()))
-    logs = result.scalars().all()
-    return logs 
\ No newline at end of file
+class BatchIngestResponse(BaseModel):
+    created: int
+    duplicates: int
+    invalid: int
+    failed: int = 0
+    items: List[progress_service.ItemResult]
+
+async def _read_batch(request: Request) -> List[Any]:
+    """Parse a JSON array body, or an NDJSON stream one line at a time"""
+    content_type = request.headers.get("content-type", "")
+    items: List[Any] = []
+    if "ndjson" in content_type or "jsonlines" in content_type:
+        buffer = b""
+        async for chunk in request.stream():
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                if line.strip():
+                    items.append(_parse_line(line))
+            if len(items) > progress_service.PROGRESS_BATCH_MAX_ITEMS:
+                break
+        if buffer.strip():
+            items.append(_parse_line(buffer))
+    else:
+        try:
+            items = json.loads(await request.body())
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Body must be a JSON array or NDJSON")
+        if not isinstance(items, list):
+            raise HTTPException(status_code=400, detail="Body must be a JSON array or NDJSON")
+    if len(items) > progress_service.PROGRESS_BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=413,
+            detail=f"At most {progress_service.PROGRESS_BATCH_MAX_ITEMS} logs per batch",
+        )
+    return items
+
+def _parse_line(line: bytes) -> Any:
+    try:
+        return json.loads(line)
+    except ValueError:
+        # Reported as an invalid item rather than failing the whole sync
+        return None
+
+@router.post("/batch", response_model=BatchIngestResponse)
+async def log_progress_batch(request: Request, background_tasks: BackgroundTasks,
+                             db: AsyncSession = Depends(get_db)):
+    """
+    Bulk-log progress from a wearable or offline sync. Accepts a JSON array or
+    an NDJSON stream (Content-Type: application/x-ndjson) of ProgressLogItem.
+    Items with an idempotency_key already stored for that user are reported as
+    "duplicate" with the original id, so replays are safe; "failed" items should
+    be sent again.
+    """
+    raw_items = await _read_batch(request)
+    valid, invalid = progress_service.validate_items(raw_items)
+    created = await progress_service.ingest_batch(valid, db) if valid else []
+    items = sorted(created + invalid, key=lambda r: r.index)
+    _schedule_laurels(background_tasks, [r.id for r in created if r.status == "created"])
+    return BatchIngestResponse(
+        created=sum(1 for r in items if r.status == "created"),
+        duplicates=sum(1 for r in items if r.status == "duplicate"),
+        invalid=len(invalid),
+        failed=sum(1 for r in items if r.status == "failed"),
+        items=items,
+    )
+
+@router.get("/{user_id}", response_model=List[ProgressLogResponse], response_model_exclude_unset=True)
+async def get_progress(
+    user_id: str,
+    response: Response,
+    limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE, description="Page size"),
+    cursor: Optional[str] = Query(None, description="X-Next-Cursor header from the previous page"),
+    log_type: Optional[str] = Query(None, description="Only logs of this type"),
+    since: Optional[datetime] = Query(None, description="Only logs created at or after this time"),
+    until: Optional[datetime] = Query(None, description="Only logs created before this time"),
+    fields: Optional[str] = Query(None, description="Comma-separated fields to return, e.g. id,log_type,created_at"),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """Get a page of progress logs for a user, newest first"""
+    selected = parse_fields(fields, PROGRESS_FIELDS)
+    # id and created_at are always read to build the next cursor
+    columns = [getattr(ProgressLog, f) for f in dict.fromkeys([*selected, "id", "created_at"])]
+    query = select(*columns).where(ProgressLog.user_id == user_id)
+    if log_type:
+        query = query.where(ProgressLog.log_type == log_type)
+    if since:
+        query = query.where(ProgressLog.created_at >= naive_utc(since))
+    if until:
+        query = query.where(ProgressLog.created_at < naive_utc(until))
+    result = await db.execute(keyset_page(query, ProgressLog, cursor, limit))
+    return finish_page(result.all(), selected, limit, response)
+
+class E1rmPoint(BaseModel):
+    date: date
+    e1rm: float
+
+class ExerciseTrend(BaseModel):
+    best: float
+    latest: float
+    trend_per_week: Optional[float] = None  # e1RM change per week (least squares)
+    points: List[E1rmPoint]
+
+class MeasurementPoint(BaseModel):
+    date: date
+    value: float
+    moving_average: float
+
+class MeasurementTrend(BaseModel):
+    latest: float
+    moving_average: float
+    change: float  # moving-average change across the window
+    points: List[MeasurementPoint]
+
+class Adherence(BaseModel):
+    planned_per_week: Optional[int] = None
+    completed: List[int]  # distinct training days per week
+    rate: Optional[float] = None
+
+class ProgressAnalyticsResponse(BaseModel):
+    user_id: str
+    weeks: int
+    week_starts: List[date]
+    weekly_volume: Dict[str, List[float]]  # muscle group -> volume per week
+    weekly_sets: Dict[str, List[int]]
+    e1rm: Dict[str, ExerciseTrend]
+    measurements: Dict[str, MeasurementTrend]
+    adherence: Adherence
+
+@router.get("/{user_id}/analytics", response_model=ProgressAnalyticsResponse)
+async def get_progress_analytics(
+    user_id: str,
+    weeks: int = Query(12, ge=1, le=ANALYTICS_MAX_WEEKS, description="Weeks to report, ending this week"),
+    window: int = Query(7, ge=1, le=90, description="Measurements per moving average"),
+    db: AsyncSession = Depends(get_read_db)
+):
+    """Weekly volume per muscle group, e1RM trends, measurement averages and plan adherence"""
+    # Imported here so NumPy stays off the worker start-up path
+    from empyre_backend.services import analytics
+
+    return await analytics.progress_report(user_id, db, weeks=weeks, window=window)
@@ -0,0 +1,81 @@
+# empyre_backend/server.py
+"""
+Production entry point: python -m empyre_backend.server [--workers N]
+
+Runs SERVER_WORKERS uvicorn worker processes on one socket, each building its
+own app through `main.create_app`. The event loop and HTTP parser are uvloop
+and httptools when installed (`uvicorn[standard]` in requirements.txt).
+
+On SIGTERM/SIGINT each worker stops accepting connections, gives in-flight
+requests up to SERVER_GRACEFUL_TIMEOUT_S to finish, then runs the app's
+shutdown: background LLM calls get LLM_DRAIN_TIMEOUT_S more before the LLM
+client and the database pools are closed.
+
+DB_CREATE_ALL (development only) runs once here, before any worker starts,
+so workers never race each other creating tables.
+"""
+
+import argparse
+import asyncio
+import os
+
+from empyre_backend.utils.settings import env, get_settings, reset_settings
+
+SERVER_HOST = env("SERVER_HOST", "0.0.0.0")
+SERVER_PORT = int(env("SERVER_PORT", "8000"))
+SERVER_WORKERS = int(env("SERVER_WORKERS", str(os.cpu_count() or 1)))
+SERVER_LOOP = env("SERVER_LOOP", "auto")  # "auto" picks uvloop when installed
+SERVER_HTTP = env("SERVER_HTTP", "auto")  # "auto" picks httptools when installed
+SERVER_GRACEFUL_TIMEOUT_S = int(env("SERVER_GRACEFUL_TIMEOUT_S", "30"))
+SERVER_KEEPALIVE_S = int(env("SERVER_KEEPALIVE_S", "5"))
+SERVER_BACKLOG = int(env("SERVER_BACKLOG", "2048"))
+SERVER_ACCESS_LOG = env("SERVER_ACCESS_LOG", "false").lower() == "true"
+FORWARDED_ALLOW_IPS = env("FORWARDED_ALLOW_IPS", "127.0.0.1")
+
+
+def prepare_database() -> None:
+    """Create missing tables once in the parent, then stop workers from doing it again"""
+    if not get_settings().db_create_all:
+        return
+    from empyre_backend.db import dispose_engines, init_db
+
+    async def create() -> None:
+        try:
+            await init_db()
+        finally:
+            await dispose_engines()
+
+    asyncio.run(create())
+    os.environ["DB_CREATE_ALL"] = "false"
+    reset_settings()
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="Run the Empyre API")
+    parser.add_argument("--host", default=SERVER_HOST)
+    parser.add_argument("--port", type=int, default=SERVER_PORT)
+    parser.add_argument("--workers", type=int, default=SERVER_WORKERS)
+    args = parser.parse_args(argv)
+
+    import uvicorn
+
+    prepare_database()
+    uvicorn.run(
+        "empyre_backend.main:create_app",
+        factory=True,
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        loop=SERVER_LOOP,
+        http=SERVER_HTTP,
+        timeout_graceful_shutdown=SERVER_GRACEFUL_TIMEOUT_S,
+        timeout_keep_alive=SERVER_KEEPALIVE_S,
+        backlog=SERVER_BACKLOG,
+        access_log=SERVER_ACCESS_LOG,
+        proxy_headers=True,
+        forwarded_allow_ips=FORWARDED_ALLOW_IPS,
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,29 @@
 # AI coach service
 
 import json
-from typing import Union
-from openai import OpenAI
-from empyre_backend.utils.helpers import get_openai_key
+from contextlib import aclosing
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple, Union
+from empyre_backend.services import (
+    llm_client, model_router, onboarding_rules, plan_cache, plan_schema, plan_stream, prompt_context,
+    response_cache,
+)
 
-# Initialize your OpenAI client
-client = OpenAI(api_key=get_openai_key())
+def extract_locally(field: str, message: str) -> Optional[str]:
+    """Fast path: a confident local parse of a core field, or None when the LLM is needed"""
+    if onboarding_rules.ONBOARDING_FAST_PATH:
+        local = onboarding_rules.extract(field, message)
+        if local.value is not None and local.confidence >= onboarding_rules.ONBOARDING_CONFIDENCE_THRESHOLD:
+            return local.value
+    return None
 
 async def extract_answer(field: str, message: str) -> str:
     """Extract structured answer from user message for a specific field"""
+    local = extract_locally(field, message)
+    if local is not None:
+        return local
+
     system_prompt = f"""
-You are an AI assistant that extracts structured answers from user messages.
+v1.0.extract — You are an AI assistant that extracts structured answers from user messages.
 
 Field: {field}
 User message: {message}
@@ -29,18 +41,18 @@ Examples:
 Return the extracted value only.
 """
     
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
+    content = await model_router.complete(
         messages=[
             {"role": "system", "content": system_prompt},
             {"role": "user", "content": f"Extract the answer for field '{field}' from: {message}"}
         ],
         temperature=0.1,
+        flow="extract",
     )
     
-    return response.choices[0].message.content.strip()
+    return content.strip()
 
-def generate_plan(profile_json: dict, raw: bool = False) -> Union[dict, str]:
+async def generate_plan(profile_json: dict, raw: bool = False) -> Union[dict, str]:
     """
     v1.0.plan_gen — You are Empyre, the AI fitness coach. Based on this user profile, generate a complete
     workout split and meal plan in JSON, adhering to all dynamic guardrails:
@@ -71,25 +83,27 @@ Output only valid JSON matching this schema:
   "notes": "<optional summary or disclaimer>"
 }
 """
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
+    content = await model_router.complete(
         messages=[
             {"role": "system",  "content": system_prompt},
             {"role": "user",    "content": f"Profile: {json.dumps(profile_json)}\nGenerate plan now."}
         ],
         temperature=0.7,
+        timeout=llm_client.LLM_PLAN_TIMEOUT_S,
+        flow="plan",
+        json_mode=True,
     )
-    content = response.choices[0].message.content
     if raw:
         return content
-    try:
-        return json.loads(content)
-    except Exception:
-        return {"error": "Invalid AI response"}
-
-import asyncio
+    return await finish_plan(content, profile_json)
 
 async def core_loop(profile: dict) -> dict:
+    # Fast path: core questions are templated locally, no LLM round trip
+    if onboarding_rules.ONBOARDING_FAST_PATH:
+        question = onboarding_rules.next_question(profile)
+        if question is not None:
+            return question
+
     system_prompt = """
 v1.0.core_loop — You are Empyre, the AI fitness coach. You help users by asking one profile question at a time until all core fields are collected.
 Core fields (in order): 
@@ -115,15 +129,15 @@ Your job:
        "text":"<your question here>"
      }
 """
-    response = client.chat.completions.create(
-        model="gpt-4",
+    content = await model_router.complete(
         messages=[
             {"role": "system", "content": system_prompt},
-            {"role": "user", "content": json.dumps({"profile_json": profile, "knowledge_level": profile.get("knowledge_level")})}
+            {"role": "user", "content": prompt_context.render("core_loop", profile)}
         ],
         temperature=0.7,
+        flow="core_loop",
     )
-    return json.loads(response.choices[0].message.content)
+    return json.loads(content)
 
 async def aux_offer(profile: dict) -> dict:
     system_prompt = """
@@ -143,15 +157,15 @@ Your job:
        "text":"<your personalized yes/no prompt>"
      }
 """
-    response = client.chat.completions.create(
-        model="gpt-4",
+    content = await model_router.complete(
         messages=[
             {"role": "system", "content": system_prompt},
-            {"role": "user", "content": json.dumps({"profile_json": profile})}
+            {"role": "user", "content": prompt_context.render("aux_offer", profile)}
         ],
         temperature=0.7,
+        flow="aux_offer",
     )
-    return json.loads(response.choices[0].message.content)
+    return json.loads(content)
 
 async def aux_loop(profile: dict) -> dict:
     system_prompt = """
@@ -175,21 +189,17 @@ Your job:
   6. If the user has already answered several auxiliary questions, you may propose a custom field that could further refine their plan.
   7. Be creative and adaptive - think like a human coach who tailors their approach to each individual.
 """
-    response = client.chat.completions.create(
-        model="gpt-4",
+    content = await model_router.complete(
         messages=[
             {"role": "system", "content": system_prompt},
-            {"role": "user", "content": json.dumps({
-                "profile_json": profile,
-                "auxiliary_opt_in": True
-            })}
+            {"role": "user", "content": prompt_context.render("aux_loop", profile)}
         ],
         temperature=0.7,
+        flow="aux_loop",
     )
-    return json.loads(response.choices[0].message.content)
+    return json.loads(content)
 
-async def generate_plan_flow(profile: dict) -> dict:
-    system_prompt = """
+PLAN_FLOW_PROMPT = """
 v1.0.plan_gen — You are Empyre, the AI fitness coach. Based on this user profile, generate a complete workout split and meal plan in JSON, adhering to all dynamic guardrails:
 
 1. Caloric deficit ≤ 40% of TDEE (never below BMR).
@@ -215,27 +225,155 @@ Output only valid JSON matching this schema:
   "notes": "<optional summary or disclaimer>"
 }
 """
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
+
+PLAN_REPAIR_PROMPT = """
+v1.0.plan_repair — You are Empyre, the AI fitness coach. Some sections of a generated plan failed validation. Regenerate ONLY those sections, consistent with the rest of the plan.
+
+When called, you will receive:
+  • profile_json: the user's profile
+  • plan: a compact summary of the sections that passed (day → "exercise setsxreps", macros)
+  • sections: each section to regenerate, with what was wrong with it
+
+Rules:
+  • Every exercise has 1–6 sets and 1–25 reps.
+  • Protein ≥1.2 g/kg and fats ≥0.25 g/kg of body weight.
+  • Don't duplicate a training day that is already in the plan.
+
+Output only a JSON object with one key per requested section:
+  • "Day N": [ { "exercise": "<name>", "sets": <int>, "reps": <int> }, … ]
+  • "meals": { "target_macros": { "protein_g": <number>, "carbs_g": <number>, "fats_g": <number> }, "sample_day": { "Meal 1": "<description>", … } }
+  • "split_type": "<string>"
+"""
+
+async def _plan_completion(profile: dict) -> str:
+    return await model_router.complete(
         messages=[
-            {"role": "system", "content": system_prompt},
-            {"role": "user", "content": json.dumps({"profile_json": profile})}
+            {"role": "system", "content": PLAN_FLOW_PROMPT},
+            {"role": "user", "content": prompt_context.render("plan_gen", profile)}
         ],
         temperature=0.7,
+        timeout=llm_client.LLM_PLAN_TIMEOUT_S,
+        flow="plan",
+        json_mode=True,
     )
-    content = response.choices[0].message.content
-    plan = json.loads(content)
-    # store on profile so has_plan() returns True
-    profile["plan"] = plan
+
+async def repair_plan_sections(profile: dict, plan: dict, issues: plan_schema.Issues) -> Dict[str, Any]:
+    """Regenerate only the named plan sections; returns {section name: new value}"""
+    payload = {
+        "profile_json": prompt_context.build("plan_gen", profile)["profile_json"],
+        "plan": prompt_context.summarize_plan(plan),
+        "sections": issues,
+    }
+    content = await model_router.complete(
+        messages=[
+            {"role": "system", "content": PLAN_REPAIR_PROMPT},
+            {"role": "user", "content": json.dumps(payload)}
+        ],
+        temperature=0.4,
+        timeout=llm_client.LLM_PLAN_TIMEOUT_S,
+        flow="plan_repair",
+        json_mode=True,
+    )
+    try:
+        fixes = json.loads(content)
+    except ValueError:
+        return {}
+    return {name: value for name, value in fixes.items() if name in issues} if isinstance(fixes, dict) else {}
+
+async def finish_plan(content: str, profile: dict) -> dict:
+    """
+    Validate a plan completion and repair just its invalid sections. The plan
+    is regenerated in full only when too little of it survives to repair.
+    """
+    plan_schema.record("plans")
+    for attempt in range(plan_schema.PLAN_MAX_REGENERATIONS + 1):
+        if attempt:
+            plan_schema.record("regenerations")
+            content = await _plan_completion(profile)
+        plan, issues = plan_schema.check_text(content, profile)
+        if not issues:
+            plan_schema.record("valid_first_pass" if not attempt else "repaired")
+            return plan
+        for _ in range(plan_schema.PLAN_REPAIR_ATTEMPTS):
+            if not plan_schema.repairable(plan, issues):
+                break
+            plan_schema.record("repair_calls")
+            fixes = await repair_plan_sections(profile, plan, issues)
+            plan, new_issues = plan_schema.validate(plan_schema.merge(plan, fixes), profile)
+            plan_schema.record("sections_repaired", len([name for name in fixes if name not in new_issues]))
+            issues = {**{name: problem for name, problem in issues.items() if name not in fixes}, **new_issues}
+            if not issues:
+                plan_schema.record("repaired")
+                return plan
+    plan_schema.record("failed")
+    raise plan_schema.InvalidPlan(issues)
+
+async def generate_plan_flow(profile: dict) -> dict:
+    cached = await plan_cache.lookup(profile)
+    if cached is not None:
+        return {"type": "plan", "plan": cached, "text": "Here's your personalized plan!"}
+
+    plan = await finish_plan(await _plan_completion(profile), profile)
+    await plan_cache.store(profile, plan)
     return {"type": "plan", "plan": plan, "text": "Here's your personalized plan!"}
 
-async def handle_tweak_or_log(profile: dict, message: str) -> dict:
+async def stream_plan_flow(profile: dict) -> AsyncIterator[Tuple[str, Any]]:
+    """
+    Streaming variant of generate_plan_flow. Yields ("token", text) for every
+    delta, ("section", {"name", "value"}) as each plan section completes, and
+    finally ("result", response) with the same shape generate_plan_flow returns.
+    Sections that fail validation are repaired after the stream ends and sent
+    again, so a later "section" event replaces an earlier one of the same name.
+    """
+    cached = await plan_cache.lookup(profile)
+    if cached is not None:
+        for name, value in plan_stream.sections(cached):
+            yield "section", {"name": name, "value": value}
+        yield "result", {"type": "plan", "plan": cached, "text": "Here's your personalized plan!"}
+        return
+
+    parser: Optional[plan_stream.IncrementalPlanParser] = plan_stream.IncrementalPlanParser(lenient=True)
+    chunks: List[str] = []
+    streamed: Dict[str, Any] = {}
+    deltas = model_router.stream(
+        messages=[
+            {"role": "system", "content": PLAN_FLOW_PROMPT},
+            {"role": "user", "content": prompt_context.render("plan_gen", profile)}
+        ],
+        temperature=0.7,
+        timeout=llm_client.LLM_PLAN_TIMEOUT_S,
+        flow="plan",
+        json_mode=True,
+    )
+    async with aclosing(deltas):  # A client that disconnects closes the model stream too
+        async for delta in deltas:
+            yield "token", delta
+            chunks.append(delta)
+            try:
+                parsed = parser.feed(delta) if parser is not None else []
+            except (ValueError, AttributeError, IndexError):
+                parser, parsed = None, []  # Malformed document: stop emitting, finish_plan salvages
+            for name, value in parsed:
+                streamed[name] = value
+                yield "section", {"name": name, "value": value}
+    plan = await finish_plan("".join(chunks), profile)
+    # Re-send the sections that repair replaced or added
+    for name, value in plan_stream.sections(plan):
+        if streamed.get(name) != value:
+            yield "section", {"name": name, "value": value}
+    await plan_cache.store(profile, plan)
+    yield "result", {"type": "plan", "plan": plan, "text": "Here's your personalized plan!"}
+
+async def handle_tweak_or_log(profile: dict, plan: Optional[dict], message: str,
+                              history: Optional[Dict[str, Any]] = None, user_id: Optional[str] = None) -> dict:
     """Handle plan tweaks and workout logging after plan is generated"""
     system_prompt = """
 v1.0.tweak_log — You are Empyre, the AI fitness coach. The user has a complete plan and is now requesting modifications or logging workouts.
 
 When called, you will receive:
-  • profile_json: the user's complete profile with plan
+  • profile_json: the user's profile
+  • plan: a compact summary of their current plan (day → "exercise setsxreps", macros)
+  • history: optional; a summary of the earlier conversation and the most recent messages, oldest first
   • message: user's request for tweak or log
 
 Your job:
@@ -246,19 +384,51 @@ Your job:
      {
        "type": "confirmation",
        "text": "<your response>",
-       "plan_update": { /* optional plan modifications */ }
+       "plan_update": { /* optional plan modifications, see below */ }
      }
+     plan_update holds only the sections the user's request changes, each with its full new value:
+     "Day N" → [{"exercise": str, "sets": int, "reps": int}, ...] (null removes the day),
+     "meals" → {"target_macros": {...}, "sample_day": {...}}, "split_type" → str, "notes" → str.
+     Leave it empty for workout logs and questions.
   5. Keep the Roman legion theme in your responses
 """
-    response = client.chat.completions.create(
-        model="gpt-4o-mini",
+    # Replies are cached per user, so an anonymous call always goes to the model
+    cached = response_cache.lookup(user_id, message, plan, history) if user_id else None
+    if cached is not None:
+        return cached
+
+    content = await model_router.complete(
         messages=[
             {"role": "system", "content": system_prompt},
-            {"role": "user", "content": json.dumps({
-                "profile_json": profile,
-                "message": message
-            })}
+            {"role": "user", "content": prompt_context.render("tweak_log", profile, message, history, plan)}
         ],
         temperature=0.7,
+        flow="tweak_log",
+    )
+    resp = json.loads(content)
+    if user_id:
+        response_cache.store(user_id, message, plan, resp, history)
+    return resp
+
+async def summarize_conversation(summary: str, messages: List[Tuple[str, str]]) -> str:
+    """Fold older chat messages into the running conversation summary"""
+    system_prompt = """
+v1.0.summarize — You maintain the memory of Empyre, the AI fitness coach, for one user.
+
+When called, you will receive:
+  • summary: the current summary of the conversation so far (may be empty)
+  • messages: older messages to fold in, oldest first, as [role, content]
+
+Return ONLY the updated summary as plain text, at most 150 words. Keep what matters for
+coaching: goals, injuries and limits, preferences, plan changes agreed, workouts logged
+and how they went. Drop greetings and small talk.
+"""
+    content = await model_router.complete(
+        messages=[
+            {"role": "system", "content": system_prompt},
+            {"role": "user", "content": json.dumps({"summary": summary, "messages": messages})}
+        ],
+        temperature=0.2,
+        flow="summarize",
     )
-    return json.loads(response.choices[0].message.content) 
\ No newline at end of file
+    return content.strip()
@@ -0,0 +1,339 @@
+# empyre_backend/services/analytics.py
+"""
+Progress analytics over a user's workout and measurement logs.
+
+Logs are flattened once into per-user columnar NumPy arrays (one row per
+set, one row per measurement) and every report is computed with vectorized
+operations over those columns: bincount for weekly volume, reduceat for
+daily best e1RM, cumsum for moving averages. The arrays are cached per user
+and extended incrementally with only the logs whose id is above the last one
+seen; computed reports are cached alongside and dropped whenever new logs
+arrive. Ids can commit out of order, so the user's stored log count is
+checked as well and the extract is rebuilt when a log appeared below the
+last id seen.
+"""
+
+import math
+from collections import OrderedDict
+from datetime import date, datetime, timedelta
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from empyre_backend.db import Profile, ProgressLog
+from empyre_backend.services import plan_store
+from empyre_backend.services.workout_log import iter_sets, normalize_exercise
+from empyre_backend.utils.settings import env
+
+ANALYTICS_CACHE_MAX_USERS = int(env("ANALYTICS_CACHE_MAX_USERS", "1000"))
+
+SECONDS_PER_DAY = 86400
+
+# First match wins, so more specific groups come first ("leg raise" is core,
+# "romanian deadlift" is legs, plain "deadlift" is back)
+MUSCLE_GROUPS: List[Tuple[str, Tuple[str, ...]]] = [
+    ("core", ("plank", "crunch", "sit up", "situp", "leg raise", "ab wheel", "russian twist")),
+    ("legs", ("squat", "lunge", "leg ", "calf", "romanian", "rdl", "hip thrust", "glute", "step up")),
+    ("chest", ("bench", "chest", "push up", "pushup", "fly", "flye", "dip", "incline", "decline")),
+    ("back", ("row", "pull up", "pullup", "chin up", "pulldown", "deadlift", "shrug", "pullover")),
+    ("shoulders", ("overhead", "ohp", "shoulder", "military", "lateral raise", "face pull", "arnold")),
+    ("arms", ("curl", "tricep", "skull", "extension", "kickback")),
+]
+OTHER_GROUP = "other"
+GROUP_NAMES = [name for name, _ in MUSCLE_GROUPS] + [OTHER_GROUP]
+
+
+def muscle_group(exercise: str) -> str:
+    padded = exercise + " "
+    for group, keywords in MUSCLE_GROUPS:
+        if any(keyword in padded for keyword in keywords):
+            return group
+    return OTHER_GROUP
+
+
+def _measurements(log_data: Dict[str, Any]) -> List[Tuple[str, float]]:
+    """{"metric": "weight", "value": 80} or {"weight": 80, "waist_cm": 84}; NaN, inf and huge ints are dropped"""
+    if not isinstance(log_data, dict):
+        return []
+    if "metric" in log_data and "value" in log_data:
+        items = [(log_data["metric"], log_data["value"])]
+    else:
+        items = list(log_data.items())
+    values = []
+    for name, value in items:
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            try:
+                number = float(value)
+            except OverflowError:
+                continue
+            if math.isfinite(number):
+                values.append((normalize_exercise(name), number))
+    return values
+
+
+class UserSeries:
+    """Columnar extract of one user's logs"""
+
+    def __init__(self):
+        self.last_log_id = 0
+        self.log_count = 0
+        self.exercises: Dict[str, int] = {}
+        self.exercise_groups: List[int] = []
+        self.metrics: Dict[str, int] = {}
+        # One row per set
+        self.set_ts = np.empty(0, dtype=np.int64)
+        self.set_exercise = np.empty(0, dtype=np.int32)
+        self.set_weight = np.empty(0, dtype=np.float64)
+        self.set_reps = np.empty(0, dtype=np.float64)
+        # One row per workout log, for adherence
+        self.workout_ts = np.empty(0, dtype=np.int64)
+        # One row per measured value
+        self.measure_ts = np.empty(0, dtype=np.int64)
+        self.measure_metric = np.empty(0, dtype=np.int32)
+        self.measure_value = np.empty(0, dtype=np.float64)
+        self.reports: Dict[Tuple[Any, ...], Dict[str, Any]] = {}
+
+    def _code(self, table: Dict[str, int], name: str) -> int:
+        code = table.get(name)
+        if code is None:
+            code = table[name] = len(table)
+            if table is self.exercises:
+                self.exercise_groups.append(GROUP_NAMES.index(muscle_group(name)))
+        return code
+
+    def append(self, rows: List[Tuple[int, datetime, str, Dict[str, Any]]]) -> int:
+        """Add (id, created_at, log_type, log_data) rows not seen yet; returns rows added"""
+        rows = [row for row in rows if row[0] > self.last_log_id]
+        if not rows:
+            return 0
+        set_cols: List[List[Any]] = [[], [], [], []]
+        workout_ts, measure_cols = [], [[], [], []]
+        for log_id, created_at, log_type, log_data in rows:
+            ts = int((created_at - datetime(1970, 1, 1)).total_seconds())
+            if log_type == "workout":
+                workout_ts.append(ts)
+                for exercise, weight, reps in iter_sets(log_data):
+                    for column, value in zip(set_cols, (ts, self._code(self.exercises, exercise), weight, reps)):
+                        column.append(value)
+            elif log_type == "measurement":
+                for metric, value in _measurements(log_data):
+                    for column, item in zip(measure_cols, (ts, self._code(self.metrics, metric), value)):
+                        column.append(item)
+
+        self.set_ts = np.concatenate([self.set_ts, np.array(set_cols[0], dtype=np.int64)])
+        self.set_exercise = np.concatenate([self.set_exercise, np.array(set_cols[1], dtype=np.int32)])
+        self.set_weight = np.concatenate([self.set_weight, np.array(set_cols[2], dtype=np.float64)])
+        self.set_reps = np.concatenate([self.set_reps, np.array(set_cols[3], dtype=np.float64)])
+        self.workout_ts = np.concatenate([self.workout_ts, np.array(workout_ts, dtype=np.int64)])
+        self.measure_ts = np.concatenate([self.measure_ts, np.array(measure_cols[0], dtype=np.int64)])
+        self.measure_metric = np.concatenate([self.measure_metric, np.array(measure_cols[1], dtype=np.int32)])
+        self.measure_value = np.concatenate([self.measure_value, np.array(measure_cols[2], dtype=np.float64)])
+        self.last_log_id = max(row[0] for row in rows)
+        self.log_count += len(rows)
+        self.reports.clear()  # New logs invalidate every computed report
+        return len(rows)
+
+
+_series: "OrderedDict[str, UserSeries]" = OrderedDict()
+_stats = {"hits": 0, "misses": 0, "rows_loaded": 0, "rebuilds": 0}
+
+
+def stats() -> Dict[str, int]:
+    return {**_stats, "users": len(_series)}
+
+
+def clear() -> None:
+    _series.clear()
+
+
+def _get_series(user_id: str) -> UserSeries:
+    series = _series.get(user_id)
+    if series is None:
+        series = _series[user_id] = UserSeries()
+    _series.move_to_end(user_id)
+    while len(_series) > ANALYTICS_CACHE_MAX_USERS:
+        _series.popitem(last=False)
+    return series
+
+
+async def load_series(user_id: str, db: AsyncSession) -> UserSeries:
+    """Return the user's columnar extract, fetching only logs newer than the cached ones"""
+    series = _get_series(user_id)
+    scope = (ProgressLog.user_id == user_id, ProgressLog.log_type.in_(["workout", "measurement"]))
+    # 1. Counted first, so a log committing meanwhile can only make the extract look newer
+    stored = (await db.execute(select(func.count()).select_from(ProgressLog).where(*scope))).scalar_one()
+
+    # 2. Logs above the last id seen
+    result = await db.execute(
+        select(ProgressLog.id, ProgressLog.created_at, ProgressLog.log_type, ProgressLog.log_data)
+        .where(*scope, ProgressLog.id > series.last_log_id)
+        .order_by(ProgressLog.id)
+    )
+    _stats["rows_loaded"] += series.append(result.all())
+
+    # 3. More logs stored than seen: one committed late below last_log_id, so start over
+    if stored > series.log_count:
+        _stats["rebuilds"] += 1
+        series = _series[user_id] = UserSeries()
+        result = await db.execute(
+            select(ProgressLog.id, ProgressLog.created_at, ProgressLog.log_type, ProgressLog.log_data)
+            .where(*scope)
+            .order_by(ProgressLog.id)
+        )
+        _stats["rows_loaded"] += series.append(result.all())
+    return series
+
+
+async def planned_days_per_week(user_id: str, db: AsyncSession) -> Optional[int]:
+    """Training days in the active plan (tweaks included), falling back to the profile's answers"""
+    active = await plan_store.active_plan(user_id, db)
+    split = active[2].get("split") if active else None
+    days = split.get("days") if isinstance(split, dict) else None
+    if isinstance(days, (dict, list)) and days:
+        return len(days)
+    profile_data = (await db.execute(
+        select(Profile.profile_data).where(Profile.user_id == user_id)
+    )).scalar_one_or_none() or {}
+    try:
+        return int(profile_data["training_days_per_week"]) or None
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def _monday(day: date) -> date:
+    return day - timedelta(days=day.weekday())
+
+
+def _day_of(ts: np.ndarray) -> np.ndarray:
+    return ts // SECONDS_PER_DAY
+
+
+def _as_date(day_number: int) -> date:
+    return date(1970, 1, 1) + timedelta(days=int(day_number))
+
+
+def weekly_volume(series: UserSeries, first_day: int, weeks: int) -> Tuple[Dict[str, List[float]], Dict[str, List[int]]]:
+    """Volume (weight x reps) and set count per muscle group per week"""
+    week = (_day_of(series.set_ts) - first_day) // 7
+    mask = (week >= 0) & (week < weeks)
+    groups = np.asarray(series.exercise_groups, dtype=np.int64)[series.set_exercise[mask]] \
+        if series.exercise_groups else np.empty(0, dtype=np.int64)
+    flat = groups * weeks + week[mask]
+    size = len(GROUP_NAMES) * weeks
+    volume = np.bincount(flat, weights=(series.set_weight * series.set_reps)[mask], minlength=size)
+    sets = np.bincount(flat, minlength=size)
+    volume, sets = volume.reshape(len(GROUP_NAMES), weeks), sets.reshape(len(GROUP_NAMES), weeks)
+    active = np.flatnonzero(sets.sum(axis=1))
+    return (
+        {GROUP_NAMES[g]: np.round(volume[g], 1).tolist() for g in active},
+        {GROUP_NAMES[g]: sets[g].tolist() for g in active},
+    )
+
+
+def e1rm_trends(series: UserSeries, first_day: int) -> Dict[str, Dict[str, Any]]:
+    """Daily best estimated 1RM per loaded exercise, with a least-squares slope per week"""
+    reps = series.set_reps
+    e1rm = np.where(reps <= 1, series.set_weight, series.set_weight * (1 + reps / 30))
+    day = _day_of(series.set_ts)
+    mask = (series.set_weight > 0) & (day >= first_day)
+    if not mask.any():
+        return {}
+    exercise, day, e1rm = series.set_exercise[mask], day[mask], e1rm[mask]
+    order = np.lexsort((day, exercise))
+    exercise, day, e1rm = exercise[order], day[order], e1rm[order]
+    # One (exercise, day) group per run of equal keys
+    starts = np.flatnonzero(np.r_[True, (exercise[1:] != exercise[:-1]) | (day[1:] != day[:-1])])
+    best = np.maximum.reduceat(e1rm, starts)
+    exercise, day = exercise[starts], day[starts]
+
+    names = {code: name for name, code in series.exercises.items()}
+    trends = {}
+    bounds = np.flatnonzero(np.r_[True, exercise[1:] != exercise[:-1], True])
+    for lo, hi in zip(bounds[:-1], bounds[1:]):
+        days, values = day[lo:hi], best[lo:hi]
+        slope = float(np.polyfit(days, values, 1)[0]) * 7 if len(days) > 1 else None
+        trends[names[int(exercise[lo])]] = {
+            "best": round(float(values.max()), 1),
+            "latest": round(float(values[-1]), 1),
+            "trend_per_week": round(slope, 2) if slope is not None else None,
+            "points": [{"date": _as_date(d), "e1rm": round(float(v), 1)} for d, v in zip(days, values)],
+        }
+    return trends
+
+
+def moving_averages(series: UserSeries, first_day: int, window: int) -> Dict[str, Dict[str, Any]]:
+    """Trailing `window`-entry moving average per measurement metric"""
+    if not len(series.measure_ts):
+        return {}
+    order = np.lexsort((series.measure_ts, series.measure_metric))
+    metric, ts, value = series.measure_metric[order], series.measure_ts[order], series.measure_value[order]
+    names = {code: name for name, code in series.metrics.items()}
+    results = {}
+    bounds = np.flatnonzero(np.r_[True, metric[1:] != metric[:-1], True])
+    for lo, hi in zip(bounds[:-1], bounds[1:]):
+        values = value[lo:hi]
+        sums = np.r_[0.0, np.cumsum(values)]
+        idx = np.arange(len(values))
+        start = np.maximum(idx + 1 - window, 0)
+        average = (sums[idx + 1] - sums[start]) / (idx + 1 - start)
+        in_range = _day_of(ts[lo:hi]) >= first_day
+        if not in_range.any():
+            continue
+        shown = np.flatnonzero(in_range)
+        results[names[int(metric[lo])]] = {
+            "latest": round(float(values[-1]), 2),
+            "moving_average": round(float(average[-1]), 2),
+            "change": round(float(average[shown[-1]] - average[shown[0]]), 2),
+            "points": [
+                {"date": _as_date(_day_of(ts[lo + i])), "value": round(float(values[i]), 2),
+                 "moving_average": round(float(average[i]), 2)}
+                for i in shown
+            ],
+        }
+    return results
+
+
+def adherence(series: UserSeries, first_day: int, weeks: int, planned: Optional[int]) -> Dict[str, Any]:
+    """Distinct training days per week against the plan's days per week"""
+    days = np.unique(_day_of(series.workout_ts))
+    week = (days - first_day) // 7
+    completed = np.bincount(week[(week >= 0) & (week < weeks)], minlength=weeks)
+    rate = None
+    if planned:
+        rate = round(float(np.minimum(completed, planned).sum()) / (planned * weeks), 3)
+    return {"planned_per_week": planned, "completed": completed.tolist(), "rate": rate}
+
+
+async def progress_report(user_id: str, db: AsyncSession, weeks: int = 12, window: int = 7,
+                          today: Optional[date] = None) -> Dict[str, Any]:
+    """Weekly volume, e1RM trends, measurement moving averages and plan adherence"""
+    # 1. Bring the columnar extract up to date (only new logs are read)
+    series = await load_series(user_id, db)
+    planned = await planned_days_per_week(user_id, db)
+
+    # 2. Serve the cached report unless new logs arrived
+    start = _monday(today or datetime.utcnow().date()) - timedelta(weeks=weeks - 1)
+    key = (start, weeks, window, planned)
+    report = series.reports.get(key)
+    if report is not None:
+        _stats["hits"] += 1
+        return report
+    _stats["misses"] += 1
+
+    # 3. Compute every section over the arrays
+    first_day = (start - date(1970, 1, 1)).days
+    volume, sets = weekly_volume(series, first_day, weeks)
+    report = {
+        "user_id": user_id,
+        "weeks": weeks,
+        "week_starts": [start + timedelta(weeks=i) for i in range(weeks)],
+        "weekly_volume": volume,
+        "weekly_sets": sets,
+        "e1rm": e1rm_trends(series, first_day),
+        "measurements": moving_averages(series, first_day, window),
+        "adherence": adherence(series, first_day, weeks, planned),
+    }
+    series.reports[key] = report
+    return report
@@ -0,0 +1,212 @@
+# empyre_backend/services/conversation_memory.py
+"""
+Per-user conversation memory: every chat message is stored, and prompts get
+a bounded view of it (a rolling summary plus the last MEMORY_HOT_MESSAGES
+messages).
+
+Messages are written in the same commit as the chat turn's profile update.
+The recent window and summary are kept in an in-process LRU, versioned by
+the profile's `message_count` column. Every turn loads the profile row
+anyway, so a warm entry is checked without a query; a stale or missing entry
+(another worker took the turn, or it was evicted) is reloaded with one query
+for the summary and one for the window.
+
+Once more than MEMORY_COMPACT_BATCH messages sit behind the recent window,
+compaction folds them into the summary with one LLM call, so the prompt
+stays the same size however long the history grows.
+"""
+
+import asyncio
+from collections import OrderedDict, deque
+from datetime import datetime
+from typing import Any, Deque, Dict, Optional, Tuple
+
+from sqlalchemy import func, select
+
+from empyre_backend.db import ChatMessage, ConversationSummary, Profile, dialect_insert
+from empyre_backend.services import ai_coach
+from empyre_backend.services.profile_service import ProfileSession
+from empyre_backend.utils.settings import env
+
+MEMORY_HOT_MESSAGES = int(env("MEMORY_HOT_MESSAGES", "8"))
+MEMORY_COMPACT_BATCH = int(env("MEMORY_COMPACT_BATCH", "20"))
+MEMORY_SUMMARY_MAX_CHARS = int(env("MEMORY_SUMMARY_MAX_CHARS", "1200"))
+MEMORY_CACHE_MAX_USERS = int(env("MEMORY_CACHE_MAX_USERS", "1000"))
+MEMORY_COMPACTION_MODE = env("MEMORY_COMPACTION_MODE", "inline")  # "inline" or "off"
+
+
+class Memory:
+    """Hot view of one user's conversation"""
+
+    __slots__ = ("message_count", "summary", "summarized_count", "recent")
+
+    def __init__(self, message_count: int = 0, summary: str = "", summarized_count: int = 0):
+        self.message_count = message_count
+        self.summary = summary
+        self.summarized_count = summarized_count
+        self.recent: Deque[Tuple[str, str]] = deque(maxlen=MEMORY_HOT_MESSAGES)
+
+    def context(self) -> Dict[str, Any]:
+        """Prompt payload: summary of older messages and the recent window, oldest first"""
+        history: Dict[str, Any] = {}
+        if self.summary:
+            history["summary"] = self.summary
+        if self.recent:
+            history["recent"] = [{"role": role, "content": content} for role, content in self.recent]
+        return history
+
+
+_cache: "OrderedDict[str, Memory]" = OrderedDict()
+_stats = {"hits": 0, "misses": 0, "compactions": 0}
+_compacting = set()
+
+
+def stats() -> Dict[str, int]:
+    return {**_stats, "users": len(_cache)}
+
+
+def clear() -> None:
+    _cache.clear()
+
+
+def _put(user_id: str, memory: Memory) -> None:
+    _cache[user_id] = memory
+    _cache.move_to_end(user_id)
+    while len(_cache) > MEMORY_CACHE_MAX_USERS:
+        _cache.popitem(last=False)
+
+
+async def load(session: ProfileSession) -> Memory:
+    """The user's memory as of this turn; no query when the cached copy is current"""
+    user_id = session.user_id
+    memory = _cache.get(user_id)
+    if memory is not None and memory.message_count == session.message_count:
+        _stats["hits"] += 1
+        _cache.move_to_end(user_id)
+        return memory
+
+    _stats["misses"] += 1
+    memory = Memory(session.message_count)
+    if session.message_count:
+        summary = await session.db.get(ConversationSummary, user_id)
+        query = select(ChatMessage.role, ChatMessage.content).where(ChatMessage.user_id == user_id)
+        if summary is not None:
+            memory.summary = summary.summary
+            memory.summarized_count = summary.summarized_count
+            query = query.where(ChatMessage.id > summary.last_message_id)
+        result = await session.db.execute(query.order_by(ChatMessage.id.desc()).limit(MEMORY_HOT_MESSAGES))
+        memory.recent.extend(reversed(result.all()))
+    _put(user_id, memory)
+    return memory
+
+
+def record(session: ProfileSession, user_message: Optional[str], reply: Optional[str]) -> None:
+    """Stage this turn's messages with the profile commit and update the cache once it lands"""
+    user_id = session.user_id
+    messages = [(role, content) for role, content in (("user", user_message), ("assistant", reply)) if content]
+    if not messages:
+        return
+    base = session.message_count
+
+    def publish() -> None:
+        memory = _cache.get(user_id)
+        if memory is None:
+            return
+        if memory.message_count != base or session.message_count != base + len(messages):
+            _cache.pop(user_id, None)  # Another worker wrote in between; reload next time
+            return
+        memory.recent.extend(messages)
+        memory.message_count = session.message_count
+
+    rows = [{"user_id": user_id, "role": role, "content": content} for role, content in messages]
+    session.add_messages(rows, after_commit=publish)
+
+
+def needs_compaction(session: ProfileSession) -> bool:
+    """True when compaction is on and enough messages sit behind the cached recent window"""
+    memory = _cache.get(session.user_id)
+    if MEMORY_COMPACTION_MODE != "inline" or memory is None:
+        return False
+    return session.message_count - memory.summarized_count > MEMORY_HOT_MESSAGES + MEMORY_COMPACT_BATCH
+
+
+async def compact(session_factory, user_id: str) -> bool:
+    """Fold messages older than the recent window into the user's summary"""
+    # 1. One compaction per user per process at a time
+    if user_id in _compacting:
+        return False
+    _compacting.add(user_id)
+    try:
+        async with session_factory() as db:
+            summary = await db.get(ConversationSummary, user_id)
+            last_id = summary.last_message_id if summary else 0
+            summarized = summary.summarized_count if summary else 0
+
+            # 2. Everything newer than the summary except the recent window
+            result = await db.execute(
+                select(ChatMessage.id, ChatMessage.role, ChatMessage.content)
+                .where(ChatMessage.user_id == user_id, ChatMessage.id > last_id)
+                .order_by(ChatMessage.id)
+            )
+            rows = result.all()[:-MEMORY_HOT_MESSAGES or None]
+            if len(rows) <= MEMORY_COMPACT_BATCH:
+                return False
+
+            # 3. Summarize and store, unless a newer summary landed meanwhile
+            text = await ai_coach.summarize_conversation(
+                summary.summary if summary else "", [(row.role, row.content) for row in rows]
+            )
+            text = text[:MEMORY_SUMMARY_MAX_CHARS]
+            new_last_id, new_count = rows[-1].id, summarized + len(rows)
+            insert = dialect_insert(db)
+            stmt = insert(ConversationSummary).values(
+                user_id=user_id, summary=text, last_message_id=new_last_id,
+                summarized_count=new_count, updated_at=datetime.utcnow(),
+            )
+            stmt = stmt.on_conflict_do_update(
+                index_elements=[ConversationSummary.user_id],
+                set_={
+                    "summary": stmt.excluded.summary,
+                    "last_message_id": stmt.excluded.last_message_id,
+                    "summarized_count": stmt.excluded.summarized_count,
+                    "updated_at": stmt.excluded.updated_at,
+                },
+                where=ConversationSummary.last_message_id < stmt.excluded.last_message_id,
+            )
+            await db.execute(stmt)
+            await db.commit()
+
+        # 4. The recent window is unchanged, so a cached copy only needs the new summary
+        memory = _cache.get(user_id)
+        if memory is not None and memory.summarized_count == summarized:
+            memory.summary = text
+            memory.summarized_count = new_count
+        _stats["compactions"] += 1
+        return True
+    finally:
+        _compacting.discard(user_id)
+
+
+async def compact_all(session_factory) -> int:
+    """Compact every user whose backlog is over the threshold (one-off catch-up)"""
+    async with session_factory() as db:
+        result = await db.execute(
+            select(Profile.user_id)
+            .outerjoin(ConversationSummary, ConversationSummary.user_id == Profile.user_id)
+            .where(
+                Profile.message_count - func.coalesce(ConversationSummary.summarized_count, 0)
+                > MEMORY_HOT_MESSAGES + MEMORY_COMPACT_BATCH
+            )
+        )
+        user_ids = result.scalars().all()
+    compacted = 0
+    for user_id in user_ids:
+        compacted += await compact(session_factory, user_id)
+    return compacted
+
+
+if __name__ == "__main__":
+    # python -m empyre_backend.services.conversation_memory
+    from empyre_backend.db import AsyncSessionLocal
+
+    print(f"Compacted {asyncio.run(compact_all(AsyncSessionLocal))} conversations")
@@ -0,0 +1,133 @@
+# empyre_backend/services/conversation_state.py
+"""
+Conversation state machine for the chat flow.
+
+Each profile row stores its current `phase` and the `pending_field` the
+last question asked for, so a turn dispatches straight on the phase instead
+of re-deriving it from the profile JSON. Phases only move along TRANSITIONS,
+and they move at the point the state changes: when an answer is recorded or
+a plan is produced.
+
+    core_loop -> aux_offer -> aux_loop -> plan_gen -> tweak_log
+                          \\______________/
+"""
+
+from datetime import datetime, timedelta
+from enum import Enum
+from typing import Any, Dict, Optional
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from empyre_backend.db import Profile
+from empyre_backend.services import profile_service
+
+
+class Phase(str, Enum):
+    CORE_LOOP = "core_loop"
+    AUX_OFFER = "aux_offer"
+    AUX_LOOP = "aux_loop"
+    PLAN_GEN = "plan_gen"
+    TWEAK_LOG = "tweak_log"
+
+
+TRANSITIONS = {
+    Phase.CORE_LOOP: {Phase.AUX_OFFER},
+    Phase.AUX_OFFER: {Phase.AUX_LOOP, Phase.PLAN_GEN},
+    Phase.AUX_LOOP: {Phase.PLAN_GEN},
+    Phase.PLAN_GEN: {Phase.TWEAK_LOG},
+    Phase.TWEAK_LOG: set(),
+}
+
+OPT_IN_FIELD = "auxiliary_opt_in"
+_YES_WORDS = ("yes", "sure", "ok")
+
+
+class InvalidTransition(ValueError):
+    pass
+
+
+def derive_phase(profile: Dict[str, Any], has_plan: bool) -> Phase:
+    """Phase implied by the profile data and whether a plan exists (used after manual patches)"""
+    if not profile_service.is_core_complete(profile):
+        return Phase.CORE_LOOP
+    if profile.get(OPT_IN_FIELD) is None:
+        return Phase.AUX_OFFER
+    if profile.get(OPT_IN_FIELD) and not profile_service.is_aux_complete(profile):
+        return Phase.AUX_LOOP
+    if not has_plan:
+        return Phase.PLAN_GEN
+    return Phase.TWEAK_LOG
+
+
+def current(session: profile_service.ProfileSession) -> Phase:
+    return Phase(session.phase)
+
+
+def transition(session: profile_service.ProfileSession, to: Phase) -> None:
+    """Move to `to` if TRANSITIONS allows it (staying put is always allowed)"""
+    phase = current(session)
+    if to is phase:
+        return
+    if to not in TRANSITIONS[phase]:
+        raise InvalidTransition(f"{phase.value} -> {to.value}")
+    session.set_phase(to.value)
+
+
+def apply_patch(session: profile_service.ProfileSession, patch: Dict[str, Any]) -> None:
+    """Apply a manual profile patch, which may move the phase anywhere"""
+    session.apply_patch(patch)
+    if session.pending_field in patch:
+        session.pending_field = None
+    phase = derive_phase(session.data, session.plan_id is not None)
+    if phase is not current(session):
+        session.set_phase(phase.value)
+        session.pending_field = None
+
+
+def ask(session: profile_service.ProfileSession, field: Optional[str]) -> None:
+    """Remember which field the question just sent is asking for"""
+    session.pending_field = field
+
+
+def after_answer(phase: Phase, profile: Dict[str, Any]) -> Phase:
+    """Phase that follows `phase` once `profile` holds the latest answer"""
+    if phase is Phase.CORE_LOOP and profile_service.is_core_complete(profile):
+        return Phase.AUX_OFFER
+    if phase is Phase.AUX_OFFER and profile.get(OPT_IN_FIELD) is not None:
+        return Phase.AUX_LOOP if profile[OPT_IN_FIELD] else Phase.PLAN_GEN
+    if phase is Phase.AUX_LOOP and profile_service.is_aux_complete(profile):
+        return Phase.PLAN_GEN
+    return phase
+
+
+def record_opt_in(session: profile_service.ProfileSession, message: str) -> None:
+    """Store the yes/no answer to the optional-questions offer"""
+    lowered = message.lower()
+    session.data[OPT_IN_FIELD] = any(word in lowered for word in _YES_WORDS)
+    session.pending_field = None
+    transition(session, after_answer(current(session), session.data))
+
+
+def record_answer(session: profile_service.ProfileSession, value: Any) -> None:
+    """Store the answer to the pending question and advance the phase"""
+    session.data[session.pending_field] = value
+    session.pending_field = None
+    transition(session, after_answer(current(session), session.data))
+
+
+def plan_ready(session: profile_service.ProfileSession) -> None:
+    """A plan was produced for this profile"""
+    if session.plan_id is not None:
+        transition(session, Phase.TWEAK_LOG)
+
+
+async def phase_counts(db: AsyncSession, stuck_for: Optional[timedelta] = None) -> Dict[str, int]:
+    """Users per phase, optionally only those who entered it more than `stuck_for` ago"""
+    query = select(Profile.phase, func.count()).group_by(Profile.phase)
+    if stuck_for is not None:
+        query = query.where(Profile.phase_changed_at < datetime.utcnow() - stuck_for)
+    result = await db.execute(query)
+    counts = {phase.value: 0 for phase in Phase}
+    counts.update({phase: count for phase, count in result.all()})
+    return counts
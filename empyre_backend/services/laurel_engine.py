@@ -0,0 +1,317 @@
+# empyre_backend/services/laurel_engine.py
+"""
+Automatic laurel awarding driven by progress logs.
+
+For every (user, exercise) the engine keeps running state in
+`exercise_stats`: best weight, best estimated 1RM, last and rolling (EMA)
+session volume, and the last log id applied. Each new workout log is
+compared against that state in O(1) per set, so no history is rescanned:
+
+  * pr                    - a set beats the best estimated 1RM
+  * progressive_overload  - session volume beats the rolling volume by
+                            LAUREL_OVERLOAD_MIN_GAIN
+
+Inline processing, the background worker and a backfill may see the same
+log. On PostgreSQL each batch takes a transaction-level advisory lock per
+user before reading that user's stats, so runs for one user are serialized
+and the second one finds the log already applied (logs at or below
+`last_log_id` are skipped). Every engine laurel also carries an `award_key`
+(log, laurel type, exercise) that is unique per user, so a laurel is stored
+at most once even without the lock.
+
+The worker cursor only moves past ids that are settled: a missing id below
+newer committed logs may belong to an insert still in flight, so the cursor
+waits for it up to LAUREL_ENGINE_SETTLE_S before treating it as rolled
+back. LAUREL_ENGINE_MODE picks "inline" (after each /progress write),
+"worker" (poll for new logs) or "off".
+"""
+
+import asyncio
+import logging
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from sqlalchemy import bindparam, select, text, tuple_
+from sqlalchemy.dialects.postgresql import ARRAY
+from sqlalchemy.types import String
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from empyre_backend.db import EngineCursor, ExerciseStat, ProgressLog, dialect_insert
+from empyre_backend.services import laurel_service
+from empyre_backend.services.workout_log import WorkSet, estimated_1rm, iter_sets
+from empyre_backend.utils.settings import env
+
+LAUREL_ENGINE_MODE = env("LAUREL_ENGINE_MODE", "inline")  # "inline", "worker" or "off"
+LAUREL_ENGINE_POLL_S = float(env("LAUREL_ENGINE_POLL_S", "5"))
+LAUREL_ENGINE_BATCH_SIZE = int(env("LAUREL_ENGINE_BATCH_SIZE", "1000"))
+LAUREL_ENGINE_SETTLE_S = float(env("LAUREL_ENGINE_SETTLE_S", "10"))
+LAUREL_PR_POINTS = int(env("LAUREL_PR_POINTS", "25"))
+LAUREL_OVERLOAD_POINTS = int(env("LAUREL_OVERLOAD_POINTS", "10"))
+LAUREL_OVERLOAD_MIN_GAIN = float(env("LAUREL_OVERLOAD_MIN_GAIN", "0.05"))
+VOLUME_EMA_ALPHA = 0.3
+
+CURSOR_NAME = "laurel_engine"
+
+logger = logging.getLogger(__name__)
+
+# First missing id of each gap the worker is waiting on -> when it was first seen
+_gaps: Dict[int, float] = {}
+
+_LOCK_USERS = text(
+    "SELECT count(pg_advisory_xact_lock(hashtext('laurel_engine:' || user_id))) "
+    "FROM (SELECT unnest(:user_ids) AS user_id ORDER BY 1) AS users"
+).bindparams(bindparam("user_ids", type_=ARRAY(String)))
+
+_STAT_FIELDS = ("best_weight", "best_e1rm", "last_volume", "rolling_volume", "sessions", "last_log_id")
+
+
+def _blank_stat() -> Dict[str, Any]:
+    return {field: 0 for field in _STAT_FIELDS}
+
+
+def _title(exercise: str) -> str:
+    return exercise.title()
+
+
+def _award_key(log_id: int, laurel_type: str, exercise: str) -> str:
+    return f"{log_id}:{laurel_type}:{exercise}"
+
+
+def _parse_sets(log: Any) -> Optional[List[WorkSet]]:
+    """The log's sets, or None (logged and skipped) if its log_data cannot be read"""
+    try:
+        return list(iter_sets(log.log_data))
+    except Exception:
+        logger.exception("Skipping unreadable workout log %s", log.id)
+        return None
+
+
+def apply_log(log_id: int, user_id: str, sets: Iterable[WorkSet],
+              stats: Dict[Tuple[str, str], Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Fold one workout log's sets into `stats` in place and return the laurels it earns"""
+    sessions: Dict[str, Dict[str, float]] = {}
+    for exercise, weight, reps in sets:
+        session = sessions.setdefault(exercise, {"volume": 0.0, "e1rm": 0.0, "weight": 0.0, "reps": 0})
+        session["volume"] += weight * reps
+        e1rm = estimated_1rm(weight, reps)
+        if e1rm > session["e1rm"]:
+            session.update(e1rm=e1rm, weight=weight, reps=reps)
+
+    laurels = []
+    for exercise, session in sessions.items():
+        stat = stats.setdefault((user_id, exercise), _blank_stat())
+        if log_id <= stat["last_log_id"]:
+            continue  # Already applied (inline and worker overlap, or re-run backfill)
+
+        if stat["sessions"] and session["e1rm"] > stat["best_e1rm"] > 0:
+            laurels.append({
+                "user_id": user_id,
+                "laurel_type": "pr",
+                "points": LAUREL_PR_POINTS,
+                "award_key": _award_key(log_id, "pr", exercise),
+                "description": (
+                    f"New PR on {_title(exercise)}: {session['weight']:g} x {session['reps']} "
+                    f"(est. 1RM {session['e1rm']:.1f})"
+                ),
+            })
+        if stat["sessions"] and stat["rolling_volume"] > 0 and \
+                session["volume"] >= stat["rolling_volume"] * (1 + LAUREL_OVERLOAD_MIN_GAIN):
+            laurels.append({
+                "user_id": user_id,
+                "laurel_type": "progressive_overload",
+                "points": LAUREL_OVERLOAD_POINTS,
+                "award_key": _award_key(log_id, "progressive_overload", exercise),
+                "description": (
+                    f"Progressive overload on {_title(exercise)}: volume {session['volume']:g} "
+                    f"vs average {stat['rolling_volume']:.0f}"
+                ),
+            })
+
+        stat["best_e1rm"] = max(stat["best_e1rm"], session["e1rm"])
+        stat["best_weight"] = max(stat["best_weight"], session["weight"])
+        stat["rolling_volume"] = (
+            session["volume"] if not stat["sessions"]
+            else VOLUME_EMA_ALPHA * session["volume"] + (1 - VOLUME_EMA_ALPHA) * stat["rolling_volume"]
+        )
+        stat["last_volume"] = session["volume"]
+        stat["sessions"] += 1
+        stat["last_log_id"] = log_id
+    return laurels
+
+
+async def _lock_users(db: AsyncSession, user_ids: Iterable[str]) -> None:
+    """Serialize engine runs per user until commit (sorted, so two batches cannot deadlock)"""
+    if user_ids and db.get_bind().dialect.name == "postgresql":
+        await db.execute(_LOCK_USERS, {"user_ids": sorted(user_ids)})
+
+
+async def _load_stats(db: AsyncSession, keys: Sequence[Tuple[str, str]]) -> Dict[Tuple[str, str], Dict[str, Any]]:
+    if not keys:
+        return {}
+    result = await db.execute(
+        select(ExerciseStat).where(tuple_(ExerciseStat.user_id, ExerciseStat.exercise).in_(list(keys)))
+    )
+    return {
+        (row.user_id, row.exercise): {field: getattr(row, field) for field in _STAT_FIELDS}
+        for row in result.scalars().all()
+    }
+
+
+async def _save_stats(db: AsyncSession, stats: Dict[Tuple[str, str], Dict[str, Any]]) -> None:
+    if not stats:
+        return
+    now = datetime.utcnow()
+    rows = [{"user_id": user_id, "exercise": exercise, **stat, "updated_at": now}
+            for (user_id, exercise), stat in stats.items()]
+    insert = dialect_insert(db)
+    stmt = insert(ExerciseStat)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[ExerciseStat.user_id, ExerciseStat.exercise],
+        set_={field: stmt.excluded[field] for field in (*_STAT_FIELDS, "updated_at")},
+        where=ExerciseStat.last_log_id < stmt.excluded.last_log_id,  # never roll state back
+    )
+    await db.execute(stmt, rows)
+
+
+async def process_logs(logs: Sequence[Any], db: AsyncSession) -> int:
+    """
+    Apply a batch of ProgressLog rows (any objects with id, user_id, log_type,
+    log_data) in id order, write stats and laurels in one transaction, and
+    return the number of laurels awarded. Logs whose data cannot be read are
+    skipped so they never block the rest of the batch.
+    """
+    workouts = sorted((log for log in logs if log.log_type == "workout"), key=lambda log: log.id)
+    parsed = [(log, sets) for log in workouts if (sets := _parse_sets(log)) is not None]
+    keys = {(log.user_id, exercise) for log, sets in parsed for exercise, _, _ in sets}
+    # Stats are read only once this batch holds its users, so they are never stale
+    await _lock_users(db, {user_id for user_id, _ in keys})
+    stats = await _load_stats(db, list(keys))
+
+    laurels: List[Dict[str, Any]] = []
+    for log, sets in parsed:
+        laurels.extend(apply_log(log.id, log.user_id, sets, stats))
+
+    touched = {key: stat for key, stat in stats.items() if key in keys}
+    await _save_stats(db, touched)
+    awarded = await laurel_service.award_many(laurels, db, commit=False)
+    await db.commit()
+    if awarded:
+        await laurel_service.refresh_entries(db, {laurel["user_id"] for laurel in laurels})
+    return awarded
+
+
+async def process_log_ids(session_factory, log_ids: Sequence[int]) -> int:
+    """Inline mode: process freshly written logs in their own session"""
+    if not log_ids:
+        return 0
+    async with session_factory() as db:
+        result = await db.execute(select(ProgressLog).where(ProgressLog.id.in_(list(log_ids))))
+        return await process_logs(result.scalars().all(), db)
+
+
+async def _read_cursor(db: AsyncSession) -> int:
+    cursor = await db.get(EngineCursor, CURSOR_NAME)
+    return cursor.last_log_id if cursor else 0
+
+
+async def _write_cursor(db: AsyncSession, last_log_id: int) -> None:
+    insert = dialect_insert(db)
+    stmt = insert(EngineCursor).values(name=CURSOR_NAME, last_log_id=last_log_id, updated_at=datetime.utcnow())
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[EngineCursor.name],
+        set_={"last_log_id": stmt.excluded.last_log_id, "updated_at": stmt.excluded.updated_at},
+    )
+    await db.execute(stmt)
+
+
+def _settled(after: int, log_ids: Sequence[int], settle_s: float) -> Tuple[int, int]:
+    """
+    Walk committed ids after the cursor and return (last settled id, ids passed).
+    Stops before a gap younger than `settle_s`: ids commit out of order, so the
+    missing row may still show up and must not be skipped.
+    """
+    now = time.monotonic()
+    previous = after
+    for log_id in log_ids:
+        if log_id > previous + 1:
+            _gaps.setdefault(previous + 1, now)  # Every gap in the batch starts settling at once
+        previous = log_id
+
+    upto, passed = after, 0
+    for log_id in log_ids:
+        if log_id > upto + 1 and now - _gaps[upto + 1] < settle_s:
+            break
+        upto, passed = log_id, passed + 1
+    for start in [start for start in _gaps if start <= upto]:
+        del _gaps[start]
+    return upto, passed
+
+
+def waiting_on_gap() -> bool:
+    """True while the cursor is held back by a gap that has not settled yet"""
+    return bool(_gaps)
+
+
+async def process_pending(db: AsyncSession, batch_size: int = LAUREL_ENGINE_BATCH_SIZE,
+                          settle_s: float = LAUREL_ENGINE_SETTLE_S) -> Tuple[int, int]:
+    """Process the next settled batch of logs after the stored cursor; returns (logs passed, laurels)"""
+    after = await _read_cursor(db)
+    # 1. Ids of every log type, so gaps left by other types are not mistaken for in-flight workouts
+    ids = await db.execute(
+        select(ProgressLog.id).where(ProgressLog.id > after).order_by(ProgressLog.id).limit(batch_size)
+    )
+    upto, passed = _settled(after, ids.scalars().all(), settle_s)
+    if upto == after:
+        return 0, 0
+
+    # 2. Workouts up to the settled id; the cursor, stats and laurels commit together
+    result = await db.execute(
+        select(ProgressLog)
+        .where(ProgressLog.id > after, ProgressLog.id <= upto, ProgressLog.log_type == "workout")
+        .order_by(ProgressLog.id)
+    )
+    await _write_cursor(db, upto)
+    awarded = await process_logs(result.scalars().all(), db)
+    return passed, awarded
+
+
+async def backfill(session_factory, batch_size: int = LAUREL_ENGINE_BATCH_SIZE) -> Tuple[int, int]:
+    """Run the engine over all existing logs from the stored cursor onwards"""
+    processed = awarded = 0
+    while True:
+        async with session_factory() as db:
+            count, earned = await process_pending(db, batch_size)
+        processed += count
+        awarded += earned
+        if count < batch_size:
+            return processed, awarded
+
+
+async def run_worker(session_factory, poll_s: float = LAUREL_ENGINE_POLL_S) -> None:
+    """Background worker: drain new logs, then poll every `poll_s` seconds"""
+    while True:
+        try:
+            processed, awarded = await backfill(session_factory)
+            if awarded:
+                logger.info("Laurel engine processed %d logs, awarded %d laurels", processed, awarded)
+        except Exception:
+            logger.exception("Laurel engine batch failed")
+        await asyncio.sleep(poll_s)
+
+
+if __name__ == "__main__":
+    # One-off backfill over existing history: python -m empyre_backend.services.laurel_engine
+    from empyre_backend.db import AsyncSessionLocal
+
+    async def _backfill_all() -> Tuple[int, int]:
+        processed = awarded = 0
+        while True:
+            count, earned = await backfill(AsyncSessionLocal)
+            processed, awarded = processed + count, awarded + earned
+            if not waiting_on_gap():
+                return processed, awarded
+            await asyncio.sleep(LAUREL_ENGINE_SETTLE_S)  # Let gaps in the history settle, then go on
+
+    totals = asyncio.run(_backfill_all())
+    print(f"Processed {totals[0]} logs, awarded {totals[1]} laurels")
@@ -0,0 +1,233 @@
+# empyre_backend/services/laurel_service.py
+"""
+Laurel awarding, materialized point totals and the Arena leaderboard.
+
+Every award inserts the laurel row and upserts the user's `laurel_totals`
+row in the same transaction, so totals never need a scan of `laurels`.
+Ranking is served from an in-process sorted index built from
+`laurel_totals`: rank lookups are a binary search and top-N is a slice.
+The index is refreshed from the table every LEADERBOARD_REFRESH_S seconds so
+awards made by other workers show up, and `reconcile()` rebuilds totals
+from the raw laurels to repair any drift (every LEADERBOARD_RECONCILE_S
+seconds, or once with `python -m empyre_backend.services.laurel_service`).
+"""
+
+import asyncio
+import bisect
+import logging
+import time
+from datetime import datetime
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import delete, func, literal, select, text, true
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from empyre_backend.db import Laurel, LaurelTotal, dialect_insert
+from empyre_backend.utils.settings import env
+
+LEADERBOARD_REFRESH_S = float(env("LEADERBOARD_REFRESH_S", "30"))
+LEADERBOARD_RECONCILE_S = float(env("LEADERBOARD_RECONCILE_S", "0"))  # 0 disables
+AWARD_CHUNK_SIZE = 500  # laurels per multi-row INSERT
+
+logger = logging.getLogger(__name__)
+
+
+class Leaderboard:
+    """Users sorted by (points desc, user_id asc)"""
+
+    def __init__(self):
+        self._keys: List[Tuple[int, str]] = []  # (-points, user_id), kept sorted
+        self._points: Dict[str, int] = {}
+        self.loaded_at = 0.0
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def load(self, totals: Iterable[Tuple[str, int]]) -> None:
+        self._points = {user_id: points for user_id, points in totals}
+        self._keys = sorted((-points, user_id) for user_id, points in self._points.items())
+        self.loaded_at = time.monotonic()
+
+    def set(self, user_id: str, points: int) -> None:
+        old = self._points.get(user_id)
+        if old is not None:
+            index = bisect.bisect_left(self._keys, (-old, user_id))
+            del self._keys[index]
+        self._points[user_id] = points
+        bisect.insort(self._keys, (-points, user_id))
+
+    def points(self, user_id: str) -> Optional[int]:
+        return self._points.get(user_id)
+
+    def rank(self, user_id: str) -> Optional[int]:
+        """1-based competition rank: users with more points + 1"""
+        points = self._points.get(user_id)
+        if points is None:
+            return None
+        return bisect.bisect_left(self._keys, (-points, "")) + 1
+
+    def slice(self, start: int, stop: int) -> List[Dict[str, Any]]:
+        """Entries at 0-based positions [start, stop)"""
+        start = max(start, 0)
+        entries = []
+        for position, (neg_points, user_id) in enumerate(self._keys[start:stop], start=start):
+            entries.append({
+                "user_id": user_id,
+                "points": -neg_points,
+                "rank": bisect.bisect_left(self._keys, (neg_points, "")) + 1,
+                "position": position + 1,
+            })
+        return entries
+
+    def top(self, n: int) -> List[Dict[str, Any]]:
+        return self.slice(0, n)
+
+    def around(self, user_id: str, radius: int) -> List[Dict[str, Any]]:
+        points = self._points.get(user_id)
+        if points is None:
+            return []
+        index = bisect.bisect_left(self._keys, (-points, user_id))
+        return self.slice(index - radius, index + radius + 1)
+
+
+leaderboard = Leaderboard()
+_load_lock = asyncio.Lock()
+
+
+async def ensure_leaderboard(db: AsyncSession, force: bool = False) -> Leaderboard:
+    """Load or refresh the in-process leaderboard from laurel_totals"""
+    def needs_load() -> bool:
+        age = time.monotonic() - leaderboard.loaded_at
+        return not leaderboard.loaded_at or age > LEADERBOARD_REFRESH_S
+
+    if force or needs_load():
+        async with _load_lock:
+            if force or needs_load():
+                result = await db.execute(select(LaurelTotal.user_id, LaurelTotal.points))
+                leaderboard.load(result.all())
+    return leaderboard
+
+
+async def _add_to_totals(db: AsyncSession, user_id: str, points: int, count: int) -> None:
+    insert = dialect_insert(db)
+    stmt = insert(LaurelTotal).values(user_id=user_id, points=points, laurel_count=count)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[LaurelTotal.user_id],
+        set_={
+            "points": LaurelTotal.points + stmt.excluded.points,
+            "laurel_count": LaurelTotal.laurel_count + stmt.excluded.laurel_count,
+            "updated_at": datetime.utcnow(),
+        },
+    )
+    await db.execute(stmt)
+
+
+async def refresh_entries(db: AsyncSession, user_ids: Iterable[str]) -> None:
+    """Pull committed totals for these users into the in-process leaderboard"""
+    if not leaderboard.loaded_at:
+        return  # Loaded lazily on first read
+    result = await db.execute(
+        select(LaurelTotal.user_id, LaurelTotal.points).where(LaurelTotal.user_id.in_(list(user_ids)))
+    )
+    for user_id, points in result.all():
+        leaderboard.set(user_id, points)
+
+
+async def award(user_id: str, laurel_type: str, points: int, description: str,
+                db: AsyncSession) -> Laurel:
+    """Insert a laurel and bump the user's total in one transaction"""
+    laurel = Laurel(user_id=user_id, laurel_type=laurel_type, points=points, description=description)
+    db.add(laurel)
+    await _add_to_totals(db, user_id, points, 1)
+    await db.commit()
+    await db.refresh(laurel)
+    await refresh_entries(db, [user_id])
+    return laurel
+
+
+async def award_many(laurels: List[Dict[str, Any]], db: AsyncSession, commit: bool = True) -> int:
+    """
+    Bulk-insert laurel dicts and fold them into totals (one upsert per user).
+    Laurels whose (user_id, award_key) is already stored are skipped, so only
+    the ones actually inserted count; returns that number.
+    """
+    if not laurels:
+        return 0
+    per_user: Dict[str, List[int]] = {}
+    insert = dialect_insert(db)
+    rows = [{"description": None, "award_key": None, **laurel} for laurel in laurels]
+    for start in range(0, len(rows), AWARD_CHUNK_SIZE):
+        stmt = (
+            insert(Laurel)
+            .values(rows[start:start + AWARD_CHUNK_SIZE])
+            .on_conflict_do_nothing(index_elements=["user_id", "award_key"])
+            .returning(Laurel.user_id, Laurel.points)
+        )
+        for user_id, points in (await db.execute(stmt)).all():
+            totals = per_user.setdefault(user_id, [0, 0])
+            totals[0] += points or 0
+            totals[1] += 1
+    for user_id, (points, count) in per_user.items():
+        await _add_to_totals(db, user_id, points, count)
+    if commit:
+        await db.commit()
+        await refresh_entries(db, per_user)
+    return sum(count for _, count in per_user.values())
+
+
+async def reconcile(db: AsyncSession) -> int:
+    """Rebuild laurel_totals from the laurels table; returns rows corrected"""
+    # 1. Every award inserts its laurels before touching totals. On PostgreSQL a SHARE lock
+    #    on laurels waits for awards in flight and holds off new ones until we commit, so
+    #    no award can land between the sums below and the upsert (SQLite has one writer anyway)
+    if db.get_bind().dialect.name == "postgresql":
+        await db.execute(text("LOCK TABLE laurels IN SHARE MODE"))
+
+    # 2. Sum and upsert in one statement, touching only the totals that are off
+    insert = dialect_insert(db)
+    sums = (
+        select(Laurel.user_id, func.coalesce(func.sum(Laurel.points), 0), func.count(Laurel.id),
+               literal(datetime.utcnow()))
+        .where(true())  # SQLite needs a WHERE before ON CONFLICT in INSERT ... SELECT
+        .group_by(Laurel.user_id)
+    )
+    stmt = insert(LaurelTotal).from_select(["user_id", "points", "laurel_count", "updated_at"], sums)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[LaurelTotal.user_id],
+        set_={field: stmt.excluded[field] for field in ("points", "laurel_count", "updated_at")},
+        where=(LaurelTotal.points != stmt.excluded.points) | (LaurelTotal.laurel_count != stmt.excluded.laurel_count),
+    ).returning(LaurelTotal.user_id)
+    corrected = len((await db.execute(stmt)).all())
+
+    # 3. Totals for users without any laurels
+    orphans = await db.execute(
+        delete(LaurelTotal).where(LaurelTotal.user_id.not_in(select(Laurel.user_id).distinct()))
+    )
+    corrected += orphans.rowcount
+    await db.commit()
+    await ensure_leaderboard(db, force=True)
+    return corrected
+
+
+async def run_reconciler(session_factory, interval_s: float = LEADERBOARD_RECONCILE_S) -> None:
+    """Background loop that reconciles totals every `interval_s` seconds"""
+    while True:
+        await asyncio.sleep(interval_s)
+        try:
+            async with session_factory() as db:
+                corrected = await reconcile(db)
+            if corrected:
+                logger.warning("Reconciled %d laurel_totals rows", corrected)
+        except Exception:
+            logger.exception("Laurel totals reconciliation failed")
+
+
+if __name__ == "__main__":
+    # One-off repair: python -m empyre_backend.services.laurel_service
+    from empyre_backend.db import AsyncSessionLocal
+
+    async def _reconcile_once() -> int:
+        async with AsyncSessionLocal() as db:
+            return await reconcile(db)
+
+    print(f"Corrected {asyncio.run(_reconcile_once())} laurel_totals rows")
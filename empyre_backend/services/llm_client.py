@@ -0,0 +1,409 @@
+# LLM client service
+"""
+Async LLM client shared by every ai_coach flow.
+
+A single pooled backend is created per worker on first use. Calls go through
+`complete()`, which applies the per-call timeout, the per-model rate limit
+(services/rate_limit.py) and a global concurrency limit so a burst of /chat
+requests never blocks the event loop or opens an unbounded number of
+provider connections. At most LLM_MAX_QUEUE calls wait for a slot, each for
+at most LLM_QUEUE_TIMEOUT_S; past that, calls fail fast with RateLimited.
+Which model a flow uses, failover and hedging are decided one level up, in
+services/model_router.py.
+
+Set LLM_BACKEND=fake to use a deterministic local backend (no API key, no
+network) for offline load testing.
+"""
+
+import asyncio
+import json
+import re
+import time
+from contextlib import aclosing, asynccontextmanager
+from typing import Any, AsyncIterator, Dict, List, NamedTuple, Optional, Union
+
+from empyre_backend.services import rate_limit
+from empyre_backend.utils import metrics
+from empyre_backend.utils.settings import env
+
+LLM_BACKEND = env("LLM_BACKEND", "openai")  # "openai" or "fake"
+LLM_TIMEOUT_S = float(env("LLM_TIMEOUT_S", "60"))
+LLM_PLAN_TIMEOUT_S = float(env("LLM_PLAN_TIMEOUT_S", "120"))
+LLM_MAX_CONCURRENCY = int(env("LLM_MAX_CONCURRENCY", "32"))
+LLM_MAX_QUEUE = int(env("LLM_MAX_QUEUE", "64"))
+LLM_QUEUE_TIMEOUT_S = float(env("LLM_QUEUE_TIMEOUT_S", "10"))
+LLM_MAX_CONNECTIONS = int(env("LLM_MAX_CONNECTIONS", "100"))
+LLM_MAX_RETRIES = int(env("LLM_MAX_RETRIES", "2"))
+LLM_FAKE_LATENCY_MS = float(env("LLM_FAKE_LATENCY_MS", "0"))
+LLM_DRAIN_TIMEOUT_S = float(env("LLM_DRAIN_TIMEOUT_S", "20"))  # shutdown waits this long for running calls
+DRAIN_POLL_S = 0.05
+# Ask the provider for a syntactically valid JSON object on calls that request it
+LLM_JSON_MODE = env("LLM_JSON_MODE", "1") == "1"
+
+Messages = List[Dict[str, str]]
+
+
+class Completion(NamedTuple):
+    """Backend reply with provider token usage (None when unknown)"""
+    text: str
+    prompt_tokens: Optional[int] = None
+    completion_tokens: Optional[int] = None
+
+
+class OpenAIBackend:
+    """OpenAI chat completions over one pooled, keep-alive HTTP client"""
+
+    def __init__(self, api_key: str, max_connections: int = LLM_MAX_CONNECTIONS,
+                 max_retries: int = LLM_MAX_RETRIES):
+        import httpx
+        from openai import AsyncOpenAI, DefaultAsyncHttpxClient
+
+        http_client = DefaultAsyncHttpxClient(
+            limits=httpx.Limits(
+                max_connections=max_connections,
+                max_keepalive_connections=max_connections,
+            )
+        )
+        self._client = AsyncOpenAI(api_key=api_key, http_client=http_client, max_retries=max_retries)
+
+    @asynccontextmanager
+    async def _provider_limits(self, model: str):
+        # A 429 that outlasted the client's own retries becomes a RateLimited
+        from openai import RateLimitError
+
+        try:
+            yield
+        except RateLimitError as exc:
+            header = exc.response.headers.get("retry-after") if exc.response is not None else None
+            try:
+                retry_after = float(header) if header else None
+            except ValueError:
+                retry_after = None
+            raise rate_limit.provider_limited(model, retry_after) from exc
+
+    async def complete(self, model: str, messages: Messages, temperature: float, timeout: float,
+                       json_mode: bool = False) -> Completion:
+        async with self._provider_limits(model):
+            response = await self._client.chat.completions.create(
+                model=model,
+                messages=messages,
+                temperature=temperature,
+                timeout=timeout,
+                **_response_format(json_mode),
+            )
+        usage = response.usage
+        return Completion(
+            response.choices[0].message.content,
+            usage.prompt_tokens if usage else None,
+            usage.completion_tokens if usage else None,
+        )
+
+    async def stream(self, model: str, messages: Messages, temperature: float,
+                     timeout: float, json_mode: bool = False) -> AsyncIterator[Union[str, Completion]]:
+        """Yield text deltas, then a Completion carrying only the usage"""
+        async with self._provider_limits(model):
+            response = await self._client.chat.completions.create(
+                model=model,
+                messages=messages,
+                temperature=temperature,
+                timeout=timeout,
+                stream=True,
+                stream_options={"include_usage": True},
+                **_response_format(json_mode),
+            )
+        async for chunk in response:
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
+            if chunk.usage:
+                yield Completion("", chunk.usage.prompt_tokens, chunk.usage.completion_tokens)
+
+    async def aclose(self) -> None:
+        await self._client.close()
+
+
+def _response_format(json_mode: bool) -> Dict[str, Any]:
+    return {"response_format": {"type": "json_object"}} if json_mode and LLM_JSON_MODE else {}
+
+
+class FakeBackend:
+    """Deterministic offline backend that answers each ai_coach prompt with valid JSON"""
+
+    def __init__(self, latency_ms: float = LLM_FAKE_LATENCY_MS):
+        self.latency_ms = latency_ms
+        self.calls = 0
+
+    async def complete(self, model: str, messages: Messages, temperature: float, timeout: float,
+                       json_mode: bool = False) -> Completion:
+        self.calls += 1
+        if self.latency_ms:
+            await asyncio.wait_for(asyncio.sleep(self.latency_ms / 1000), timeout)
+        reply = fake_reply(messages)
+        return Completion(reply, _estimate_tokens(messages), len(reply) // 4)
+
+    async def stream(self, model: str, messages: Messages, temperature: float, timeout: float,
+                     json_mode: bool = False, chunk_size: int = 16) -> AsyncIterator[Union[str, Completion]]:
+        self.calls += 1
+        reply = fake_reply(messages)
+        chunks = [reply[i:i + chunk_size] for i in range(0, len(reply), chunk_size)]
+        for chunk in chunks:
+            if self.latency_ms:
+                await asyncio.sleep(self.latency_ms / 1000 / len(chunks))
+            yield chunk
+        yield Completion("", _estimate_tokens(messages), len(reply) // 4)
+
+    async def aclose(self) -> None:
+        pass
+
+
+def _estimate_tokens(messages: Messages) -> int:
+    """Rough prompt size for the fake backend (~4 characters per token)"""
+    return sum(len(m.get("content", "")) for m in messages) // 4
+
+
+_CORE_FIELDS = ["initial_goal", "knowledge_level", "experience_years",
+                "training_days_per_week", "session_length_min", "equipment_access"]
+
+FAKE_PLAN = {
+    "split": {
+        "type": "Full Body",
+        "days": {
+            "Day 1": [
+                {"exercise": "Back Squat", "sets": 3, "reps": 8},
+                {"exercise": "Bench Press", "sets": 3, "reps": 8},
+                {"exercise": "Barbell Row", "sets": 3, "reps": 10},
+            ],
+            "Day 2": [
+                {"exercise": "Deadlift", "sets": 3, "reps": 5},
+                {"exercise": "Overhead Press", "sets": 3, "reps": 8},
+                {"exercise": "Pull Up", "sets": 3, "reps": 8},
+            ],
+            "Day 3": [
+                {"exercise": "Front Squat", "sets": 3, "reps": 8},
+                {"exercise": "Incline Dumbbell Press", "sets": 3, "reps": 10},
+                {"exercise": "Romanian Deadlift", "sets": 3, "reps": 10},
+            ],
+        },
+    },
+    "meals": {
+        "target_macros": {"protein_g": 160, "carbs_g": 250, "fats_g": 70},
+        "sample_day": {
+            "Meal 1": "Oats with whey and berries",
+            "Meal 2": "Chicken, rice and vegetables",
+            "Meal 3": "Greek yogurt and nuts",
+            "Meal 4": "Salmon, potatoes and salad",
+        },
+    },
+    "notes": "Progress the load when all sets hit the top of the rep range.",
+}
+
+
+def _fake_section(name: str) -> Any:
+    days = list(FAKE_PLAN["split"]["days"].values())
+    if name.startswith("Day "):
+        number = re.search(r"\d+", name)
+        return days[(int(number.group(0)) - 1) % len(days) if number else 0]
+    if name == "split_type":
+        return FAKE_PLAN["split"]["type"]
+    return FAKE_PLAN.get(name)
+
+
+def _user_payload(messages: Messages) -> Dict[str, Any]:
+    try:
+        return json.loads(messages[-1]["content"])
+    except (ValueError, KeyError, IndexError):
+        return {}
+
+
+def fake_reply(messages: Messages) -> str:
+    """Build the fake backend's reply from the prompt version tag"""
+    system = messages[0]["content"] if messages else ""
+    payload = _user_payload(messages)
+    profile = payload.get("profile_json") or {}
+
+    if "v1.0.core_loop" in system:
+        field = next((f for f in _CORE_FIELDS if f not in profile), _CORE_FIELDS[-1])
+        return json.dumps({"type": "question", "field": field,
+                           "text": f"What is your {field.replace('_', ' ')}?"})
+    if "v1.0.aux_offer" in system:
+        return json.dumps({"type": "decision", "field": "auxiliary_opt_in",
+                           "text": "Want to share a few optional details for a sharper plan?"})
+    if "v1.0.aux_loop" in system:
+        field = f"aux_detail_{len(profile)}"
+        return json.dumps({"type": "question", "field": field,
+                           "text": "Anything else I should know about your training?"})
+    if "v1.0.plan_gen" in system:
+        return json.dumps(FAKE_PLAN)
+    if "v1.0.plan_repair" in system:
+        return json.dumps({name: _fake_section(name) for name in payload.get("sections") or {}})
+    if "v1.0.tweak_log" in system:
+        return json.dumps({"type": "confirmation",
+                           "text": "Noted, legionary. Keep marching.", "plan_update": {}})
+    if "v1.0.summarize" in system:
+        lines = [payload.get("summary") or ""]
+        lines += [f"{role}: {content[:60]}" for role, content in payload.get("messages") or []]
+        return " | ".join(line for line in lines if line)
+    if "v1.0.extract" in system:
+        message = messages[-1]["content"].rsplit("from:", 1)[-1].strip()
+        number = re.search(r"\d+", message)
+        return number.group(0) if number else message
+    return "{}"
+
+
+_backend = None
+_semaphore: Optional[asyncio.Semaphore] = None
+_waiting = 0
+_in_flight = 0
+
+
+def get_backend():
+    """Return the worker-wide backend, creating it on first use"""
+    global _backend
+    if _backend is None:
+        if LLM_BACKEND == "fake":
+            _backend = FakeBackend()
+        else:
+            from empyre_backend.utils.helpers import get_openai_key
+            _backend = OpenAIBackend(api_key=get_openai_key())
+    return _backend
+
+
+def set_backend(backend) -> None:
+    """Swap the backend (used by benchmarks and load tests)"""
+    global _backend
+    _backend = backend
+
+
+def _get_semaphore() -> asyncio.Semaphore:
+    global _semaphore
+    if _semaphore is None:
+        _semaphore = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+    return _semaphore
+
+
+def has_capacity() -> bool:
+    """True when a call could start now without waiting for a concurrency slot"""
+    return not _get_semaphore().locked()
+
+
+@asynccontextmanager
+async def _slot(model: str):
+    """Per-model rate budget, then one of the LLM_MAX_CONCURRENCY slots via a bounded queue"""
+    global _waiting, _in_flight
+    _in_flight += 1
+    try:
+        await rate_limit.acquire_model(model)
+        semaphore = _get_semaphore()
+        if semaphore.locked():
+            if _waiting >= LLM_MAX_QUEUE:
+                rate_limit.count("queue", "rejected")
+                raise rate_limit.RateLimited("queue", LLM_QUEUE_TIMEOUT_S)
+            _waiting += 1
+            try:
+                await asyncio.wait_for(semaphore.acquire(), LLM_QUEUE_TIMEOUT_S)
+            except asyncio.TimeoutError:
+                rate_limit.count("queue", "timed_out")
+                raise rate_limit.RateLimited("queue", LLM_QUEUE_TIMEOUT_S) from None
+            finally:
+                _waiting -= 1
+        else:
+            await semaphore.acquire()
+        try:
+            yield
+        finally:
+            semaphore.release()
+    finally:
+        _in_flight -= 1
+
+
+def queue_depth() -> int:
+    """LLM calls waiting for a concurrency slot"""
+    return _waiting
+
+
+def in_flight() -> int:
+    """LLM calls running or waiting in this worker"""
+    return _in_flight
+
+
+async def drain(timeout: float = LLM_DRAIN_TIMEOUT_S) -> int:
+    """On shutdown: wait up to `timeout` for in-flight calls to finish; returns how many are left"""
+    deadline = time.monotonic() + timeout
+    while _in_flight and time.monotonic() < deadline:
+        await asyncio.sleep(DRAIN_POLL_S)
+    return _in_flight
+
+
+async def completion(model: str, messages: Messages, temperature: float = 0.7,
+                     timeout: Optional[float] = None, flow: str = "other", json_mode: bool = False) -> Completion:
+    """Run one chat completion without blocking the event loop; returns the text and token usage"""
+    async with _slot(model):
+        start = time.perf_counter()
+        try:
+            result = await get_backend().complete(
+                model, messages, temperature, timeout if timeout is not None else LLM_TIMEOUT_S,
+                json_mode=json_mode,
+            )
+        except asyncio.CancelledError:
+            # A hedged call that lost the race
+            metrics.record_llm_call(model, flow, time.perf_counter() - start, "cancelled")
+            raise
+        except Exception:
+            metrics.record_llm_call(model, flow, time.perf_counter() - start, "error")
+            raise
+    if not isinstance(result, Completion):
+        result = Completion(result)
+    metrics.record_llm_call(model, flow, time.perf_counter() - start, "ok",
+                            result.prompt_tokens, result.completion_tokens)
+    return result
+
+
+async def complete(model: str, messages: Messages, temperature: float = 0.7,
+                   timeout: Optional[float] = None, flow: str = "other", json_mode: bool = False) -> str:
+    """Run one chat completion on `model` and return its text"""
+    result = await completion(model, messages, temperature, timeout, flow, json_mode)
+    return result.text
+
+
+async def stream_completion(model: str, messages: Messages, temperature: float = 0.7,
+                            timeout: Optional[float] = None, flow: str = "other",
+                            json_mode: bool = False) -> AsyncIterator[Union[str, Completion]]:
+    """Yield completion text deltas as the provider produces them, then a Completion carrying the usage"""
+    usage = Completion("")
+    outcome = "error"
+    async with _slot(model):
+        start = time.perf_counter()
+        try:
+            async for delta in get_backend().stream(
+                model, messages, temperature, timeout if timeout is not None else LLM_TIMEOUT_S,
+                json_mode=json_mode,
+            ):
+                if isinstance(delta, Completion):
+                    usage = delta
+                else:
+                    yield delta
+            outcome = "ok"
+        except (GeneratorExit, asyncio.CancelledError):
+            outcome = "cancelled"  # Closed by the consumer, e.g. a client disconnect
+            raise
+        finally:
+            metrics.record_llm_call(model, flow, time.perf_counter() - start, outcome,
+                                    usage.prompt_tokens, usage.completion_tokens)
+    yield usage
+
+
+async def stream(model: str, messages: Messages, temperature: float = 0.7,
+                 timeout: Optional[float] = None, flow: str = "other",
+                 json_mode: bool = False) -> AsyncIterator[str]:
+    """Yield completion text deltas as the provider produces them"""
+    async with aclosing(stream_completion(model, messages, temperature, timeout, flow, json_mode)) as deltas:
+        async for delta in deltas:
+            if not isinstance(delta, Completion):
+                yield delta
+
+
+async def aclose() -> None:
+    """Close the pooled HTTP client (call on shutdown)"""
+    global _backend
+    if _backend is not None:
+        await _backend.aclose()
+        _backend = None
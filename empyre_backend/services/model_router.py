@@ -0,0 +1,311 @@
+# empyre_backend/services/model_router.py
+"""
+Model routing for the ai_coach flows.
+
+MODEL_ROUTES maps each flow (core_loop, aux_offer, aux_loop, extract, plan,
+plan_repair, tweak_log, summarize) to a primary and an optional fallback
+model, e.g. "plan=gpt-4o>gpt-4o-mini,*=gpt-4o-mini>gpt-4o". On every call:
+
+* Failover: a model that errors or is rate limited is retried once on the
+  other. A primary whose recent error rate is above MODEL_FAILOVER_ERROR_RATE
+  (or whose p95 on the flow is above MODEL_FAILOVER_P95_S) goes second until
+  its bad calls age out of the MODEL_HEALTH_WINDOW_S window.
+* Hedging (flows in MODEL_HEDGE_FLOWS): if the first model hasn't answered
+  within its live p95 for the flow, the request also goes to the other one,
+  the first answer wins and the loser is cancelled. A hedge only starts when
+  an LLM slot is free, so it never queues behind real traffic.
+
+Latency, outcome, tokens and cost (MODEL_PRICES, USD per million prompt /
+completion tokens) are tallied per flow and model in stats(), and failovers
+and hedges in events(), both on /metrics. Health is tracked per worker.
+"""
+
+import asyncio
+import logging
+import time
+from collections import deque
+from contextlib import aclosing
+from typing import AsyncIterator, Awaitable, Callable, Deque, Dict, List, NamedTuple, Optional, Tuple
+
+from empyre_backend.services import llm_client, rate_limit
+from empyre_backend.services.llm_client import Completion, Messages
+from empyre_backend.utils.settings import env
+
+MODEL_ROUTES = env("MODEL_ROUTES", "*=gpt-4o-mini>gpt-4o")  # flow=primary>fallback, "*" for the rest
+MODEL_PRICES = env("MODEL_PRICES", "gpt-4o-mini=0.15/0.6,gpt-4o=2.5/10,gpt-4=30/60")
+MODEL_HEDGE_FLOWS = env("MODEL_HEDGE_FLOWS", "core_loop,aux_offer,aux_loop,extract,tweak_log")
+MODEL_HEDGE_DEFAULT_S = float(env("MODEL_HEDGE_DEFAULT_S", "4"))  # until a flow has MODEL_HEALTH_MIN_CALLS
+MODEL_HEDGE_MIN_S = float(env("MODEL_HEDGE_MIN_S", "0.5"))
+MODEL_HEALTH_WINDOW_S = float(env("MODEL_HEALTH_WINDOW_S", "300"))
+MODEL_HEALTH_MIN_CALLS = int(env("MODEL_HEALTH_MIN_CALLS", "10"))
+MODEL_FAILOVER_ERROR_RATE = float(env("MODEL_FAILOVER_ERROR_RATE", "0.5"))
+MODEL_FAILOVER_P95_S = float(env("MODEL_FAILOVER_P95_S", "0"))  # 0: latency alone never reroutes
+WINDOW_MAX_CALLS = 200
+
+logger = logging.getLogger(__name__)
+
+
+class Route(NamedTuple):
+    primary: str
+    fallback: Optional[str] = None
+
+
+def _parse_routes(spec: str) -> Dict[str, Route]:
+    routes = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        flow, _, models = item.partition("=")
+        primary, _, fallback = models.partition(">")
+        routes[flow.strip()] = Route(primary.strip(), fallback.strip() or None)
+    return routes
+
+
+def _parse_prices(spec: str) -> Dict[str, Tuple[float, float]]:
+    prices = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        model, _, price = item.partition("=")
+        prompt, _, completion = price.partition("/")
+        prices[model.strip()] = (float(prompt), float(completion or prompt))
+    return prices
+
+
+_ROUTES = _parse_routes(MODEL_ROUTES)
+_PRICES = _parse_prices(MODEL_PRICES)
+_HEDGE_FLOWS = frozenset(filter(None, (flow.strip() for flow in MODEL_HEDGE_FLOWS.split(","))))
+DEFAULT_ROUTE = Route("gpt-4o-mini", "gpt-4o")
+
+
+def route(flow: str) -> Route:
+    return _ROUTES.get(flow) or _ROUTES.get("*") or DEFAULT_ROUTE
+
+
+class _Window:
+    """Recent calls as (monotonic time, seconds, ok), at most MODEL_HEALTH_WINDOW_S old"""
+
+    __slots__ = ("calls",)
+
+    def __init__(self):
+        self.calls: Deque[Tuple[float, float, bool]] = deque(maxlen=WINDOW_MAX_CALLS)
+
+    def add(self, seconds: float, ok: bool) -> None:
+        self.calls.append((time.monotonic(), seconds, ok))
+
+    def _recent(self) -> Deque[Tuple[float, float, bool]]:
+        cutoff = time.monotonic() - MODEL_HEALTH_WINDOW_S
+        while self.calls and self.calls[0][0] < cutoff:
+            self.calls.popleft()
+        return self.calls
+
+    def error_rate(self) -> Optional[float]:
+        calls = self._recent()
+        if len(calls) < MODEL_HEALTH_MIN_CALLS:
+            return None
+        return sum(1 for _, _, ok in calls if not ok) / len(calls)
+
+    def p95(self) -> Optional[float]:
+        durations = sorted(seconds for _, seconds, ok in self._recent() if ok)
+        if len(durations) < MODEL_HEALTH_MIN_CALLS:
+            return None
+        return durations[min(int(0.95 * len(durations)), len(durations) - 1)]
+
+
+_errors: Dict[str, _Window] = {}                  # model -> outcomes across flows
+_latency: Dict[Tuple[str, str], _Window] = {}     # (flow, model) -> durations
+_tallies: Dict[Tuple[str, str], Dict[str, float]] = {}
+_events: Dict[Tuple[str, str], int] = {}
+
+
+def stats() -> Dict[Tuple[str, str, str], float]:
+    """(flow, model, stat) -> value: calls, errors, cancelled, seconds, tokens, cost_usd, live p95_s and error_rate"""
+    out = {(flow, model, stat): value for (flow, model), tally in _tallies.items() for stat, value in tally.items()}
+    for (flow, model), window in _latency.items():
+        p95 = window.p95()
+        if p95 is not None:
+            out[(flow, model, "p95_s")] = p95
+    for (flow, model) in _tallies:
+        rate = _errors[model].error_rate() if model in _errors else None
+        if rate is not None:
+            out[(flow, model, "error_rate")] = rate
+    return out
+
+
+def events() -> Dict[Tuple[str, str], int]:
+    """(flow, event) -> count; event is failover, rerouted, hedged or hedge_won"""
+    return dict(_events)
+
+
+def _count(flow: str, event: str) -> None:
+    _events[(flow, event)] = _events.get((flow, event), 0) + 1
+
+
+def cost(model: str, prompt_tokens: Optional[int], completion_tokens: Optional[int]) -> float:
+    """USD for one call; 0 for models without a price"""
+    prompt_price, completion_price = _PRICES.get(model, (0.0, 0.0))
+    return ((prompt_tokens or 0) * prompt_price + (completion_tokens or 0) * completion_price) / 1_000_000
+
+
+def record(flow: str, model: str, seconds: float, outcome: str,
+           prompt_tokens: Optional[int] = None, completion_tokens: Optional[int] = None) -> None:
+    """Tally one call; outcome is ok, error or cancelled (a hedge that lost, or an abandoned stream)"""
+    tally = _tallies.setdefault((flow, model), {
+        "calls": 0, "errors": 0, "cancelled": 0, "seconds": 0.0,
+        "prompt_tokens": 0, "completion_tokens": 0, "cost_usd": 0.0,
+    })
+    tally["calls"] += 1
+    tally["seconds"] += seconds
+    tally["prompt_tokens"] += prompt_tokens or 0
+    tally["completion_tokens"] += completion_tokens or 0
+    tally["cost_usd"] += cost(model, prompt_tokens, completion_tokens)
+    if outcome == "cancelled":
+        # Slower than the hedge that beat it: a lower bound, still a latency sample
+        tally["cancelled"] += 1
+        _latency.setdefault((flow, model), _Window()).add(seconds, True)
+        return
+    ok = outcome == "ok"
+    if not ok:
+        tally["errors"] += 1
+    _errors.setdefault(model, _Window()).add(seconds, ok)
+    if ok:
+        _latency.setdefault((flow, model), _Window()).add(seconds, True)
+
+
+def _unhealthy(flow: str, model: str) -> bool:
+    errors = _errors.get(model)
+    rate = errors.error_rate() if errors is not None else None
+    if rate is not None and rate > MODEL_FAILOVER_ERROR_RATE:
+        return True
+    if MODEL_FAILOVER_P95_S > 0:
+        latency = _latency.get((flow, model))
+        p95 = latency.p95() if latency is not None else None
+        return p95 is not None and p95 > MODEL_FAILOVER_P95_S
+    return False
+
+
+def order(flow: str) -> List[str]:
+    """Models to try for `flow`, healthiest route first"""
+    primary, fallback = route(flow)
+    if fallback is None or fallback == primary:
+        return [primary]
+    if _unhealthy(flow, primary) and not _unhealthy(flow, fallback):
+        _count(flow, "rerouted")
+        return [fallback, primary]
+    return [primary, fallback]
+
+
+def hedge_delay(flow: str, model: str) -> float:
+    """Seconds to wait on `model` before hedging: its live p95 for the flow"""
+    latency = _latency.get((flow, model))
+    p95 = latency.p95() if latency is not None else None
+    return max(p95 if p95 is not None else MODEL_HEDGE_DEFAULT_S, MODEL_HEDGE_MIN_S)
+
+
+def _can_fail_over(exc: Exception) -> bool:
+    # The global LLM queue is shared by every model: another one won't get in either
+    return not (isinstance(exc, rate_limit.RateLimited) and exc.scope == "queue")
+
+
+async def _failover(flow: str, models: List[str], call: Callable[[str], Awaitable[str]]) -> str:
+    for index, model in enumerate(models):
+        try:
+            return await call(model)
+        except Exception as exc:
+            if index == len(models) - 1 or not _can_fail_over(exc):
+                raise
+            _count(flow, "failover")
+            logger.warning("%s call on %s failed, trying %s: %s", flow, model, models[index + 1], exc)
+    raise AssertionError("unreachable")
+
+
+async def _hedged(flow: str, models: List[str], call: Callable[[str], Awaitable[str]]) -> str:
+    first, second = models
+    tasks = [asyncio.ensure_future(call(first))]
+    try:
+        # 1. Give the first model its usual time
+        done, _ = await asyncio.wait(tasks, timeout=hedge_delay(flow, first))
+        if done or not llm_client.has_capacity():
+            try:
+                return await tasks[0]
+            except Exception as exc:
+                if not _can_fail_over(exc):
+                    raise
+                _count(flow, "failover")
+                logger.warning("%s call on %s failed, trying %s: %s", flow, first, second, exc)
+                return await call(second)
+
+        # 2. Slow: race the second model against it, first answer wins
+        _count(flow, "hedged")
+        tasks.append(asyncio.ensure_future(call(second)))
+        pending = set(tasks)
+        error: Optional[BaseException] = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    if task is tasks[1]:
+                        _count(flow, "hedge_won")
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+async def complete(flow: str, messages: Messages, temperature: float = 0.7,
+                   timeout: Optional[float] = None, json_mode: bool = False) -> str:
+    """Run one completion for `flow` on its routed models and return the text"""
+
+    async def call(model: str) -> str:
+        start = time.perf_counter()
+        try:
+            result = await llm_client.completion(model, messages, temperature, timeout, flow, json_mode)
+        except asyncio.CancelledError:
+            record(flow, model, time.perf_counter() - start, "cancelled")
+            raise
+        except Exception:
+            record(flow, model, time.perf_counter() - start, "error")
+            raise
+        record(flow, model, time.perf_counter() - start, "ok", result.prompt_tokens, result.completion_tokens)
+        return result.text
+
+    models = order(flow)
+    if len(models) > 1 and flow in _HEDGE_FLOWS:
+        return await _hedged(flow, models, call)
+    return await _failover(flow, models, call)
+
+
+async def stream(flow: str, messages: Messages, temperature: float = 0.7,
+                 timeout: Optional[float] = None, json_mode: bool = False) -> AsyncIterator[str]:
+    """
+    Yield completion text deltas for `flow`. Streams are never hedged, and fail
+    over only if the first model errors before producing any text.
+    """
+    models = order(flow)
+    for index, model in enumerate(models):
+        start = time.perf_counter()
+        usage = Completion("")
+        outcome, started = "error", False
+        try:
+            # Closed with this generator, so an abandoned stream releases its slot and records at once
+            async with aclosing(llm_client.stream_completion(
+                model, messages, temperature, timeout, flow, json_mode,
+            )) as deltas:
+                async for delta in deltas:
+                    if isinstance(delta, Completion):
+                        usage = delta
+                    else:
+                        started = True
+                        yield delta
+            outcome = "ok"
+        except (GeneratorExit, asyncio.CancelledError):
+            outcome = "cancelled"  # The consumer went away (client disconnect), not a model failure
+            raise
+        except Exception as exc:
+            if started or index == len(models) - 1 or not _can_fail_over(exc):
+                raise
+            _count(flow, "failover")
+            logger.warning("%s stream on %s failed, trying %s: %s", flow, model, models[index + 1], exc)
+        finally:
+            record(flow, model, time.perf_counter() - start, outcome, usage.prompt_tokens, usage.completion_tokens)
+        if outcome == "ok":
+            return
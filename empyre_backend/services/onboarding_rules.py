@@ -0,0 +1,308 @@
+# empyre_backend/services/onboarding_rules.py
+"""
+Deterministic fast path for the six core onboarding fields.
+
+Questions come from templates keyed by field and knowledge_level, and answers
+are parsed with regex/number/enum extractors that report a confidence score.
+ai_coach only falls back to the LLM when the local confidence is below
+ONBOARDING_CONFIDENCE_THRESHOLD. Answers that negate, hedge ("3 or 4 days",
+"maybe 3") or contradict themselves are capped at HEDGED_CONFIDENCE, and
+answers giving more than one duration are scored too low to pass, so the LLM
+reads them instead. Ages ("25 years old") are never read as training years,
+articles never count as "1", and a range ("3-4 days", "30 to 45 minutes")
+always takes its low end.
+"""
+
+import re
+import zlib
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+from empyre_backend.services.profile_service import CORE_FIELDS
+from empyre_backend.utils.settings import env
+
+ONBOARDING_FAST_PATH = env("ONBOARDING_FAST_PATH", "1") == "1"
+ONBOARDING_CONFIDENCE_THRESHOLD = float(env("ONBOARDING_CONFIDENCE_THRESHOLD", "0.8"))
+HEDGED_CONFIDENCE = 0.5
+
+
+class Extraction(NamedTuple):
+    value: Optional[str]
+    confidence: float
+
+
+# Question templates: field -> knowledge_level -> phrasings
+QUESTION_TEMPLATES: Dict[str, Dict[str, List[str]]] = {
+    "initial_goal": {
+        "default": [
+            "Welcome to the legion! What's your main fitness goal right now - build muscle, lose fat, get stronger, or something else?",
+            "Every campaign starts with an objective. What do you most want to achieve with your training?",
+        ],
+    },
+    "knowledge_level": {
+        "default": [
+            "How would you describe your training knowledge - beginner, intermediate, or advanced?",
+            "Where are you on the path, legionary: beginner, intermediate, or advanced?",
+        ],
+    },
+    "experience_years": {
+        "beginner": [
+            "How long have you been working out, if at all? Months or years are both fine.",
+        ],
+        "intermediate": [
+            "How many years have you been training consistently?",
+        ],
+        "advanced": [
+            "How many years of structured training do you have under your belt?",
+        ],
+        "default": [
+            "How many years have you been training?",
+        ],
+    },
+    "training_days_per_week": {
+        "beginner": [
+            "How many days a week can you realistically set aside for workouts?",
+        ],
+        "advanced": [
+            "How many training days per week can you commit to?",
+        ],
+        "default": [
+            "How many days per week can you train?",
+        ],
+    },
+    "session_length_min": {
+        "beginner": [
+            "About how long can each workout be? For example 30, 45 or 60 minutes.",
+        ],
+        "advanced": [
+            "What's your typical session length in minutes?",
+        ],
+        "default": [
+            "How many minutes can you spend on each session?",
+        ],
+    },
+    "equipment_access": {
+        "beginner": [
+            "What equipment can you use - a full gym, a home setup with dumbbells, or just your bodyweight?",
+        ],
+        "advanced": [
+            "What's your equipment situation - full commercial gym, home gym, or limited kit?",
+        ],
+        "default": [
+            "What equipment do you have access to?",
+        ],
+    },
+}
+
+_WORD_NUMBERS = {
+    "zero": 0, "none": 0, "one": 1, "two": 2, "couple": 2, "three": 3,
+    "four": 4, "five": 5, "six": 6, "seven": 7, "eight": 8, "nine": 9, "ten": 10,
+    "eleven": 11, "twelve": 12, "half": 0.5,
+}
+
+# Enum synonyms: canonical value -> keyword patterns
+_GOALS: List[Tuple[str, str]] = [
+    ("build muscle", r"\b(build(ing)? muscle|muscle|bulk|hypertrophy|gain (mass|size|weight)|get bigger|size)\b"),
+    ("lose fat", r"\b(lose (fat|weight)|fat loss|weight loss|cut(ting)?|shred|slim|lean(er)? out|tone)\b"),
+    ("get stronger", r"\b(strong(er)?|strength|powerlifting|lift heavier)\b"),
+    ("improve endurance", r"\b(endurance|cardio|stamina|marathon|run(ning)?|conditioning)\b"),
+    ("general fitness", r"\b(general fitness|get fit|stay fit|healthy|health|fitness)\b"),
+]
+
+_LEVELS: List[Tuple[str, str]] = [
+    ("beginner", r"\b(beginner|novice|new(bie)?|never|just start(ing|ed)|first time|no idea)\b"),
+    ("intermediate", r"\b(intermediate|some experience|moderate|decent|in between)\b"),
+    ("advanced", r"\b(advanced|expert|experienced|veteran|competitive|pro)\b"),
+]
+
+_EQUIPMENT: List[Tuple[str, str]] = [
+    ("bodyweight only", r"\b(no equipment|nothing|bodyweight|body weight|calisthenics|none)\b"),
+    ("home gym", r"\b(home gym|garage gym|home setup|gym at home|power rack at home)\b"),
+    ("dumbbells", r"\b(dumbbells?|kettlebells?)\b"),
+    ("resistance bands", r"\b(bands?|resistance bands?)\b"),
+    ("full gym", r"\b(full gym|commercial gym|gym membership|the gym|a gym|gym)\b"),
+]
+
+_NUMBER = r"\b(\d+(?:\.\d+)?|" + "|".join(sorted(_WORD_NUMBERS, key=len, reverse=True)) + r")"
+_UNIT = r"(years?|yrs?|months?|mos?|weeks?|days?|hours?|hrs?|h|minutes?|mins?)\b"
+# "N to M" / "N-M" before a unit; extractors take the low end
+_RANGE = r"(?:\s*(?:-|to)\s*(\d+(?:\.\d+)?))?"
+_YEARS = r"(years?|yrs?)\b(?!\s*old)"
+_MONTHS = r"(months?|mos?)\b(?!\s*old)"
+_HOURS = r"(hours?|hrs?|h)\b"
+_MINUTES = r"(minutes?|mins?|m)\b"
+# Ages are not training durations: "25 years old", "aged 25", "25 y/o"
+_AGE = r"\b\d+\s*(?:years?|yrs?)[\s-]*old\b|\baged?\s+\d+\b|\b\d+\s*y/?o\b"
+
+# Negative answers the extractors understand; any other negation makes the answer unsafe to parse
+_NEGATIVE_ANSWERS = r"\b(no equipment|no experience|not at all|no idea)\b"
+_NEGATION = r"\b(not|no|nor|without|cannot|can'?t|don'?t|doesn'?t|isn'?t|aren'?t|wasn'?t|haven'?t|hasn'?t)\b"
+_ALTERNATIVES = r"\b(or|or so|either|between|maybe|probably)\b"
+
+
+def _to_number(token: str) -> float:
+    token = token.lower()
+    return float(_WORD_NUMBERS[token]) if token in _WORD_NUMBERS else float(token)
+
+
+def _fmt(number: float) -> str:
+    return str(int(number)) if number == int(number) else f"{number:g}"
+
+
+def _halves(text: str) -> str:
+    """Spell halves as decimals: 'half an hour' -> '0.5 hour', 'a year and a half' -> '1.5 year'"""
+    text = re.sub(r"\bhalf an? " + _UNIT, r"0.5 \1", text)
+    text = re.sub(r"\ban? " + _UNIT + r"\s+and\s+a\s+half\b", r"1.5 \1", text)
+    text = re.sub(_NUMBER + r"\s+and\s+a\s+half\s+" + _UNIT,
+                  lambda m: f"{_fmt(_to_number(m.group(1)) + 0.5)} {m.group(2)}", text)
+    return re.sub(_NUMBER + r"\s*" + _UNIT + r"\s+and\s+a\s+half\b",
+                  lambda m: f"{_fmt(_to_number(m.group(1)) + 0.5)} {m.group(2)}", text)
+
+
+def _hedged(text: str) -> bool:
+    """True when the answer negates or offers alternatives, so a keyword match may mean the opposite"""
+    text = re.sub(_NEGATIVE_ANSWERS, " ", text)
+    return bool(re.search(_NEGATION, text) or re.search(_ALTERNATIVES, text))
+
+
+def _numbers(text: str) -> List[float]:
+    return [float(n) for n in re.findall(r"\d+(?:\.\d+)?", text)]
+
+
+def _elsewhere(text: str, match: "re.Match[str]", pattern: str) -> bool:
+    """True when `pattern` also matches outside `match`, i.e. the answer gives a second value"""
+    return bool(re.search(pattern, text[:match.start()] + " | " + text[match.end():]))
+
+
+def _match_enum(text: str, options: List[Tuple[str, str]]) -> Extraction:
+    hits = [value for value, pattern in options if re.search(pattern, text)]
+    if not hits:
+        return Extraction(None, 0.0)
+    # First pattern wins, but competing matches lower our confidence
+    return Extraction(hits[0], 0.9 if len(hits) == 1 else 0.6)
+
+
+def _extract_goal(text: str) -> Extraction:
+    return _match_enum(text, _GOALS)
+
+
+def _extract_level(text: str) -> Extraction:
+    return _match_enum(text, _LEVELS)
+
+
+def _extract_equipment(text: str) -> Extraction:
+    # A home gym also matches the generic gym pattern and usually has dumbbells or bands;
+    # only "no equipment" contradicts it
+    options = _EQUIPMENT
+    if re.search(dict(_EQUIPMENT)["home gym"], text):
+        options = [(value, pattern) for value, pattern in _EQUIPMENT if value in ("home gym", "bodyweight only")]
+    return _match_enum(text, options)
+
+
+def _extract_years(text: str) -> Extraction:
+    text = re.sub(_AGE, " ", text)
+    never = re.search(r"\b(never|no experience|not at all|none|zero)\b", text)
+    # "never been consistent but lifted 3 years": a duration next to "never" is a contradiction,
+    # and so is "1 year off, 4 years on"
+    durations = _NUMBER + r"\+?" + _RANGE + r"\s*(?:" + _YEARS + "|" + _MONTHS + ")"
+    match = re.search(durations, text)
+    conflict = 0.6 if never or (match and _elsewhere(text, match, durations)) else None
+    match = re.search(_NUMBER + r"\+?" + _RANGE + r"\s*" + _YEARS, text)
+    if match:
+        return Extraction(_fmt(_to_number(match.group(1))), conflict or (0.8 if match.group(2) else 0.95))
+    match = re.search(_NUMBER + _RANGE + r"\s*" + _MONTHS, text)
+    if match:
+        return Extraction(_fmt(round(_to_number(match.group(1)) / 12, 1)),
+                          conflict or (0.8 if match.group(2) else 0.9))
+    if re.search(r"\ban? " + _YEARS, text):
+        return Extraction("1", 0.6 if never else 0.9)
+    if never:
+        return Extraction("0", 0.9)
+    numbers = _numbers(text)
+    if len(numbers) == 1 and text.strip().replace(".", "", 1).isdigit():
+        return Extraction(_fmt(numbers[0]), 0.9)
+    if len(numbers) == 1:
+        return Extraction(_fmt(numbers[0]), 0.6)
+    return Extraction(None, 0.0)
+
+
+def _extract_days(text: str) -> Extraction:
+    if re.search(r"\b(every ?day|daily|7 days)\b", text):
+        return Extraction("7", 0.95)
+    counts = _NUMBER + _RANGE + r"\s*(days?|times|x)\b"
+    match = re.search(counts, text)
+    if match:
+        days = _to_number(match.group(1))
+        if 1 <= days <= 7:
+            if _elsewhere(text, match, counts):
+                return Extraction(_fmt(days), 0.6)
+            # A range like "3-4 days" takes the low end and is less certain
+            return Extraction(_fmt(days), 0.8 if match.group(2) else 0.95)
+    numbers = _numbers(text)
+    if len(numbers) == 1 and 1 <= numbers[0] <= 7:
+        return Extraction(_fmt(numbers[0]), 0.9 if text.strip().isdigit() else 0.7)
+    return Extraction(None, 0.0)
+
+
+def _extract_minutes(text: str) -> Extraction:
+    durations = _NUMBER + _RANGE + r"\s*(?:" + _HOURS + "|" + _MINUTES + ")"
+    # "1 hour 30 minutes" / "1 hour and 30 minutes" is one duration
+    match = re.search(_NUMBER + _RANGE + r"\s*" + _HOURS + r"(?:,?\s*(?:and\s+)?(\d+)\s*" + _MINUTES + ")?", text)
+    if match:
+        minutes = _to_number(match.group(1)) * 60 + float(match.group(4) or 0)
+        if _elsewhere(text, match, durations):
+            return Extraction(_fmt(minutes), 0.6)  # "2 hours max, usually 90 minutes"
+        return Extraction(_fmt(minutes), 0.8 if match.group(2) else 0.95)
+    match = re.search(r"(\d+)" + _RANGE + r"\s*" + _MINUTES, text)
+    if match:
+        # A range like "30 to 45 minutes" takes the low end, as days do
+        minutes = float(match.group(1))
+        if 10 <= minutes <= 240:
+            if _elsewhere(text, match, durations):
+                return Extraction(_fmt(minutes), 0.6)
+            return Extraction(_fmt(minutes), 0.95 if not match.group(2) else 0.8)
+    if re.search(r"\ban hour\b|\bhour\b", text):
+        return Extraction("60", 0.85)
+    numbers = _numbers(text)
+    if len(numbers) == 1 and 10 <= numbers[0] <= 240:
+        return Extraction(_fmt(numbers[0]), 0.9 if text.strip().isdigit() else 0.7)
+    return Extraction(None, 0.0)
+
+
+_EXTRACTORS = {
+    "initial_goal": _extract_goal,
+    "knowledge_level": _extract_level,
+    "experience_years": _extract_years,
+    "training_days_per_week": _extract_days,
+    "session_length_min": _extract_minutes,
+    "equipment_access": _extract_equipment,
+}
+
+
+def extract(field: str, message: str) -> Extraction:
+    """Parse a core field answer locally; confidence 0.0 means no match"""
+    extractor = _EXTRACTORS.get(field)
+    if extractor is None or not message:
+        return Extraction(None, 0.0)
+    text = _halves(message.lower().strip())
+    found = extractor(text)
+    if found.confidence > HEDGED_CONFIDENCE and _hedged(text):
+        return found._replace(confidence=HEDGED_CONFIDENCE)
+    return found
+
+
+def next_core_field(profile: Dict[str, Any]) -> Optional[str]:
+    """Return the first missing core field, or None when core is complete"""
+    return next((f for f in CORE_FIELDS if f not in profile), None)
+
+
+def next_question(profile: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Templated question for the next missing core field"""
+    field = next_core_field(profile)
+    if field is None:
+        return None
+    templates = QUESTION_TEMPLATES[field]
+    level = str(profile.get("knowledge_level") or "").lower()
+    options = templates.get(level) or templates["default"]
+    # Stable per-user variant so users don't all see the same wording
+    seed = zlib.crc32(str(profile.get("user_id", "")).encode())
+    return {"type": "question", "field": field, "text": options[seed % len(options)]}
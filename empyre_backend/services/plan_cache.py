@@ -0,0 +1,196 @@
+# empyre_backend/services/plan_cache.py
+"""
+Plan cache keyed by a normalized profile fingerprint.
+
+Users with near-identical core profiles (same goal, level, bucketed
+experience, days, session length and equipment) share a generated plan
+instead of each triggering a fresh plan generation. Profiles with auxiliary
+answers beyond PLAN_CACHE_MAX_AUX_FIELDS, or with `plan_cache_opt_out` set,
+always get a fresh plan.
+
+PLAN_CACHE_BACKEND selects "memory" (per-worker LRU + TTL), "redis" (any
+Redis-compatible server at PLAN_CACHE_URL, shared across workers) or "off".
+"""
+
+import copy
+import hashlib
+import json
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from empyre_backend.services import onboarding_rules, profile_service
+from empyre_backend.utils.settings import env
+
+PLAN_CACHE_BACKEND = env("PLAN_CACHE_BACKEND", "memory")
+PLAN_CACHE_URL = env("PLAN_CACHE_URL", "redis://localhost:6379/0")
+PLAN_CACHE_TTL_S = int(env("PLAN_CACHE_TTL_S", "86400"))
+PLAN_CACHE_MAX_ENTRIES = int(env("PLAN_CACHE_MAX_ENTRIES", "1024"))
+PLAN_CACHE_MAX_AUX_FIELDS = int(env("PLAN_CACHE_MAX_AUX_FIELDS", "0"))
+
+# Bucket upper bounds; values above the last bound share the last bucket
+_EXPERIENCE_BUCKETS = [(1, "<1y"), (3, "1-3y"), (5, "3-5y"), (float("inf"), "5y+")]
+_SESSION_BUCKETS = [(30, "<=30"), (45, "31-45"), (60, "46-60"), (90, "61-90"), (float("inf"), "90+")]
+
+
+def _number(value: Any) -> Optional[float]:
+    try:
+        return float(str(value).strip())
+    except (TypeError, ValueError):
+        return None
+
+
+def _bucket(value: Any, buckets) -> Optional[str]:
+    number = _number(value)
+    if number is None:
+        return None
+    return next(label for bound, label in buckets if number <= bound)
+
+
+def _canonical(field: str, value: Any) -> str:
+    """Map free text onto the onboarding enums where the rules engine is confident"""
+    text = str(value).strip().lower()
+    found = onboarding_rules.extract(field, text)
+    if found.value is not None and found.confidence >= onboarding_rules.ONBOARDING_CONFIDENCE_THRESHOLD:
+        return found.value
+    return " ".join(text.split())
+
+
+def is_cacheable(profile: Dict[str, Any]) -> bool:
+    """Per-user opt-out: explicit flag, or more auxiliary detail than the cache tolerates"""
+    if profile.get("plan_cache_opt_out"):
+        return False
+    return len(profile_service.aux_fields(profile)) <= PLAN_CACHE_MAX_AUX_FIELDS
+
+
+def fingerprint(profile: Dict[str, Any]) -> Optional[str]:
+    """Stable hash of the plan-relevant profile fields, or None if not cacheable"""
+    if not profile_service.is_core_complete(profile) or not is_cacheable(profile):
+        return None
+    days = _number(profile["training_days_per_week"])
+    canonical = {
+        "goal": _canonical("initial_goal", profile["initial_goal"]),
+        "level": _canonical("knowledge_level", profile["knowledge_level"]),
+        "experience": _bucket(profile["experience_years"], _EXPERIENCE_BUCKETS),
+        "days": int(days) if days is not None else str(profile["training_days_per_week"]),
+        "session": _bucket(profile["session_length_min"], _SESSION_BUCKETS),
+        "equipment": _canonical("equipment_access", profile["equipment_access"]),
+    }
+    encoded = json.dumps(canonical, sort_keys=True).encode()
+    return hashlib.sha256(encoded).hexdigest()[:32]
+
+
+def personalize(plan: Dict[str, Any], profile: Dict[str, Any]) -> Dict[str, Any]:
+    """Lightly tailor a shared plan to this user without another LLM call"""
+    plan = copy.deepcopy(plan)
+    intro = (
+        f"Built for your goal to {profile.get('initial_goal')}: "
+        f"{profile.get('training_days_per_week')} days a week, "
+        f"about {profile.get('session_length_min')} minutes per session."
+    )
+    plan["notes"] = f"{intro} {plan.get('notes') or ''}".strip()
+    return plan
+
+
+class InMemoryPlanCache:
+    """Per-worker LRU cache with TTL expiry"""
+
+    def __init__(self, max_entries: int = PLAN_CACHE_MAX_ENTRIES, ttl_s: int = PLAN_CACHE_TTL_S):
+        self.max_entries = max_entries
+        self.ttl_s = ttl_s
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, plan = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return plan
+
+    async def set(self, key: str, plan: Dict[str, Any]) -> None:
+        self._entries[key] = (time.monotonic() + self.ttl_s, plan)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+class RedisPlanCache:
+    """Redis-compatible backend shared by every worker (needs the `redis` package)"""
+
+    def __init__(self, url: str = PLAN_CACHE_URL, ttl_s: int = PLAN_CACHE_TTL_S, prefix: str = "empyre:plan:"):
+        import redis.asyncio as redis
+
+        self._redis = redis.from_url(url)
+        self.ttl_s = ttl_s
+        self.prefix = prefix
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        raw = await self._redis.get(self.prefix + key)
+        return json.loads(raw) if raw else None
+
+    async def set(self, key: str, plan: Dict[str, Any]) -> None:
+        await self._redis.set(self.prefix + key, json.dumps(plan), ex=self.ttl_s)
+
+
+_stats = {"hits": 0, "misses": 0, "bypassed": 0, "stores": 0, "errors": 0}
+_cache = None
+
+
+def get_cache():
+    """Return the configured backend, or None when caching is off"""
+    global _cache
+    if _cache is None and PLAN_CACHE_BACKEND != "off":
+        _cache = RedisPlanCache() if PLAN_CACHE_BACKEND == "redis" else InMemoryPlanCache()
+    return _cache
+
+
+def set_cache(cache) -> None:
+    """Swap the backend (used by benchmarks)"""
+    global _cache
+    _cache = cache
+
+
+def stats() -> Dict[str, Any]:
+    """Hit/miss counters and hit rate for this worker"""
+    lookups = _stats["hits"] + _stats["misses"]
+    return {**_stats, "hit_rate": _stats["hits"] / lookups if lookups else 0.0}
+
+
+async def lookup(profile: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+    """Return a personalized cached plan for this profile, or None"""
+    cache = get_cache()
+    key = fingerprint(profile) if cache is not None else None
+    if key is None:
+        _stats["bypassed"] += 1
+        return None
+    try:
+        plan = await cache.get(key)
+    except Exception:
+        # A cache outage must never fail plan generation
+        _stats["errors"] += 1
+        return None
+    if plan is None:
+        _stats["misses"] += 1
+        return None
+    _stats["hits"] += 1
+    return personalize(plan, profile)
+
+
+async def store(profile: Dict[str, Any], plan: Dict[str, Any]) -> None:
+    """Remember a freshly generated plan under the profile's fingerprint"""
+    cache = get_cache()
+    key = fingerprint(profile) if cache is not None else None
+    if key is None:
+        return
+    try:
+        await cache.set(key, plan)
+        _stats["stores"] += 1
+    except Exception:
+        _stats["errors"] += 1
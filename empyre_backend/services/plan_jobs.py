@@ -0,0 +1,271 @@
+# empyre_backend/services/plan_jobs.py
+"""
+Background plan generation queue, stored in the `plan_jobs` table.
+
+Once a profile is plan-ready (the optional questions were declined or
+answered), the next step is always plan generation. The turn that gets there
+queues a job for the profile and answers straight away; the plan is
+generated in the background and handed over on the user's next message. If
+that message arrives while the job is still running, the turn waits up to
+PLAN_JOBS_WAIT_S for it.
+
+Jobs are claimed with a conditional UPDATE, so any number of processes can
+run them without an outside broker. Each claim takes up to
+PLAN_JOBS_BATCH_SIZE due jobs and runs them concurrently, at most
+PLAN_JOBS_CONCURRENCY per process. Failed attempts are retried with
+exponential backoff (in inline mode, by the next run after the backoff), and
+a job whose worker died is picked up again when its lease runs out. Every
+claim stores a fresh token and a run writes its outcome only while the job
+still carries that token, so a slow run whose lease was re-claimed (or whose
+job was re-queued) cannot overwrite the newer attempt. A job
+remembers the plan prompt it was queued for, so a profile patched in the
+meantime gets a fresh job instead of a stale plan.
+
+PLAN_JOBS_MODE picks "inline" (the queuing request runs due jobs as a
+background task), "worker" (a polling worker, at startup or via
+`python -m empyre_backend.services.plan_jobs`) or "off" (generate inside the
+request, as before). /chat/stream generates inside the request, streaming the
+tokens, unless a job for the profile is already queued.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import time
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from sqlalchemy import delete, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from empyre_backend.db import PlanJob, dialect_insert
+from empyre_backend.services import ai_coach, prompt_context, rate_limit
+from empyre_backend.services.profile_service import ProfileSession
+from empyre_backend.utils.settings import env
+
+PLAN_JOBS_MODE = env("PLAN_JOBS_MODE", "inline")  # "inline", "worker" or "off"
+PLAN_JOBS_CONCURRENCY = int(env("PLAN_JOBS_CONCURRENCY", "8"))
+PLAN_JOBS_BATCH_SIZE = int(env("PLAN_JOBS_BATCH_SIZE", "16"))
+PLAN_JOBS_MAX_ATTEMPTS = int(env("PLAN_JOBS_MAX_ATTEMPTS", "3"))
+PLAN_JOBS_RETRY_S = float(env("PLAN_JOBS_RETRY_S", "5"))
+PLAN_JOBS_LEASE_S = float(env("PLAN_JOBS_LEASE_S", "300"))
+PLAN_JOBS_WAIT_S = float(env("PLAN_JOBS_WAIT_S", "20"))
+PLAN_JOBS_POLL_S = float(env("PLAN_JOBS_POLL_S", "2"))
+WAIT_POLL_S = 0.25
+
+PENDING_TEXT = "Your battle plan is being forged, legionary. Send me a message in a moment to receive it."
+
+logger = logging.getLogger(__name__)
+
+_slots: Optional[asyncio.Semaphore] = None
+_wake = asyncio.Event()
+_stats = {
+    "enqueued": 0, "claimed": 0, "done": 0, "retried": 0, "failed": 0,
+    "delivered": 0, "waited": 0, "pending_replies": 0, "fallbacks": 0, "superseded": 0,
+}
+
+
+def stats() -> Dict[str, int]:
+    return dict(_stats)
+
+
+def _get_slots() -> asyncio.Semaphore:
+    global _slots
+    if _slots is None:
+        _slots = asyncio.Semaphore(PLAN_JOBS_CONCURRENCY)
+    return _slots
+
+
+def fingerprint(profile: Dict[str, Any]) -> str:
+    """Hash of the plan_gen prompt payload: equal fingerprints get the same plan request"""
+    payload = json.dumps(prompt_context.build("plan_gen", profile), sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()[:32]
+
+
+def pending_reply() -> Dict[str, Any]:
+    _stats["pending_replies"] += 1
+    return {"type": "plan_pending", "text": PENDING_TEXT}
+
+
+async def enqueue(session: ProfileSession, job_fingerprint: Optional[str] = None) -> None:
+    """Queue (or re-queue) plan generation for the session's profile, in the turn's transaction"""
+    now = datetime.utcnow()
+    insert = dialect_insert(session.db)
+    stmt = insert(PlanJob).values(
+        user_id=session.user_id, status="pending",
+        fingerprint=job_fingerprint or fingerprint(session.data), profile_data=session.data,
+        plan_data=None, attempts=0, error=None, run_after=now, claim_token=None, created_at=now, updated_at=now,
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[PlanJob.user_id],
+        set_={
+            field: stmt.excluded[field]
+            for field in ("status", "fingerprint", "profile_data", "plan_data", "attempts", "error",
+                          "run_after", "claim_token", "created_at", "updated_at")
+        },
+    )
+    await session.db.execute(stmt)
+    session.on_commit(_wake.set)
+    _stats["enqueued"] += 1
+
+
+async def _get(session: ProfileSession) -> Optional[Any]:
+    """The user's job (status, fingerprint, plan), read in a transaction that ends straight away"""
+    result = await session.db.execute(
+        select(PlanJob.status, PlanJob.fingerprint, PlanJob.plan_data).where(PlanJob.user_id == session.user_id)
+    )
+    job = result.first()
+    await session.release()
+    return job
+
+
+async def queued(session: ProfileSession) -> bool:
+    """True when a job exists for the profile as it is now (pending, running or finished)"""
+    job = await _get(session)
+    return job is not None and job.fingerprint == fingerprint(session.data)
+
+
+async def discard(session: ProfileSession) -> None:
+    """Drop the user's job in the turn's transaction (the plan was generated in the request)"""
+    await session.db.execute(delete(PlanJob).where(PlanJob.user_id == session.user_id))
+
+
+async def take(session: ProfileSession) -> Optional[Dict[str, Any]]:
+    """
+    The plan response for this plan_gen turn, or None when it is not ready yet
+    (the job is queued here if the profile has none). A job that ran out of
+    attempts falls back to generating in the request.
+    """
+    user_id = session.user_id
+    job_fingerprint = fingerprint(session.data)
+    job = await _get(session)
+
+    # 1. Nothing queued for this profile yet, or the profile changed since
+    if job is None or job.fingerprint != job_fingerprint:
+        await enqueue(session, job_fingerprint)
+        return None
+
+    # 2. Generation is underway: give it a little longer
+    if job.status == "running":
+        _stats["waited"] += 1
+        deadline = time.monotonic() + PLAN_JOBS_WAIT_S
+        while job is not None and job.status == "running" and time.monotonic() < deadline:
+            await asyncio.sleep(WAIT_POLL_S)
+            job = await _get(session)
+        if job is None:
+            return None
+
+    # 3. Hand over the result
+    if job.status == "done":
+        await session.db.execute(delete(PlanJob).where(PlanJob.user_id == user_id))
+        _stats["delivered"] += 1
+        return {"type": "plan", "plan": job.plan_data, "text": "Here's your personalized plan!"}
+    if job.status == "failed":
+        # Generate before touching the job so no transaction is open during the LLM call
+        _stats["fallbacks"] += 1
+        resp = await ai_coach.generate_plan_flow(session.data)
+        await session.db.execute(delete(PlanJob).where(PlanJob.user_id == user_id))
+        return resp
+    return None
+
+
+class Claim(NamedTuple):
+    user_id: str
+    profile_data: Dict[str, Any]
+    attempt: int  # 1 for the first run
+    token: str
+
+
+async def _claim(db: AsyncSession, limit: int) -> List[Claim]:
+    """Mark up to `limit` due jobs as running under this worker's lease"""
+    now = datetime.utcnow()
+    due = (PlanJob.status.in_(("pending", "running")), PlanJob.run_after <= now)
+    result = await db.execute(
+        select(PlanJob.user_id, PlanJob.fingerprint, PlanJob.profile_data)
+        .where(*due)
+        .order_by(PlanJob.run_after)
+        .limit(limit)
+    )
+    claimed = []
+    for job in result.all():
+        # Conditional on the job still being due, so two workers never both claim it
+        token = uuid.uuid4().hex
+        attempt = (await db.execute(
+            update(PlanJob)
+            .where(PlanJob.user_id == job.user_id, PlanJob.fingerprint == job.fingerprint, *due)
+            .values(status="running", attempts=PlanJob.attempts + 1, claim_token=token,
+                    run_after=now + timedelta(seconds=PLAN_JOBS_LEASE_S), updated_at=now)
+            .returning(PlanJob.attempts)
+        )).scalar_one_or_none()
+        if attempt is not None:
+            claimed.append(Claim(job.user_id, job.profile_data, attempt, token))
+    await db.commit()
+    _stats["claimed"] += len(claimed)
+    return claimed
+
+
+async def _run(session_factory, job: Claim) -> None:
+    async with _get_slots():
+        attempts = job.attempt
+        try:
+            resp = await ai_coach.generate_plan_flow(dict(job.profile_data))
+            values: Dict[str, Any] = {"status": "done", "plan_data": resp["plan"], "error": None}
+            _stats["done"] += 1
+        except Exception as exc:
+            logger.warning("Plan job for %s failed (attempt %d): %s", job.user_id, attempts, exc)
+            values = {"error": str(exc)[:500]}
+            if attempts >= PLAN_JOBS_MAX_ATTEMPTS:
+                values["status"] = "failed"
+                _stats["failed"] += 1
+            else:
+                backoff = PLAN_JOBS_RETRY_S * 2 ** (attempts - 1)
+                if isinstance(exc, rate_limit.RateLimited):
+                    backoff = max(backoff, exc.retry_after)
+                values.update(status="pending", run_after=datetime.utcnow() + timedelta(seconds=backoff))
+                _stats["retried"] += 1
+
+    # Only this claim may finish the job: a re-claim after the lease ran out, or a
+    # re-queue for a changed profile, replaced the token and keeps its own state
+    async with session_factory() as db:
+        updated = await db.execute(
+            update(PlanJob)
+            .where(PlanJob.user_id == job.user_id, PlanJob.claim_token == job.token,
+                   PlanJob.status == "running")
+            .values(**values, claim_token=None, updated_at=datetime.utcnow())
+        )
+        await db.commit()
+    if not updated.rowcount:
+        _stats["superseded"] += 1
+
+
+async def run_pending(session_factory, batch_size: int = PLAN_JOBS_BATCH_SIZE) -> int:
+    """Claim one batch of due jobs and run them concurrently; returns the number claimed"""
+    async with session_factory() as db:
+        jobs = await _claim(db, batch_size)
+    await asyncio.gather(*(_run(session_factory, job) for job in jobs))
+    return len(jobs)
+
+
+async def run_worker(session_factory, poll_s: float = PLAN_JOBS_POLL_S) -> None:
+    """Background worker: drain due jobs, then wait for a new one or `poll_s` seconds"""
+    while True:
+        _wake.clear()
+        try:
+            while await run_pending(session_factory) >= PLAN_JOBS_BATCH_SIZE:
+                pass
+        except Exception:
+            logger.exception("Plan job batch failed")
+        try:
+            await asyncio.wait_for(_wake.wait(), timeout=poll_s)
+        except asyncio.TimeoutError:
+            pass
+
+
+if __name__ == "__main__":
+    # Standalone worker: python -m empyre_backend.services.plan_jobs
+    from empyre_backend.db import AsyncSessionLocal
+
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(run_worker(AsyncSessionLocal))
@@ -0,0 +1,204 @@
+# empyre_backend/services/plan_schema.py
+"""
+Plan schema and local guardrail checks.
+
+A plan is checked section by section, using the sections plan_stream emits
+(split type, each "Day N", meals and notes). A failure therefore names the
+block to regenerate rather than condemning the whole plan. The checks are:
+
+* shape, via the Pydantic models below (JSON Schema: Plan.model_json_schema());
+* sets 1-6 and reps 1-25 for every exercise;
+* non-negative macros, with protein >= 1.2 g/kg and fats >= 0.25 g/kg when the
+  profile has a body weight;
+* for output that had to be salvaged, no gaps in "Day 1".."Day N" for the
+  user's training days per week, which catches a completion cut off mid-split.
+
+The remaining prompt guardrails (deficit vs TDEE, weekly hours, compound
+coverage, BMI disclaimer) need judgement the profile data can't settle locally
+and stay with the model.
+"""
+
+import json
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from pydantic import BaseModel, Field, TypeAdapter, ValidationError
+from typing_extensions import Annotated
+
+from empyre_backend.services import plan_stream
+from empyre_backend.utils.settings import env
+
+PLAN_REPAIR_ATTEMPTS = int(env("PLAN_REPAIR_ATTEMPTS", "2"))
+PLAN_MAX_REGENERATIONS = int(env("PLAN_MAX_REGENERATIONS", "1"))
+
+MIN_SETS, MAX_SETS = 1, 6
+MIN_REPS, MAX_REPS = 1, 25
+PROTEIN_G_PER_KG = 1.2
+FATS_G_PER_KG = 0.25
+
+Issues = Dict[str, str]  # section name -> what is wrong with it
+
+
+class PlanExercise(BaseModel):
+    exercise: Annotated[str, Field(min_length=1)]
+    sets: Annotated[int, Field(ge=MIN_SETS, le=MAX_SETS)]
+    reps: Annotated[int, Field(ge=MIN_REPS, le=MAX_REPS)]
+
+
+class PlanSplit(BaseModel):
+    type: Annotated[str, Field(min_length=1)]
+    days: Dict[str, Annotated[List[PlanExercise], Field(min_length=1)]]
+
+
+class TargetMacros(BaseModel):
+    protein_g: Annotated[float, Field(ge=0)]
+    carbs_g: Annotated[float, Field(ge=0)]
+    fats_g: Annotated[float, Field(ge=0)]
+
+
+class PlanMeals(BaseModel):
+    target_macros: TargetMacros
+    sample_day: Dict[str, str]
+
+
+class Plan(BaseModel):
+    split: PlanSplit
+    meals: PlanMeals
+    notes: Optional[str] = None
+
+
+_SPLIT_TYPE = TypeAdapter(Annotated[str, Field(min_length=1)])
+_DAY = TypeAdapter(Annotated[List[PlanExercise], Field(min_length=1)])
+_MEALS = TypeAdapter(PlanMeals)
+_DAY_NAME = re.compile(r"^Day (\d+)$")
+_NUMBER = re.compile(r"\d+(?:\.\d+)?")
+
+
+_stats = {
+    "plans": 0, "valid_first_pass": 0, "repaired": 0, "repair_calls": 0,
+    "sections_repaired": 0, "regenerations": 0, "failed": 0,
+}
+
+
+def stats() -> Dict[str, int]:
+    return dict(_stats)
+
+
+def record(event: str, count: int = 1) -> None:
+    _stats[event] += count
+
+
+class InvalidPlan(ValueError):
+    """A plan that still fails validation after repair and regeneration"""
+
+    def __init__(self, issues: Issues):
+        self.issues = issues
+        super().__init__("; ".join(f"{name}: {problem}" for name, problem in issues.items()))
+
+
+def _first_error(exc: ValidationError) -> str:
+    error = exc.errors()[0]
+    where = ".".join(str(part) for part in error["loc"])
+    return f"{where}: {error['msg']}" if where else error["msg"]
+
+
+def _number(value: Any) -> Optional[float]:
+    match = _NUMBER.search(str(value)) if value is not None else None
+    return float(match.group(0)) if match else None
+
+
+def body_weight_kg(profile: Dict[str, Any]) -> Optional[float]:
+    """Body weight from the profile answers, if any (pounds are converted)"""
+    for key in ("weight_kg", "body_weight_kg", "weight", "body_weight", "bodyweight"):
+        number = _number(profile.get(key))
+        if number:
+            return number * 0.4536 if "lb" in str(profile.get(key)).lower() else number
+    return None
+
+
+def expected_days(profile: Dict[str, Any]) -> Optional[int]:
+    days = _number(profile.get("training_days_per_week"))
+    return min(max(int(days), 1), 7) if days else None
+
+
+def _order_days(days: Dict[str, Any]) -> Dict[str, Any]:
+    if all(_DAY_NAME.match(name) for name in days):
+        return dict(sorted(days.items(), key=lambda item: int(_DAY_NAME.match(item[0]).group(1))))
+    return days
+
+
+def validate(plan: Dict[str, Any], profile: Dict[str, Any], broken: List[str] = (),
+             salvaged: bool = False) -> Tuple[Dict[str, Any], Issues]:
+    """
+    Check a (possibly partial) plan. Returns the valid sections, normalized,
+    as a plan, and the invalid or missing sections with the reason for each.
+    `broken` names sections already known to be unparseable; `salvaged` plans
+    were recovered from malformed output, so missing days are reported too.
+    """
+    issues: Issues = {name: "invalid JSON" for name in broken}
+    parts: List[plan_stream.Section] = []
+    plan = plan if isinstance(plan, dict) else {}
+
+    # 1. Split type and days
+    split = plan.get("split") if isinstance(plan.get("split"), dict) else {}
+    try:
+        parts.append(("split_type", _SPLIT_TYPE.validate_python(split.get("type"))))
+    except ValidationError as exc:
+        issues["split_type"] = _first_error(exc)
+    days = split.get("days") if isinstance(split.get("days"), dict) else {}
+    for name, exercises in days.items():
+        try:
+            parts.append((name, [item.model_dump() for item in _DAY.validate_python(exercises)]))
+        except ValidationError as exc:
+            issues[name] = _first_error(exc)
+    wanted = expected_days(profile)
+    if salvaged and wanted and days and all(_DAY_NAME.match(name) for name in days):
+        for number in range(1, wanted + 1):
+            if f"Day {number}" not in days:
+                issues.setdefault(f"Day {number}", "missing")
+    if not days and not any(_DAY_NAME.match(name) for name in issues):
+        issues["split"] = "no training days"
+
+    # 2. Meals, with macro floors when the body weight is known
+    try:
+        meals = _MEALS.validate_python(plan.get("meals"))
+        weight = body_weight_kg(profile)
+        macros = meals.target_macros
+        if weight and macros.protein_g < PROTEIN_G_PER_KG * weight:
+            issues["meals"] = f"protein_g below {PROTEIN_G_PER_KG} g/kg ({PROTEIN_G_PER_KG * weight:.0f} g)"
+        elif weight and macros.fats_g < FATS_G_PER_KG * weight:
+            issues["meals"] = f"fats_g below {FATS_G_PER_KG} g/kg ({FATS_G_PER_KG * weight:.0f} g)"
+        else:
+            parts.append(("meals", meals.model_dump()))
+    except ValidationError as exc:
+        issues["meals"] = _first_error(exc)
+
+    # 3. Notes are optional: anything unusable is dropped rather than repaired
+    if isinstance(plan.get("notes"), str):
+        parts.append(("notes", plan["notes"]))
+
+    valid = plan_stream.assemble(parts)
+    if "days" in valid.get("split", {}):
+        valid["split"]["days"] = _order_days(valid["split"]["days"])
+    return valid, issues
+
+
+def check_text(content: str, profile: Dict[str, Any]) -> Tuple[Dict[str, Any], Issues]:
+    """validate() for raw model output, salvaging what parses when the JSON is malformed"""
+    try:
+        start, end = content.find("{"), content.rfind("}")
+        return validate(json.loads(content[start:end + 1]), profile)
+    except ValueError:
+        plan, broken = plan_stream.salvage(content)
+        return validate(plan, profile, broken, salvaged=True)
+
+
+def repairable(plan: Dict[str, Any], issues: Issues) -> bool:
+    """Section repair needs at least one valid training day to stay consistent with"""
+    return bool(plan.get("split", {}).get("days")) and "split" not in issues
+
+
+def merge(plan: Dict[str, Any], fixes: Dict[str, Any]) -> Dict[str, Any]:
+    """Replace or add the given sections (a None value drops the section)"""
+    parts = [(name, value) for name, value in plan_stream.sections(plan) if name not in fixes]
+    return plan_stream.assemble(parts + [(name, value) for name, value in fixes.items() if value is not None])
@@ -0,0 +1,178 @@
+# empyre_backend/services/plan_store.py
+"""
+Versioned plan storage in the `plans` table.
+
+A generated plan becomes a Plan row (version 1) and the user's previous
+active plan is deactivated; a partial unique index keeps one active plan per
+user. A tweak's `plan_update` is validated section by section and stored as
+a PlanRevision holding only the JSON Patch from the previous version, so a
+swapped exercise costs a few dozen bytes instead of another copy of the plan.
+
+The profile row points at the active plan and version (`plan_id`,
+`plan_version`). Materialized plans are kept in an in-process LRU keyed by
+plan id and checked against that pointer, so a warm tweak turn reads no plan
+rows at all; a cache entry a few versions behind only replays the newer
+patches. Cached plans are shared: treat them as read-only.
+"""
+
+import copy
+from collections import OrderedDict
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from empyre_backend.db import Plan, PlanRevision
+from empyre_backend.services import plan_schema, plan_stream
+from empyre_backend.services.profile_service import ProfileSession
+from empyre_backend.utils import json_patch
+from empyre_backend.utils.settings import env
+
+PLAN_STORE_CACHE_MAX_PLANS = int(env("PLAN_STORE_CACHE_MAX_PLANS", "1000"))
+
+_cache: "OrderedDict[int, Tuple[int, Dict[str, Any]]]" = OrderedDict()  # plan id -> (version, plan)
+_stats = {"hits": 0, "misses": 0, "plans": 0, "revisions": 0, "rejected_sections": 0}
+
+
+def stats() -> Dict[str, int]:
+    return {**_stats, "cached_plans": len(_cache)}
+
+
+def clear() -> None:
+    _cache.clear()
+
+
+def _put(plan_id: int, version: int, plan: Dict[str, Any]) -> None:
+    cached = _cache.get(plan_id)
+    if cached is not None and cached[0] > version:
+        return  # Never replace a newer version with an older one
+    _cache[plan_id] = (version, plan)
+    _cache.move_to_end(plan_id)
+    while len(_cache) > PLAN_STORE_CACHE_MAX_PLANS:
+        _cache.popitem(last=False)
+
+
+async def materialize(db: AsyncSession, plan_id: int, version: int) -> Optional[Dict[str, Any]]:
+    """Plan `plan_id` as of `version`: the base document with its revisions applied"""
+    cached = _cache.get(plan_id)
+    if cached is not None and cached[0] == version:
+        _stats["hits"] += 1
+        _cache.move_to_end(plan_id)
+        return cached[1]
+
+    # 1. Start from an older cached version when there is one, else the base row
+    _stats["misses"] += 1
+    if cached is not None and cached[0] < version:
+        start, plan = cached
+    else:
+        plan = (await db.execute(select(Plan.plan_data).where(Plan.id == plan_id))).scalar_one_or_none()
+        if plan is None:
+            return None
+        start = 1
+
+    # 2. Replay the patches in between
+    if version > start:
+        result = await db.execute(
+            select(PlanRevision.patch)
+            .where(PlanRevision.plan_id == plan_id, PlanRevision.version > start,
+                   PlanRevision.version <= version)
+            .order_by(PlanRevision.version)
+        )
+        for patch in result.scalars().all():
+            plan = json_patch.apply(plan, patch)
+    _put(plan_id, version, plan)
+    return plan
+
+
+async def load(session: ProfileSession) -> Optional[Dict[str, Any]]:
+    """The user's active plan as of this turn; no query when the cached copy is current"""
+    if session.plan_id is None:
+        return None
+    return await materialize(session.db, session.plan_id, session.plan_version)
+
+
+async def active_plan(user_id: str, db: AsyncSession) -> Optional[Tuple[int, int, Dict[str, Any]]]:
+    """(plan id, version, plan) of the user's active plan, for callers without a ProfileSession"""
+    row = (await db.execute(
+        select(Plan.id, Plan.version).where(Plan.user_id == user_id, Plan.is_active.is_(True))
+    )).first()
+    if row is None:
+        return None
+    plan = await materialize(db, row.id, row.version)
+    return (row.id, row.version, plan) if plan is not None else None
+
+
+async def create(session: ProfileSession, plan: Dict[str, Any]) -> None:
+    """Store a newly generated plan as the user's active plan, in the turn's transaction"""
+    user_id = session.user_id
+    row = Plan(user_id=user_id, plan_data=plan, version=1, is_active=True)
+    # A concurrent turn's active plan trips uq_plans_user_id_active: ProfileConflict
+    async with session.guard():
+        await session.db.execute(
+            update(Plan).where(Plan.user_id == user_id, Plan.is_active.is_(True)).values(is_active=False)
+        )
+        session.db.add(row)
+        await session.db.flush()  # Assigns row.id for the profile pointer
+    session.set_plan(row.id, 1)
+    session.on_commit(lambda: _put(row.id, 1, plan))
+    _stats["plans"] += 1
+
+
+def _replace_sections(plan: Dict[str, Any], sections: Dict[str, Any]) -> Dict[str, Any]:
+    """`plan` with the named sections replaced, or dropped when None; other keys are kept"""
+    plan = copy.deepcopy(plan)
+    for name, value in sections.items():
+        if name == "split_type":
+            parent, key = plan.setdefault("split", {}), "type"
+        elif name in ("meals", "notes"):
+            parent, key = plan, name
+        else:
+            parent, key = plan.setdefault("split", {}).setdefault("days", {}), name
+        if value is None:
+            parent.pop(key, None)
+        else:
+            parent[key] = value
+    return plan
+
+
+async def apply_update(session: ProfileSession, plan_update: Any) -> Optional[Dict[str, Any]]:
+    """
+    Merge a tweak's plan_update ({section name: new value or None}) into the
+    active plan as a new revision. Sections that fail validation are left as
+    they were. Returns the new plan, or None when nothing changed.
+    """
+    current = await load(session)
+    if current is None or not isinstance(plan_update, dict) or not plan_update:
+        return None
+
+    # 1. Keep only the sections that validate against the rest of the plan
+    candidate, issues = plan_schema.validate(plan_schema.merge(current, plan_update), session.data)
+    if "split" in issues:
+        _stats["rejected_sections"] += len(plan_update)
+        return None
+    valid = dict(plan_stream.sections(candidate))
+    accepted = {
+        name: None if value is None else valid[name]
+        for name, value in plan_update.items()
+        if value is None or (name in valid and name not in issues)
+    }
+    _stats["rejected_sections"] += len(plan_update) - len(accepted)
+
+    # 2. Store the difference as the next revision
+    new_plan = _replace_sections(current, accepted)
+    patch = json_patch.diff(current, new_plan)
+    if not patch:
+        return None
+    plan_id, version = session.plan_id, session.plan_version + 1
+    # A concurrent tweak that took this version trips uq_plan_revisions_plan_id_version: ProfileConflict
+    async with session.guard():
+        session.db.add(PlanRevision(plan_id=plan_id, version=version, patch=patch))
+        await session.db.flush()
+        await session.db.execute(
+            update(Plan).where(Plan.id == plan_id).values(version=version, updated_at=datetime.utcnow())
+        )
+    session.set_plan(plan_id, version)
+    session.on_commit(lambda: _put(plan_id, version, new_plan))
+    _stats["revisions"] += 1
+    return new_plan
@@ -0,0 +1,168 @@
+# empyre_backend/services/plan_stream.py
+"""
+Incremental JSON parser for streamed plan completions.
+
+Feed it text deltas as they arrive; it emits each plan section as soon as its
+closing bracket is seen: `split.type`, every `split.days["Day N"]`, `meals`
+and `notes`. Anything outside the JSON document (e.g. markdown fences) is
+skipped.
+"""
+
+import json
+from typing import Any, Dict, List, Optional, Tuple
+
+Section = Tuple[str, Any]
+
+
+class _Frame:
+    __slots__ = ("is_object", "key", "expect_key")
+
+    def __init__(self, is_object: bool):
+        self.is_object = is_object
+        self.key: Optional[str] = None
+        self.expect_key = is_object
+
+
+def _section_name(path: Tuple[Optional[str], ...]) -> Optional[str]:
+    if len(path) == 3 and path[:2] == ("split", "days") and path[2]:
+        return path[2]
+    if path == ("split", "type"):
+        return "split_type"
+    if path in (("meals",), ("notes",)):
+        return path[0]
+    return None
+
+
+class IncrementalPlanParser:
+    """Emit completed plan sections from a stream of JSON text deltas"""
+
+    def __init__(self, lenient: bool = False):
+        self.text = ""
+        # Lenient parsers skip sections whose JSON is invalid and list them here
+        self.lenient = lenient
+        self.broken: List[str] = []
+        self._pos = 0
+        self._stack: List[_Frame] = []
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._done = False
+        # depth -> (section name, start offset) for values we will emit
+        self._open: Dict[int, Tuple[str, int]] = {}
+
+    def feed(self, delta: str) -> List[Section]:
+        """Consume a delta and return any sections it completed"""
+        sections: List[Section] = []
+        self.text += delta
+        while self._pos < len(self.text) and not self._done:
+            self._step(self.text[self._pos], sections)
+            self._pos += 1
+        return sections
+
+    def result(self) -> Dict[str, Any]:
+        """Parse the complete document once the stream has ended"""
+        start = self.text.find("{")
+        end = self.text.rfind("}")
+        return json.loads(self.text[start:end + 1])
+
+    def _path(self) -> Tuple[Optional[str], ...]:
+        return tuple(frame.key if frame.is_object else None for frame in self._stack)
+
+    def _begin_value(self) -> None:
+        name = _section_name(self._path())
+        if name is not None:
+            self._open[len(self._stack)] = (name, self._pos)
+
+    def _end_value(self, sections: List[Section]) -> None:
+        opened = self._open.pop(len(self._stack), None)
+        if opened is not None:
+            name, start = opened
+            try:
+                value = json.loads(self.text[start:self._pos + 1])
+            except ValueError:
+                if not self.lenient:
+                    raise
+                self.broken.append(name)
+                return
+            sections.append((name, value))
+
+    def _step(self, ch: str, sections: List[Section]) -> None:
+        top = self._stack[-1] if self._stack else None
+
+        if self._in_string:
+            if self._escape:
+                self._escape = False
+            elif ch == "\\":
+                self._escape = True
+            elif ch == '"':
+                self._in_string = False
+                if top is not None and top.is_object and top.expect_key:
+                    top.key = json.loads(self.text[self._string_start:self._pos + 1])
+                    top.expect_key = False
+                else:
+                    self._end_value(sections)
+            return
+
+        if top is None and ch != "{":
+            return  # preamble before the document (fences, whitespace)
+
+        if ch == '"':
+            if not (top.is_object and top.expect_key):
+                self._begin_value()
+            self._in_string = True
+            self._string_start = self._pos
+        elif ch in "{[":
+            if top is not None:
+                self._begin_value()
+            self._stack.append(_Frame(is_object=ch == "{"))
+        elif ch in "}]":
+            self._stack.pop()
+            if self._stack:
+                self._end_value(sections)
+            else:
+                self._done = True
+        elif ch == "," and top.is_object:
+            top.key = None
+            top.expect_key = True
+
+
+def sections(plan: Dict[str, Any]) -> List[Section]:
+    """The sections a complete plan would have streamed, in document order"""
+    out: List[Section] = []
+    split = plan.get("split") or {}
+    if "type" in split:
+        out.append(("split_type", split["type"]))
+    for day, exercises in (split.get("days") or {}).items():
+        out.append((day, exercises))
+    for name in ("meals", "notes"):
+        if name in plan:
+            out.append((name, plan[name]))
+    return out
+
+
+def assemble(parts: List[Section]) -> Dict[str, Any]:
+    """Inverse of sections(): rebuild a (possibly partial) plan from named sections"""
+    plan: Dict[str, Any] = {}
+    for name, value in parts:
+        if name == "split_type":
+            plan.setdefault("split", {})["type"] = value
+        elif name in ("meals", "notes"):
+            plan[name] = value
+        else:
+            plan.setdefault("split", {}).setdefault("days", {})[name] = value
+    return plan
+
+
+def salvage(text: str) -> Tuple[Dict[str, Any], List[str]]:
+    """
+    Recover what parses from malformed or truncated model output: a partial
+    plan of the valid sections, and the names of sections that were broken.
+    """
+    parser = IncrementalPlanParser(lenient=True)
+    parts: List[Section] = []
+    try:
+        for line in text.splitlines(keepends=True):
+            parts.extend(parser.feed(line))
+    except (ValueError, AttributeError, IndexError):
+        pass  # The document structure itself is broken from here on
+    return assemble(parts), parser.broken
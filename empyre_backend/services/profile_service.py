@@ -1,43 +1,23 @@
 # empyre_backend/services/profile_service.py
-from typing import Dict, Any
+import copy
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy import select
-from empyre_backend.db import Profile, get_db
+from sqlalchemy import insert, select, update
+from sqlalchemy.exc import IntegrityError
+from empyre_backend.db import ChatMessage, Profile
+from empyre_backend.utils.settings import env
 
-async def get_or_create(user_id: str, db: AsyncSession) -> Dict[str, Any]:
-    """Get existing profile or create new one"""
-    # Check if profile exists
-    result = await db.execute(select(Profile).where(Profile.user_id == user_id))
-    profile = result.scalar_one_or_none()
-    
-    if not profile:
-        # Create new profile
-        profile = Profile(user_id=user_id, profile_data={"user_id": user_id})
-        db.add(profile)
-        await db.commit()
-        await db.refresh(profile)
-    
-    return profile.profile_data
+# Times a chat turn is run before a profile conflict goes back to the client
+PROFILE_TURN_ATTEMPTS = int(env("PROFILE_TURN_ATTEMPTS", "3"))
 
-async def apply_patch(profile_data: Dict[str, Any], patch: Dict[str, Any], user_id: str, db: AsyncSession) -> Dict[str, Any]:
-    """Apply patch to profile and save to database"""
-    profile_data.update(patch)
-    
-    # Update in database
-    result = await db.execute(select(Profile).where(Profile.user_id == user_id))
-    profile = result.scalar_one_or_none()
-    
-    if profile:
-        profile.profile_data = profile_data
-        await db.commit()
-    
-    return profile_data
+CORE_FIELDS = ["initial_goal", "knowledge_level", "experience_years",
+               "training_days_per_week", "session_length_min", "equipment_access"]
 
 def is_core_complete(profile: Dict[str, Any]) -> bool:
     """Check if all core fields are present"""
-    core = ["initial_goal", "knowledge_level", "experience_years",
-            "training_days_per_week", "session_length_min", "equipment_access"]
-    return all(f in profile for f in core)
+    return all(f in profile for f in CORE_FIELDS)
 
 def is_aux_complete(profile: Dict[str, Any]) -> bool:
     """Check if auxiliary fields are complete (if user opted in)"""
@@ -45,26 +25,145 @@ def is_aux_complete(profile: Dict[str, Any]) -> bool:
         return True  # User didn't opt in, so it's "complete"
     
     # For now, consider it complete if they've answered at least 2 auxiliary questions
-    aux_fields = [k for k in profile.keys() if k not in [
-        "user_id", "initial_goal", "knowledge_level", "experience_years",
-        "training_days_per_week", "session_length_min", "equipment_access",
-        "auxiliary_opt_in", "plan"
+    return len(aux_fields(profile)) >= 2
+
+def aux_fields(profile: Dict[str, Any]) -> list:
+    """Keys outside the core fields and bookkeeping keys"""
+    return [k for k in profile.keys() if k not in [
+        "user_id", *CORE_FIELDS, "auxiliary_opt_in", "plan", "plan_cache_opt_out"
     ]]
-    return len(aux_fields) >= 2
 
-def has_plan(profile: Dict[str, Any]) -> bool:
-    """Check if user has a plan"""
-    return "plan" in profile
+class ProfileConflict(Exception):
+    """Another turn for the same user committed first; re-run this one from a fresh read"""
+
+    def __init__(self, user_id: str):
+        self.user_id = user_id
+        super().__init__("Your profile changed while this message was being handled; please send it again")
+
+
+class ProfileSession:
+    """
+    Unit of work for one chat turn: the profile row is read once, patched in
+    memory, and written back with a single commit. The conversation phase,
+    pending field, active plan pointer and the turn's chat messages ride along.
+
+    No lock is held in between: the read transaction ends straight away (see
+    release()) so a turn waiting on the LLM holds no pooled connection. The
+    write is optimistic, conditional on the row's `version` being the one that
+    was read; if another turn got there first, commit() rolls the whole turn
+    back and raises ProfileConflict for the caller to re-run it. Plan rows are
+    flushed before commit(), so plan_store writes them under guard() to turn a
+    concurrent turn's unique-key clash into the same ProfileConflict.
+    """
+
+    def __init__(self, user_id: str, db: AsyncSession, row: Optional[Profile] = None):
+        self.user_id = user_id
+        self.db = db
+        self.version: Optional[int] = row.version if row is not None else None  # None: not stored yet
+        self.data: Dict[str, Any] = copy.deepcopy(row.profile_data or {}) if row is not None else {"user_id": user_id}
+        self.phase: str = (row.phase if row is not None else None) or "core_loop"
+        self.pending_field: Optional[str] = row.pending_field if row is not None else None
+        self.message_count: int = (row.message_count if row is not None else None) or 0
+        self.plan_id: Optional[int] = row.plan_id if row is not None else None
+        self.plan_version: Optional[int] = row.plan_version if row is not None else None
+        self._phase_changed = False
+        self._messages: List[Dict[str, Any]] = []
+        self._after_commit: List[Callable[[], None]] = []
 
-async def save(profile_data: Dict[str, Any], user_id: str, db: AsyncSession) -> None:
-    """Save profile to database"""
+    def set_phase(self, phase: str) -> None:
+        """Use conversation_state.transition() rather than calling this directly"""
+        self.phase = phase
+        self._phase_changed = True
+
+    def apply_patch(self, patch: Dict[str, Any]) -> Dict[str, Any]:
+        """Apply a manual patch in memory"""
+        self.data.update(patch)
+        return self.data
+
+    def set_plan(self, plan_id: int, version: int) -> None:
+        """Point the profile at its active plan version (see plan_store)"""
+        self.plan_id = plan_id
+        self.plan_version = version
+
+    def on_commit(self, callback: Callable[[], None]) -> None:
+        """Run `callback` once the turn has been committed"""
+        self._after_commit.append(callback)
+
+    def add_messages(self, messages: List[Dict[str, Any]], after_commit: Optional[Callable[[], None]] = None) -> None:
+        """Stage chat messages (ChatMessage column dicts) for the same commit as the profile"""
+        self._messages.extend(messages)
+        if after_commit is not None:
+            self.on_commit(after_commit)
+
+    async def release(self) -> None:
+        """
+        End the current read transaction and hand its connection back to the
+        pool; call before awaiting the LLM. Only valid before the turn's first
+        write: anything staged so far is discarded.
+        """
+        if self.db.in_transaction():
+            await self.db.rollback()
+
+    @asynccontextmanager
+    async def guard(self) -> AsyncIterator[None]:
+        """
+        Wrap writes staged for this turn (e.g. plan rows): a unique constraint
+        they hit means a concurrent turn for the user wrote first, so the turn
+        is rolled back and ProfileConflict raised like a stale version.
+        """
+        try:
+            yield
+        except IntegrityError:
+            await self.db.rollback()
+            raise ProfileConflict(self.user_id)
+
+    async def commit(self) -> None:
+        """Write the profile (if still at the version read) and everything staged, in one transaction"""
+        async with self.guard():
+            written = await self._write_row()  # Also flushes anything still pending
+            if written:
+                await self._insert_messages()
+                await self.db.commit()
+        if not written:
+            await self.db.rollback()
+            raise ProfileConflict(self.user_id)
+        self.version = (self.version or 0) + 1
+        self.message_count += len(self._messages)
+        for callback in self._after_commit:
+            callback()
+
+    async def _insert_messages(self) -> None:
+        if self._messages:
+            # One multi-row INSERT; message ids are never needed back
+            await self.db.execute(insert(ChatMessage).values(self._messages))
+
+    async def _write_row(self) -> bool:
+        now = datetime.utcnow()
+        values: Dict[str, Any] = {
+            "profile_data": self.data, "phase": self.phase, "pending_field": self.pending_field,
+            "message_count": self.message_count + len(self._messages),
+            "plan_id": self.plan_id, "plan_version": self.plan_version, "updated_at": now,
+        }
+        if self._phase_changed:
+            values["phase_changed_at"] = now
+        if self.version is None:
+            # Insert is deferred to commit so a new user costs no extra round trip
+            try:
+                await self.db.execute(insert(Profile).values(user_id=self.user_id, version=1, **values))
+            except IntegrityError:
+                return False  # Another turn created this user's profile first
+            return True
+        result = await self.db.execute(
+            update(Profile)
+            .where(Profile.user_id == self.user_id, Profile.version == self.version)
+            .values(version=self.version + 1, **values)
+        )
+        return result.rowcount == 1
+
+
+async def load_session(user_id: str, db: AsyncSession) -> ProfileSession:
+    """Read (or stage creation of) a user's profile for a single read-modify-write turn"""
     result = await db.execute(select(Profile).where(Profile.user_id == user_id))
-    profile = result.scalar_one_or_none()
-    
-    if profile:
-        profile.profile_data = profile_data
-    else:
-        profile = Profile(user_id=user_id, profile_data=profile_data)
-        db.add(profile)
-    
-    await db.commit() 
\ No newline at end of file
+    session = ProfileSession(user_id, db, result.scalar_one_or_none())
+    await session.release()
+    return session
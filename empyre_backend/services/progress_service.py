@@ -0,0 +1,131 @@
+# empyre_backend/services/progress_service.py
+"""
+Bulk progress ingestion for wearable and offline-phone sync.
+
+A batch is validated item by item, then written in one transaction with
+multi-row INSERTs. Items carrying a client-generated `idempotency_key` are
+inserted with ON CONFLICT DO NOTHING on (user_id, idempotency_key), so a
+replayed sync never creates duplicate logs; the original row id is reported
+back instead. Client timestamps are stored as naive UTC like every other
+DateTime column.
+"""
+
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+
+from pydantic import BaseModel, ValidationError, field_validator
+from sqlalchemy import insert, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from empyre_backend.db import ProgressLog, dialect_insert
+from empyre_backend.utils.helpers import naive_utc
+from empyre_backend.utils.settings import env
+
+PROGRESS_BATCH_MAX_ITEMS = int(env("PROGRESS_BATCH_MAX_ITEMS", "5000"))
+PROGRESS_BATCH_CHUNK_SIZE = int(env("PROGRESS_BATCH_CHUNK_SIZE", "1000"))
+
+
+class ProgressLogItem(BaseModel):
+    user_id: str
+    log_type: str  # "workout", "measurement", "goal"
+    log_data: Dict[str, Any]
+    idempotency_key: Optional[str] = None
+    created_at: Optional[datetime] = None  # when the set happened on the device
+
+    @field_validator("created_at")
+    @classmethod
+    def _utc(cls, value: Optional[datetime]) -> Optional[datetime]:
+        return naive_utc(value)
+
+
+class ItemResult(BaseModel):
+    index: int
+    status: str  # "created", "duplicate", "invalid" or "failed"
+    id: Optional[int] = None
+    idempotency_key: Optional[str] = None
+    error: Optional[str] = None
+
+
+def validate_items(raw_items: List[Any]) -> Tuple[List[Tuple[int, ProgressLogItem]], List[ItemResult]]:
+    """Split raw payloads into valid items and per-item validation failures"""
+    valid, failed = [], []
+    for index, raw in enumerate(raw_items):
+        try:
+            valid.append((index, ProgressLogItem.model_validate(raw)))
+        except ValidationError as exc:
+            failed.append(ItemResult(index=index, status="invalid", error=str(exc.errors()[0]["msg"])))
+    return valid, failed
+
+
+async def ingest_batch(items: List[Tuple[int, ProgressLogItem]], db: AsyncSession) -> List[ItemResult]:
+    """Insert validated items in one transaction and report each item's outcome"""
+    now = datetime.utcnow()
+    results: List[ItemResult] = []
+    keyed: Dict[Tuple[str, str], int] = {}
+    ids_by_key: Dict[Tuple[str, str], int] = {}
+    keyed_rows, plain_rows, plain_indexes, repeats = [], [], [], []
+
+    for index, item in items:
+        row = {
+            "user_id": item.user_id,
+            "log_type": item.log_type,
+            "log_data": item.log_data,
+            "idempotency_key": item.idempotency_key,
+            "created_at": item.created_at or now,
+        }
+        if item.idempotency_key is None:
+            plain_rows.append(row)
+            plain_indexes.append(index)
+        elif (item.user_id, item.idempotency_key) in keyed:
+            # Same key twice in one batch: only the first one is written
+            repeats.append((index, (item.user_id, item.idempotency_key)))
+        else:
+            keyed[(item.user_id, item.idempotency_key)] = index
+            keyed_rows.append(row)
+
+    # Keyless rows: RETURNING in parameter order maps ids back to items
+    for start in range(0, len(plain_rows), PROGRESS_BATCH_CHUNK_SIZE):
+        result = await db.execute(
+            insert(ProgressLog).returning(ProgressLog.id, sort_by_parameter_order=True),
+            plain_rows[start:start + PROGRESS_BATCH_CHUNK_SIZE],
+        )
+        for offset, new_id in enumerate(result.scalars().all()):
+            results.append(ItemResult(index=plain_indexes[start + offset], status="created", id=new_id))
+
+    # Keyed rows: replays hit the unique constraint and are skipped
+    for start in range(0, len(keyed_rows), PROGRESS_BATCH_CHUNK_SIZE):
+        stmt = (
+            dialect_insert(db)(ProgressLog)
+            .values(keyed_rows[start:start + PROGRESS_BATCH_CHUNK_SIZE])
+            .on_conflict_do_nothing(index_elements=["user_id", "idempotency_key"])
+            .returning(ProgressLog.id, ProgressLog.user_id, ProgressLog.idempotency_key)
+        )
+        for new_id, user_id, key in (await db.execute(stmt)).all():
+            ids_by_key[(user_id, key)] = new_id
+            results.append(ItemResult(index=keyed[(user_id, key)], status="created", id=new_id, idempotency_key=key))
+
+    replayed = [pair for pair in keyed if pair not in ids_by_key]
+    if replayed:
+        existing = await db.execute(
+            select(ProgressLog.id, ProgressLog.user_id, ProgressLog.idempotency_key)
+            .where(tuple_(ProgressLog.user_id, ProgressLog.idempotency_key).in_(replayed))
+        )
+        for row_id, user_id, key in existing.all():
+            ids_by_key[(user_id, key)] = row_id
+            results.append(ItemResult(index=keyed[(user_id, key)], status="duplicate", id=row_id, idempotency_key=key))
+
+    # Neither inserted nor found (the conflicting row went away meanwhile): the client should resend it
+    for pair in replayed:
+        if pair not in ids_by_key:
+            results.append(ItemResult(index=keyed[pair], status="failed", idempotency_key=pair[1],
+                                      error="Idempotency key conflicted but no stored log was found; retry"))
+
+    for index, pair in repeats:
+        if pair in ids_by_key:
+            results.append(ItemResult(index=index, status="duplicate", id=ids_by_key[pair], idempotency_key=pair[1]))
+        else:
+            results.append(ItemResult(index=index, status="failed", idempotency_key=pair[1],
+                                      error="Same idempotency key as a failed item in this batch"))
+
+    await db.commit()
+    return sorted(results, key=lambda r: r.index)
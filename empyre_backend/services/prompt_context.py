@@ -0,0 +1,169 @@
+# empyre_backend/services/prompt_context.py
+"""
+Compact, token-budgeted prompt context for the ai_coach flows.
+
+Instead of serializing the whole profile (including the generated plan) into
+every prompt, each flow gets only the fields it needs. The plan is reduced to
+one line per day ("Back Squat 3x8, ...") plus a macros line. If the payload
+still exceeds PROMPT_TOKEN_BUDGET, optional parts are dropped in priority
+order and long strings are truncated.
+
+Token counts use tiktoken when it is installed and a chars/4 estimate
+otherwise. tiktoken fetches its BPE file on first use (set TIKTOKEN_CACHE_DIR
+to a pre-populated directory for offline hosts), so the app loads it once at
+startup, off the event loop; if that fails the estimate is used for the life
+of the process.
+"""
+
+import json
+import logging
+from typing import Any, Callable, Dict, List, Optional
+
+from empyre_backend.services.profile_service import CORE_FIELDS
+from empyre_backend.utils.settings import env
+
+PROMPT_TOKEN_BUDGET = int(env("PROMPT_TOKEN_BUDGET", "1500"))
+PROMPT_MAX_FIELD_CHARS = int(env("PROMPT_MAX_FIELD_CHARS", "300"))
+
+# Bookkeeping keys that never belong in a prompt
+_INTERNAL_KEYS = {"user_id", "plan", "plan_cache_opt_out", "auxiliary_opt_in"}
+
+logger = logging.getLogger(__name__)
+
+_UNLOADED = object()
+_counter: Any = _UNLOADED  # tiktoken counter, or None for the estimate
+
+
+def load_tokenizer() -> Optional[Callable[[str], int]]:
+    """The tiktoken counter, loaded on the first call; None when tiktoken or its BPE file is unavailable"""
+    global _counter
+    if _counter is _UNLOADED:
+        _counter = None
+        try:
+            import tiktoken
+
+            encoder = tiktoken.get_encoding("cl100k_base")
+        except ImportError:
+            pass
+        except Exception as exc:
+            logger.warning("tiktoken encoding unavailable (%s); estimating prompt tokens as chars/4", exc)
+        else:
+            _counter = lambda text: len(encoder.encode(text))  # noqa: E731
+    return _counter
+
+
+def count_tokens(text: str) -> int:
+    """Token count with a local tokenizer (chars/4 estimate without tiktoken)"""
+    counter = load_tokenizer()
+    if counter is not None:
+        return counter(text)
+    return (len(text) + 3) // 4
+
+
+def summarize_plan(plan: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """Day -> 'Exercise SxR, ...' lines plus a one-line macro target"""
+    if not plan:
+        return {}
+    split = plan.get("split") or {}
+    days = {}
+    for day, exercises in (split.get("days") or {}).items():
+        parts = []
+        for item in exercises or []:
+            if isinstance(item, dict):
+                parts.append(f"{item.get('exercise')} {item.get('sets')}x{item.get('reps')}")
+            else:
+                parts.append(str(item))
+        days[day] = ", ".join(parts)
+    summary: Dict[str, Any] = {"split": split.get("type"), "days": days}
+    macros = (plan.get("meals") or {}).get("target_macros") or {}
+    if macros:
+        summary["macros"] = (
+            f"P{macros.get('protein_g')}g C{macros.get('carbs_g')}g F{macros.get('fats_g')}g"
+        )
+    return summary
+
+
+def core_fields(profile: Dict[str, Any]) -> Dict[str, Any]:
+    return {f: profile[f] for f in CORE_FIELDS if f in profile}
+
+
+def aux_answers(profile: Dict[str, Any]) -> Dict[str, Any]:
+    return {k: v for k, v in profile.items() if k not in _INTERNAL_KEYS and k not in CORE_FIELDS}
+
+
+def _truncate(value: Any) -> Any:
+    if isinstance(value, str) and len(value) > PROMPT_MAX_FIELD_CHARS:
+        return value[:PROMPT_MAX_FIELD_CHARS] + "…"
+    if isinstance(value, dict):
+        return {k: _truncate(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_truncate(v) for v in value]
+    return value
+
+
+def fit_budget(payload: Dict[str, Any], droppable: List[List[str]], budget: int) -> Dict[str, Any]:
+    """
+    Shrink payload until it fits `budget` tokens. `droppable` lists key paths
+    in the order they may be removed (least important first); a path ending in
+    a list index removes that list item.
+    """
+    if count_tokens(json.dumps(payload)) <= budget:
+        return payload
+    payload = _truncate(payload)
+    for path in droppable:
+        if count_tokens(json.dumps(payload)) <= budget:
+            break
+        parent = payload
+        for key in path[:-1]:
+            parent = parent.get(key) if isinstance(parent, dict) else None
+        if isinstance(parent, dict):
+            parent.pop(path[-1], None)
+        elif isinstance(parent, list) and len(parent) > path[-1]:
+            parent.pop(path[-1])
+    return payload
+
+
+def build(flow: str, profile: Dict[str, Any], message: Optional[str] = None,
+          history: Optional[Dict[str, Any]] = None, plan: Optional[Dict[str, Any]] = None,
+          budget: int = PROMPT_TOKEN_BUDGET) -> Dict[str, Any]:
+    """User-message payload for one ai_coach flow (`plan` is the user's current plan, for tweak_log)"""
+    core = core_fields(profile)
+    aux = aux_answers(profile)
+
+    if flow == "core_loop":
+        payload = {"profile_json": core, "knowledge_level": profile.get("knowledge_level")}
+        droppable: List[List[str]] = []
+    elif flow == "aux_offer":
+        payload = {"profile_json": core}
+        droppable = []
+    elif flow == "aux_loop":
+        payload = {"profile_json": {**core, **aux}, "auxiliary_opt_in": True}
+        droppable = [["profile_json", k] for k in reversed(list(aux))]
+    elif flow == "plan_gen":
+        payload = {"profile_json": {**core, **aux}}
+        droppable = [["profile_json", k] for k in reversed(list(aux))]
+    elif flow == "tweak_log":
+        payload = {
+            "profile_json": {**core, **aux},
+            "plan": summarize_plan(plan),
+            "message": message,
+        }
+        # Conversation memory goes oldest message first, then the summary
+        recent = (history or {}).get("recent") or []
+        if history:
+            payload["history"] = {**history, "recent": list(recent)}
+        droppable = (
+            [["plan", "macros"]]
+            + [["history", "recent", 0]] * len(recent)
+            + [["history", "summary"]]
+            + [["profile_json", k] for k in reversed(list(aux))]
+        )
+    else:
+        raise ValueError(f"Unknown flow: {flow}")
+    return fit_budget(payload, droppable, budget)
+
+
+def render(flow: str, profile: Dict[str, Any], message: Optional[str] = None,
+           history: Optional[Dict[str, Any]] = None, plan: Optional[Dict[str, Any]] = None) -> str:
+    """JSON-encoded user message for one ai_coach flow"""
+    return json.dumps(build(flow, profile, message, history, plan))
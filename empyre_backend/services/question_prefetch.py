@@ -0,0 +1,151 @@
+# empyre_backend/services/question_prefetch.py
+"""
+Speculative prefetch of the next onboarding question.
+
+An onboarding turn costs two LLM calls in series: extract the answer to the
+pending question, then generate the next question. Two cases overlap them:
+
+* Answer turns. While extract_answer runs, the question the turn will most
+  likely need is generated from the profile with the raw message standing in
+  for the answer. It is used when extraction succeeds and the turn lands in
+  the predicted phase.
+* After the optional-details offer is sent, the first aux_loop question is
+  generated in the background, so a "yes" needs no LLM call at all.
+
+Each worker keeps at most one speculation per user for PREFETCH_TTL_S. A
+speculation only starts when the LLM pool has a free slot and when the
+question really needs the LLM (templated core questions never do). Every
+speculation is counted in stats() as either a hit or wasted, and wasted ones
+record why (miss, unanswered, stale, expired, error, evicted).
+"""
+
+import asyncio
+import copy
+import time
+from collections import OrderedDict
+from typing import Any, Dict, NamedTuple, Optional, Tuple
+
+from empyre_backend.services import ai_coach, conversation_state, llm_client, onboarding_rules
+from empyre_backend.services.conversation_state import Phase
+from empyre_backend.services.profile_service import ProfileSession
+from empyre_backend.utils.settings import env
+
+PREFETCH_ENABLED = env("PREFETCH_ENABLED", "1") == "1"
+PREFETCH_TTL_S = float(env("PREFETCH_TTL_S", "120"))
+PREFETCH_MAX_USERS = int(env("PREFETCH_MAX_USERS", "10000"))
+
+_QUESTION_FLOWS = {
+    Phase.CORE_LOOP: ai_coach.core_loop,
+    Phase.AUX_OFFER: ai_coach.aux_offer,
+    Phase.AUX_LOOP: ai_coach.aux_loop,
+}
+
+
+class Speculation(NamedTuple):
+    phase: Phase
+    task: asyncio.Task
+    expires: float
+
+
+_pending: "OrderedDict[str, Speculation]" = OrderedDict()
+_stats: Dict[Tuple[str, str], int] = {}
+
+
+def stats() -> Dict[Tuple[str, str], int]:
+    """(phase, outcome) -> count, where outcome is started, hit or a wasted reason"""
+    return dict(_stats)
+
+
+def _count(phase: Phase, outcome: str) -> None:
+    key = (phase.value, outcome)
+    _stats[key] = _stats.get(key, 0) + 1
+
+
+def _retrieve(task: asyncio.Task) -> None:
+    # Abandoned speculations must not log "exception was never retrieved"
+    if not task.cancelled():
+        task.exception()
+
+
+def discard(user_id: str, reason: str) -> None:
+    """Drop the user's speculation, counting it as wasted"""
+    spec = _pending.pop(user_id, None)
+    if spec is not None:
+        spec.task.cancel()
+        _count(spec.phase, reason)
+
+
+def _needs_llm(phase: Phase, profile: Dict[str, Any]) -> bool:
+    if phase is Phase.CORE_LOOP:
+        return not (onboarding_rules.ONBOARDING_FAST_PATH and onboarding_rules.next_question(profile))
+    return phase in _QUESTION_FLOWS
+
+
+def _start(user_id: str, phase: Phase, profile: Dict[str, Any]) -> None:
+    # 1. Expired entries sit at the front: everything shares one TTL
+    now = time.monotonic()
+    while _pending and next(iter(_pending.values())).expires < now:
+        discard(next(iter(_pending)), "expired")
+    discard(user_id, "miss")
+
+    # 2. Run the question flow in the background
+    task = asyncio.create_task(_QUESTION_FLOWS[phase](profile))
+    task.add_done_callback(_retrieve)
+    _pending[user_id] = Speculation(phase, task, now + PREFETCH_TTL_S)
+    _count(phase, "started")
+    while len(_pending) > PREFETCH_MAX_USERS:
+        discard(next(iter(_pending)), "evicted")
+
+
+def on_answer(session: ProfileSession, message: str) -> None:
+    """Answer turn: start the likely next question alongside extract_answer"""
+    if not PREFETCH_ENABLED or not llm_client.has_capacity():
+        return
+    field = session.pending_field
+    if ai_coach.extract_locally(field, message) is not None:
+        return  # Extraction is local, so there is no LLM call to overlap with
+    provisional = {**copy.deepcopy(session.data), field: message}
+    phase = conversation_state.after_answer(conversation_state.current(session), provisional)
+    if _needs_llm(phase, provisional):
+        _start(session.user_id, phase, provisional)
+
+
+def after_offer(session: ProfileSession) -> None:
+    """Offer turn: have the first optional question ready for a "yes" """
+    if not PREFETCH_ENABLED or not llm_client.has_capacity():
+        return
+    provisional = {**copy.deepcopy(session.data), conversation_state.OPT_IN_FIELD: True}
+    _start(session.user_id, Phase.AUX_LOOP, provisional)
+
+
+def settle(session: ProfileSession) -> None:
+    """Once the turn's phase is known, drop a speculation that cannot be used"""
+    spec = _pending.get(session.user_id)
+    if spec is None:
+        return
+    if spec.phase is not conversation_state.current(session):
+        discard(session.user_id, "miss")
+    elif spec.expires < time.monotonic():
+        discard(session.user_id, "expired")
+
+
+async def take(session: ProfileSession) -> Optional[Dict[str, Any]]:
+    """The prefetched question for this turn's phase, waiting for it if still running"""
+    spec = _pending.get(session.user_id)
+    if spec is None or spec.phase is not conversation_state.current(session):
+        return None
+    del _pending[session.user_id]
+    try:
+        resp = await spec.task
+    except Exception:
+        _count(spec.phase, "error")
+        return None
+    field = resp.get("field")
+    stale = field in session.data or (
+        spec.phase is Phase.CORE_LOOP and field != onboarding_rules.next_core_field(session.data)
+    )
+    if resp.get("type") == "question" and stale:
+        _count(spec.phase, "stale")
+        return None
+    _count(spec.phase, "hit")
+    return resp
@@ -0,0 +1,191 @@
+# empyre_backend/services/rate_limit.py
+"""
+Load shedding for the chat API and the LLM client.
+
+* Per-user token bucket on chat turns (RATE_LIMIT_USER_PER_MIN, burst
+  RATE_LIMIT_USER_BURST), so one client hammering retry costs nothing past
+  its budget.
+* Per-model token bucket on LLM calls (RATE_LIMIT_MODEL_RPM, e.g.
+  "gpt-4=500,*=3000"), kept under the provider's limits. A call that would
+  wait up to RATE_LIMIT_MODEL_MAX_WAIT_S is delayed; beyond that it fails
+  fast. A provider 429 puts the model's bucket into debt for its
+  Retry-After, so the calls behind it fail fast too instead of piling on.
+* Single-flight: concurrent identical turns (same user, message and patch)
+  in one process share the first one's result instead of each running.
+
+The global concurrency cap and its bounded wait queue live in llm_client.
+Every rejection raises RateLimited; main.py turns it into a 429 with a
+Retry-After header. Limits are per worker process.
+"""
+
+import asyncio
+import math
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+from empyre_backend.utils.settings import env
+
+RATE_LIMIT_USER_PER_MIN = float(env("RATE_LIMIT_USER_PER_MIN", "30"))  # 0 disables
+RATE_LIMIT_USER_BURST = int(env("RATE_LIMIT_USER_BURST", "10"))
+RATE_LIMIT_MAX_USERS = int(env("RATE_LIMIT_MAX_USERS", "100000"))
+RATE_LIMIT_MODEL_RPM = env("RATE_LIMIT_MODEL_RPM", "*=3000")  # model=requests per minute, "" disables
+RATE_LIMIT_MODEL_BURST_S = float(env("RATE_LIMIT_MODEL_BURST_S", "5"))  # burst = this many seconds of rate
+RATE_LIMIT_MODEL_MAX_WAIT_S = float(env("RATE_LIMIT_MODEL_MAX_WAIT_S", "2"))
+
+
+class RateLimited(Exception):
+    """Over a limit; retry after `retry_after` seconds"""
+
+    def __init__(self, scope: str, retry_after: float):
+        self.scope = scope
+        self.retry_after = max(retry_after, 0.0)
+        super().__init__(f"Too many requests ({scope}); retry after {math.ceil(self.retry_after)} s")
+
+
+class TokenBucket:
+    """`rate` tokens per second, holding at most `capacity`"""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def reserve(self, max_wait: float = 0.0) -> Tuple[bool, float]:
+        """
+        Take one token if it is available within `max_wait` seconds. Returns
+        (taken, wait): how long the caller must wait before using it, or, when
+        not taken, how long until it would be.
+        """
+        self._refill()
+        wait = (1 - self.tokens) / self.rate if self.tokens < 1 else 0.0
+        if wait > max_wait:
+            return False, wait
+        self.tokens -= 1
+        return True, wait
+
+    def pause(self, seconds: float) -> None:
+        """Hand out nothing for the next `seconds`"""
+        self._refill()
+        self.tokens = min(self.tokens, 1 - seconds * self.rate)
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+
+_users: "OrderedDict[str, TokenBucket]" = OrderedDict()
+_models: Dict[str, TokenBucket] = {}
+_stats: Dict[Tuple[str, str], int] = {}
+
+
+def stats() -> Dict[Tuple[str, str], int]:
+    """(scope, outcome) -> count; scope is user, model, provider, queue or coalesce"""
+    return dict(_stats)
+
+
+def count(scope: str, outcome: str) -> None:
+    _stats[(scope, outcome)] = _stats.get((scope, outcome), 0) + 1
+
+
+def check_user(user_id: str) -> None:
+    """Spend one of the user's chat turns, or raise RateLimited"""
+    if RATE_LIMIT_USER_PER_MIN <= 0:
+        return
+    bucket = _users.get(user_id)
+    if bucket is None:
+        bucket = _users[user_id] = TokenBucket(RATE_LIMIT_USER_PER_MIN / 60, RATE_LIMIT_USER_BURST)
+        while len(_users) > RATE_LIMIT_MAX_USERS:
+            _users.popitem(last=False)
+    _users.move_to_end(user_id)
+    taken, wait = bucket.reserve()
+    if not taken:
+        count("user", "rejected")
+        raise RateLimited("user", wait)
+
+
+def _parse_rpm(spec: str) -> Dict[str, float]:
+    limits = {}
+    for item in filter(None, (part.strip() for part in spec.split(","))):
+        model, _, rpm = item.partition("=")
+        limits[model.strip()] = float(rpm)
+    return limits
+
+
+_MODEL_RPM = _parse_rpm(RATE_LIMIT_MODEL_RPM)
+
+
+def _model_bucket(model: str) -> Optional[TokenBucket]:
+    bucket = _models.get(model)
+    if bucket is None:
+        rpm = _MODEL_RPM.get(model, _MODEL_RPM.get("*", 0))
+        if rpm <= 0:
+            return None
+        rate = rpm / 60
+        bucket = _models[model] = TokenBucket(rate, max(rate * RATE_LIMIT_MODEL_BURST_S, 1))
+    return bucket
+
+
+async def acquire_model(model: str) -> None:
+    """Wait briefly for the model's rate budget, or raise RateLimited"""
+    bucket = _model_bucket(model)
+    if bucket is None:
+        return
+    taken, wait = bucket.reserve(RATE_LIMIT_MODEL_MAX_WAIT_S)
+    if not taken:
+        count("model", "rejected")
+        raise RateLimited("model", wait)
+    if wait > 0:
+        count("model", "delayed")
+        await asyncio.sleep(wait)
+
+
+def provider_limited(model: str, retry_after: Optional[float]) -> RateLimited:
+    """The provider returned 429: stop sending this model calls for `retry_after`"""
+    seconds = retry_after if retry_after is not None else RATE_LIMIT_MODEL_MAX_WAIT_S
+    bucket = _model_bucket(model)
+    if bucket is not None:
+        bucket.pause(seconds)
+    count("provider", "rejected")
+    return RateLimited("provider", seconds)
+
+
+def _retrieve(future: asyncio.Future) -> None:
+    # Followers may all have gone away; don't log "exception was never retrieved"
+    if not future.cancelled():
+        future.exception()
+
+
+class SingleFlight:
+    """Concurrent calls with the same key share the first call's result"""
+
+    def __init__(self, scope: str):
+        self.scope = scope
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        future = self._calls.get(key)
+        if future is not None:
+            count(self.scope, "joined")
+            return await asyncio.shield(future)
+
+        future = asyncio.get_running_loop().create_future()
+        future.add_done_callback(_retrieve)
+        self._calls[key] = future
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as exc:
+            future.set_exception(exc)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            del self._calls[key]
@@ -0,0 +1,292 @@
+# empyre_backend/services/response_cache.py
+"""
+Semantic cache for post-plan tweak and log replies.
+
+Messages after the plan are repetitive ("logged my workout", "swap squats for
+leg press", "done for today"), so a user's tweak_log replies are reused when
+their new message is a near-duplicate of one they already sent. Replies are
+written from the user's own profile, plan and history, so entries belong to
+one user and are never served to another:
+
+* Messages are embedded with a hashed vectorizer (character 3-grams plus
+  words and word pairs, RESPONSE_CACHE_DIM dimensions, unit length); no
+  model download, ~50 µs per message.
+* Vectors live in one preallocated numpy matrix and the nearest neighbour is
+  a single matrix-vector product over the asking user's rows. At
+  RESPONSE_CACHE_MAX_ENTRIES in the thousands that exact scan is faster than
+  an approximate index would be.
+* A hit needs cosine similarity >= RESPONSE_CACHE_THRESHOLD, the same
+  numbers in both messages ("bench 100kg" never answers "bench 110kg") and
+  the same negations ("done for today" never answers "not done for today").
+  Replies to a question (the last coach message ended in "?") depend on the
+  conversation and always go to the model.
+* Replies without a plan_update are reused as is while the user's plan is
+  unchanged. A plan_update that only swaps exercises is kept as a template
+  ({old exercise: new exercise}) and replayed against the user's current
+  plan, but only for a message with the same words in the same order once
+  courtesy words and plurals are dropped ("can you swap squats for leg
+  press" = "swap squat for leg press", never "swap leg press for squats").
+  Any other plan_update is never cached.
+
+Entries are evicted least recently used and after RESPONSE_CACHE_TTL_S.
+The cache is per worker; RESPONSE_CACHE_ENABLED=0 turns it off.
+benchmarks/response_cache.py replays traffic to pick the threshold.
+"""
+
+import json
+import re
+import time
+import zlib
+from collections import OrderedDict
+from typing import Any, Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from empyre_backend.utils.settings import env
+
+RESPONSE_CACHE_ENABLED = env("RESPONSE_CACHE_ENABLED", "1") == "1"
+RESPONSE_CACHE_THRESHOLD = float(env("RESPONSE_CACHE_THRESHOLD", "0.85"))
+RESPONSE_CACHE_MAX_ENTRIES = int(env("RESPONSE_CACHE_MAX_ENTRIES", "5000"))
+RESPONSE_CACHE_TTL_S = float(env("RESPONSE_CACHE_TTL_S", "86400"))
+RESPONSE_CACHE_DIM = int(env("RESPONSE_CACHE_DIM", "512"))
+
+_NUMBER = re.compile(r"\d+(?:[.,]\d+)?")
+# After normalize(), "don't" is "don t": the lone "t" is the n't
+_NEGATIONS = frozenset("not no never nothing none nor neither nope t dont didnt cant couldnt wont wouldnt "
+                       "isnt arent wasnt werent havent hasnt hadnt shouldnt without".split())
+_DAY = re.compile(r"Day \d+$")
+_FILLER = frozenset("a an the please pls can could would will you i d id my me just hey hi ok okay thanks "
+                    "thank coach legionary like want need let lets s".split())
+
+
+def normalize(message: str) -> str:
+    return " ".join(re.sub(r"[^\w\s]", " ", message.lower()).split())
+
+
+def numbers(message: str) -> Tuple[str, ...]:
+    return tuple(_NUMBER.findall(message))
+
+
+def negations(text: str) -> Tuple[str, ...]:
+    """Negation words of normalized text, in order"""
+    return tuple(word for word in text.split() if word in _NEGATIONS)
+
+
+def _plan_key(plan: Optional[Dict[str, Any]]) -> int:
+    return zlib.crc32(json.dumps(plan, sort_keys=True, default=str).encode())
+
+
+def _owner(user_id: str) -> int:
+    return zlib.crc32(user_id.encode())
+
+
+def content_words(text: str) -> Tuple[str, ...]:
+    """Normalized words that carry meaning, in order, singular"""
+    return tuple(word[:-1] if len(word) > 3 and word.endswith("s") else word
+                 for word in text.split() if word not in _FILLER)
+
+
+def embed(text: str, dim: int = RESPONSE_CACHE_DIM) -> np.ndarray:
+    """Unit-length hashed n-gram vector of normalized text"""
+    words = text.split()
+    padded = f" {text} "
+    features = [padded[i:i + 3] for i in range(len(padded) - 2)]
+    features += [f"w:{word}" for word in words]
+    features += [f"b:{a} {b}" for a, b in zip(words, words[1:])]
+    vector = np.zeros(dim, dtype=np.float32)
+    for feature in features:
+        digest = zlib.crc32(feature.encode())
+        # The top bit picks a sign so that colliding features tend to cancel out
+        vector[digest % dim] += 1.0 if digest & 0x80000000 else -1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+Key = Tuple[str, str]  # (user_id, normalized message)
+
+
+class Entry(NamedTuple):
+    slot: int
+    numbers: Tuple[str, ...]
+    negations: Tuple[str, ...]
+    words: Tuple[str, ...]
+    text: str
+    swaps: Optional[Dict[str, str]]  # None: reply has no plan_update
+    plan: int  # _plan_key of the plan the reply was written against
+    expires: float
+
+
+class VectorIndex:
+    """Fixed-capacity LRU of unit vectors with exact cosine nearest-neighbour search per owner"""
+
+    def __init__(self, capacity: int = RESPONSE_CACHE_MAX_ENTRIES, dim: int = RESPONSE_CACHE_DIM):
+        self.dim = dim
+        self.vectors = np.zeros((max(capacity, 1), dim), dtype=np.float32)
+        self.owners = np.full(len(self.vectors), -1, dtype=np.int64)  # _owner(user_id) per slot, -1 if free
+        self.entries: "OrderedDict[Key, Entry]" = OrderedDict()
+        self.keys: List[Optional[Key]] = [None] * len(self.vectors)
+        self.free = list(range(len(self.vectors) - 1, -1, -1))
+        self.used = 0  # slots are handed out lowest first; scan only up to the highest one taken
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def nearest(self, user_id: str, vector: np.ndarray) -> Tuple[Optional[Key], float]:
+        """The user's closest entry; other users' rows are masked out"""
+        if not self.entries:
+            return None, 0.0
+        scores = np.where(self.owners[:self.used] == _owner(user_id), self.vectors[:self.used] @ vector, -np.inf)
+        slot = int(np.argmax(scores))
+        key = self.keys[slot]
+        if key is None or key[0] != user_id:  # No entries for this user (or an owner hash collision)
+            return None, 0.0
+        return key, float(scores[slot])
+
+    def get(self, key: Key) -> Optional[Entry]:
+        entry = self.entries.get(key)
+        if entry is not None:
+            self.entries.move_to_end(key)
+        return entry
+
+    def put(self, key: Key, vector: np.ndarray, entry: Entry) -> None:
+        if key in self.entries:
+            self.discard(key)
+        if not self.free:
+            self.discard(next(iter(self.entries)))
+        slot = self.free.pop()
+        self.used = max(self.used, slot + 1)
+        self.vectors[slot] = vector
+        self.owners[slot] = _owner(key[0])
+        self.keys[slot] = key
+        self.entries[key] = entry._replace(slot=slot)
+
+    def discard(self, key: Key) -> None:
+        entry = self.entries.pop(key)
+        self.vectors[entry.slot] = 0.0
+        self.owners[entry.slot] = -1
+        self.keys[entry.slot] = None
+        self.free.append(entry.slot)
+
+
+_index: Optional[VectorIndex] = None
+_stats = {"hits": 0, "misses": 0, "bypassed": 0, "stores": 0, "uncacheable": 0, "template_misses": 0}
+
+
+def _get_index() -> VectorIndex:
+    global _index
+    if _index is None:
+        _index = VectorIndex()
+    return _index
+
+
+def stats() -> Dict[str, Any]:
+    lookups = _stats["hits"] + _stats["misses"]
+    return {**_stats, "entries": len(_index) if _index is not None else 0,
+            "hit_rate": _stats["hits"] / lookups if lookups else 0.0}
+
+
+def clear() -> None:
+    global _index
+    _index = None
+
+
+def _days(plan: Optional[Dict[str, Any]]) -> Dict[str, List[Dict[str, Any]]]:
+    return ((plan or {}).get("split") or {}).get("days") or {}
+
+
+def swaps(plan: Optional[Dict[str, Any]], plan_update: Dict[str, Any]) -> Optional[Dict[str, str]]:
+    """
+    The plan_update as {old exercise: new exercise} when all it does is rename
+    exercises in place (same sets and reps); None for any other change.
+    """
+    days = _days(plan)
+    found: Dict[str, str] = {}
+    for name, new in plan_update.items():
+        old = days.get(name)
+        if not _DAY.match(name) or not isinstance(new, list) or not isinstance(old, list) or len(old) != len(new):
+            return None
+        for before, after in zip(old, new):
+            if not isinstance(after, dict) or any(before.get(k) != after.get(k) for k in ("sets", "reps")):
+                return None
+            old_name, new_name = str(before.get("exercise", "")), str(after.get("exercise", ""))
+            if old_name.lower() != new_name.lower():
+                if found.get(old_name.lower(), new_name) != new_name:
+                    return None
+                found[old_name.lower()] = new_name
+    return found or None
+
+
+def _apply_swaps(plan: Optional[Dict[str, Any]], swap: Dict[str, str]) -> Dict[str, Any]:
+    """The plan_update the swaps make to this plan (empty if it has none of the exercises)"""
+    update = {}
+    for name, exercises in _days(plan).items():
+        renamed = [
+            {**item, "exercise": swap[str(item.get("exercise", "")).lower()]}
+            if str(item.get("exercise", "")).lower() in swap else item
+            for item in exercises
+        ]
+        if renamed != exercises:
+            update[name] = renamed
+    return update
+
+
+def _bypass(message: str, history: Optional[Dict[str, Any]]) -> bool:
+    if not RESPONSE_CACHE_ENABLED or not normalize(message):
+        return True
+    coach = [item["content"] for item in (history or {}).get("recent") or [] if item.get("role") == "assistant"]
+    return bool(coach) and coach[-1].rstrip().endswith("?")
+
+
+def lookup(user_id: str, message: str, plan: Optional[Dict[str, Any]],
+           history: Optional[Dict[str, Any]] = None) -> Optional[Dict[str, Any]]:
+    """A reply for `message` built from a near-duplicate one this user sent, or None"""
+    if _bypass(message, history):
+        _stats["bypassed"] += 1
+        return None
+    index = _get_index()
+    text = normalize(message)
+    key, score = index.nearest(user_id, embed(text, index.dim))
+    entry = index.get(key) if key is not None and score >= RESPONSE_CACHE_THRESHOLD else None
+    if entry is not None and entry.expires < time.monotonic():
+        index.discard(key)
+        entry = None
+    if entry is None or entry.numbers != numbers(message) or entry.negations != negations(text):
+        _stats["misses"] += 1
+        return None
+    if entry.swaps is None and entry.plan != _plan_key(plan):
+        # The reply was written against a plan that has changed since
+        _stats["misses"] += 1
+        return None
+    resp: Dict[str, Any] = {"type": "confirmation", "text": entry.text}
+    if entry.swaps is not None:
+        if entry.words != content_words(text):
+            _stats["template_misses"] += 1
+            return None
+        update = _apply_swaps(plan, entry.swaps)
+        if not update:
+            # This user's plan has nothing to swap: let the model answer
+            _stats["template_misses"] += 1
+            return None
+        resp["plan_update"] = update
+    _stats["hits"] += 1
+    return resp
+
+
+def store(user_id: str, message: str, plan: Optional[Dict[str, Any]], resp: Dict[str, Any],
+          history: Optional[Dict[str, Any]] = None) -> None:
+    """Remember the model's reply to this user's `message` if it can be reused"""
+    if _bypass(message, history) or resp.get("type") != "confirmation" or not isinstance(resp.get("text"), str):
+        return
+    plan_update = resp.get("plan_update")
+    swap = None
+    if plan_update:
+        swap = swaps(plan, plan_update) if isinstance(plan_update, dict) else None
+        if swap is None:
+            _stats["uncacheable"] += 1
+            return
+    index = _get_index()
+    text = normalize(message)
+    entry = Entry(-1, numbers(message), negations(text), content_words(text), resp["text"], swap,
+                  _plan_key(plan), time.monotonic() + RESPONSE_CACHE_TTL_S)
+    index.put((user_id, text), embed(text, index.dim), entry)
+    _stats["stores"] += 1
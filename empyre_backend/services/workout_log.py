@@ -0,0 +1,86 @@
+# empyre_backend/services/workout_log.py
+"""
+Helpers for reading sets out of workout `log_data`.
+
+Progress logs are free-form JSON, so these accept the shapes clients send:
+
+    {"exercise": "Bench Press", "sets": [{"weight": 60, "reps": 8}, ...]}
+    {"exercises": [{"exercise": "Squat", "sets": [...]}, ...]}
+    {"exercise": "Row", "weight": 50, "reps": 10, "sets": 3}
+
+Weights are read from `weight`, `weight_kg` or `load`; missing weight counts
+as bodyweight (0). Non-finite numbers are ignored and exercises, sets, reps
+and weight are clamped to the MAX_* bounds below, so one hostile log cannot
+overflow a total or keep the caller busy.
+"""
+
+import math
+from typing import Any, Dict, Iterator, List, Tuple
+
+WorkSet = Tuple[str, float, int]  # (exercise, weight, reps)
+
+MAX_EXERCISES = 50   # per log
+MAX_SETS = 100       # per exercise entry
+MAX_REPS = 1000      # per set
+MAX_WEIGHT = 2000.0  # kg or lb, comfortably above any real lift
+
+
+def normalize_exercise(name: Any) -> str:
+    return " ".join(str(name).strip().lower().split())
+
+
+def _number(value: Any, default: float = 0.0) -> float:
+    try:
+        number = float(value)
+    except (TypeError, ValueError, OverflowError):
+        return default
+    return number if math.isfinite(number) else default
+
+
+def _count(value: Any, limit: int, default: float = 0.0) -> int:
+    return int(min(max(_number(value, default), 0), limit))
+
+
+def _weight(entry: Dict[str, Any]) -> float:
+    for key in ("weight", "weight_kg", "load"):
+        if key in entry:
+            return min(max(_number(entry[key]), 0.0), MAX_WEIGHT)
+    return 0.0
+
+
+def _exercise_entries(log_data: Dict[str, Any]) -> List[Dict[str, Any]]:
+    if isinstance(log_data.get("exercises"), list):
+        return [e for e in log_data["exercises"][:MAX_EXERCISES] if isinstance(e, dict)]
+    if "exercise" in log_data:
+        return [log_data]
+    return []
+
+
+def iter_sets(log_data: Dict[str, Any]) -> Iterator[WorkSet]:
+    """Yield every (exercise, weight, reps) set recorded in a workout log"""
+    if not isinstance(log_data, dict):
+        return
+    for entry in _exercise_entries(log_data):
+        name = entry.get("exercise") or entry.get("name")
+        if not name:
+            continue
+        exercise = normalize_exercise(name)
+        sets = entry.get("sets")
+        if isinstance(sets, list):
+            for item in sets[:MAX_SETS]:
+                if isinstance(item, dict):
+                    reps = _count(item.get("reps"), MAX_REPS)
+                    if reps > 0:
+                        yield exercise, _weight(item), reps
+        else:
+            # Flat form: N identical sets of weight x reps
+            reps = _count(entry.get("reps"), MAX_REPS)
+            for _ in range(max(_count(sets, MAX_SETS, 1), 1) if reps > 0 else 0):
+                yield exercise, _weight(entry), reps
+
+
+def estimated_1rm(weight: float, reps: int) -> float:
+    """Epley estimate; a single is its own 1RM"""
+    if reps <= 1:
+        return weight
+    return weight * (1 + reps / 30)
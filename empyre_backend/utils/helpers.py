@@ -1,15 +1,22 @@
-from dotenv import load_dotenv, find_dotenv
-import os
+from datetime import datetime, timezone
+from typing import Optional
 
-# Locate .env in project root
-dotenv_path = find_dotenv(filename='.env', raise_error_if_not_found=True)
-load_dotenv(dotenv_path)
+from empyre_backend.utils.settings import get_settings
 
 def get_openai_key() -> str:
     """
-    Return the OPENAI_API_KEY from .env, or raise if missing/placeholder.
+    Return the OPENAI_API_KEY from the environment or .env, or raise if missing/placeholder.
     """
-    key = os.getenv('OPENAI_API_KEY')
+    key = get_settings().openai_api_key
     if not key or key == 'your_api_key_here':
         raise RuntimeError('OPENAI_API_KEY environment variable is not set or is still the placeholder')
-    return key 
\ No newline at end of file
+    return key
+
+def naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    """
+    Timezone-aware datetimes converted to UTC with tzinfo dropped, to match the
+    naive UTC DateTime columns (asyncpg rejects aware values for them).
+    """
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
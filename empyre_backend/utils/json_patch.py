@@ -0,0 +1,99 @@
+"""
+Minimal JSON Patch (RFC 6902) for plan revisions.
+
+Only the operations a diff of two documents needs are supported: add,
+remove and replace. diff() recurses into objects, and into arrays of the same
+length, so a tweak to one exercise becomes one small op rather than a copy
+of the day or the plan. Arrays that change length are replaced whole.
+"""
+
+import copy
+from typing import Any, Dict, List
+
+Patch = List[Dict[str, Any]]
+
+
+class PatchError(ValueError):
+    pass
+
+
+def _escape(token: str) -> str:
+    return token.replace("~", "~0").replace("/", "~1")
+
+
+def _unescape(token: str) -> str:
+    return token.replace("~1", "/").replace("~0", "~")
+
+
+def _diff(old: Any, new: Any, path: str, ops: Patch) -> None:
+    if old == new:
+        return
+    if isinstance(old, dict) and isinstance(new, dict):
+        for key in old:
+            if key not in new:
+                ops.append({"op": "remove", "path": f"{path}/{_escape(key)}"})
+        for key, value in new.items():
+            if key not in old:
+                ops.append({"op": "add", "path": f"{path}/{_escape(key)}", "value": value})
+            else:
+                _diff(old[key], value, f"{path}/{_escape(key)}", ops)
+    elif isinstance(old, list) and isinstance(new, list) and len(old) == len(new):
+        for index, (before, after) in enumerate(zip(old, new)):
+            _diff(before, after, f"{path}/{index}", ops)
+    else:
+        ops.append({"op": "replace", "path": path, "value": new})
+
+
+def diff(old: Any, new: Any) -> Patch:
+    """Operations that turn `old` into `new` (empty when they are equal)"""
+    ops: Patch = []
+    _diff(old, new, "", ops)
+    return ops
+
+
+def _parent(doc: Any, path: str):
+    if not path.startswith("/"):
+        raise PatchError(f"Invalid path: {path!r}")
+    tokens = [_unescape(token) for token in path[1:].split("/")]
+    for token in tokens[:-1]:
+        try:
+            doc = doc[int(token)] if isinstance(doc, list) else doc[token]
+        except (KeyError, IndexError, ValueError, TypeError):
+            raise PatchError(f"Path not found: {path!r}")
+    return doc, tokens[-1]
+
+
+def apply(doc: Any, patch: Patch) -> Any:
+    """A copy of `doc` with `patch` applied; `doc` itself is left untouched"""
+    doc = copy.deepcopy(doc)
+    for op in patch:
+        kind, path, value = op.get("op"), op.get("path", ""), copy.deepcopy(op.get("value"))
+        if kind not in ("add", "remove", "replace"):
+            raise PatchError(f"Unsupported op: {kind!r}")
+        if path == "":
+            if kind == "remove":
+                raise PatchError("Cannot remove the whole document")
+            doc = value
+            continue
+        parent, key = _parent(doc, path)
+        try:
+            if isinstance(parent, list):
+                index = len(parent) if key == "-" else int(key)
+                if kind == "add":
+                    parent.insert(index, value)
+                elif kind == "remove":
+                    del parent[index]
+                else:
+                    parent[index] = value
+            elif isinstance(parent, dict):
+                if kind != "add" and key not in parent:
+                    raise KeyError(key)
+                if kind == "remove":
+                    del parent[key]
+                else:
+                    parent[key] = value
+            else:
+                raise TypeError(type(parent).__name__)
+        except (KeyError, IndexError, ValueError, TypeError):
+            raise PatchError(f"Cannot {kind} {path!r}")
+    return doc
@@ -1,13 +1,3 @@
-from fastapi import FastAPI
-from empyre_backend.routers.chat import router as chat_router
-from empyre_backend.db import init_db
-
-app = FastAPI()
-
-@app.on_event("startup")
-async def startup_event():
-    """Initialize database on startup"""
-    await init_db()
-
-# Include routers
-app.include_router(chat_router) 
\ No newline at end of file
+# Kept so `uvicorn empyre_backend.utils.main:app` still starts the full API;
+# the app is built in empyre_backend/main.py.
+from empyre_backend.main import app, create_app  # noqa: F401
@@ -0,0 +1,287 @@
+# empyre_backend/utils/metrics.py
+"""
+Lightweight request tracing and Prometheus-style metrics.
+
+Everything is in-process and dependency free: counters and histograms are
+plain dicts keyed by label values, updated from the event loop without locks,
+and rendered in the Prometheus text format by `render()` for GET /metrics.
+
+Each HTTP request gets a `Trace` (via a ContextVar) that collects phase spans,
+DB query counts and LLM calls. With METRICS_LOG_REQUESTS=true the trace is
+logged as one JSON line when the request finishes.
+"""
+
+import bisect
+import json
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from empyre_backend.utils.settings import env
+
+METRICS_ENABLED = env("METRICS_ENABLED", "true").lower() == "true"
+METRICS_LOG_REQUESTS = env("METRICS_LOG_REQUESTS", "false").lower() == "true"
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 5)
+
+trace_logger = logging.getLogger("empyre.trace")
+
+LabelValues = Tuple[str, ...]
+
+
+class Counter:
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = ()):
+        self.name, self.help, self.labels = name, help_text, tuple(labels)
+        self.values: Dict[LabelValues, float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1) -> None:
+        self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def samples(self) -> Iterator[Tuple[str, LabelValues, float]]:
+        for key, value in self.values.items():
+            yield self.name, key, value
+
+
+class Histogram:
+    def __init__(self, name: str, help_text: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = LATENCY_BUCKETS):
+        self.name, self.help, self.labels = name, help_text, tuple(labels)
+        self.buckets = tuple(buckets)
+        self.values: Dict[LabelValues, List[float]] = {}  # bucket counts..., +Inf, sum
+
+    def observe(self, value: float, *label_values: str) -> None:
+        row = self.values.get(label_values)
+        if row is None:
+            row = self.values[label_values] = [0] * (len(self.buckets) + 2)
+        row[bisect.bisect_left(self.buckets, value)] += 1
+        row[-1] += value
+
+    def samples(self) -> Iterator[Tuple[str, LabelValues, float]]:
+        for key, row in self.values.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), row[:-1]):
+                cumulative += count
+                yield f"{self.name}_bucket", (*key, ("le", str(bound))), cumulative
+            yield f"{self.name}_sum", key, row[-1]
+            yield f"{self.name}_count", key, cumulative
+
+
+class Gauge:
+    """Read at scrape time from a callback returning {label values: value}"""
+
+    def __init__(self, name: str, help_text: str, labels: Sequence[str],
+                 callback: Callable[[], Dict[LabelValues, float]]):
+        self.name, self.help, self.labels = name, help_text, tuple(labels)
+        self.callback = callback
+
+    def samples(self) -> Iterator[Tuple[str, LabelValues, float]]:
+        for key, value in self.callback().items():
+            yield self.name, key, value
+
+
+_registry: List[Any] = []
+
+
+def counter(name: str, help_text: str, labels: Sequence[str] = ()) -> Counter:
+    metric = Counter(name, help_text, labels)
+    _registry.append(metric)
+    return metric
+
+
+def histogram(name: str, help_text: str, labels: Sequence[str] = (),
+              buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+    metric = Histogram(name, help_text, labels, buckets)
+    _registry.append(metric)
+    return metric
+
+
+def gauge(name: str, help_text: str, labels: Sequence[str],
+          callback: Callable[[], Dict[LabelValues, float]]) -> Gauge:
+    metric = Gauge(name, help_text, labels, callback)
+    _registry.append(metric)
+    return metric
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def render() -> str:
+    """All registered metrics in the Prometheus text exposition format"""
+    lines = []
+    for metric in _registry:
+        kind = type(metric).__name__.lower()
+        lines.append(f"# HELP {metric.name} {metric.help}")
+        lines.append(f"# TYPE {metric.name} {kind}")
+        for name, key, value in metric.samples():
+            pairs = []
+            for label, label_value in zip(metric.labels, key):
+                pairs.append(f'{label}="{_escape(label_value)}"')
+            if len(key) > len(metric.labels):  # histogram "le"
+                pairs.append(f'{key[-1][0]}="{key[-1][1]}"')
+            labels = "{" + ",".join(pairs) + "}" if pairs else ""
+            lines.append(f"{name}{labels} {value}")
+    return "\n".join(lines) + "\n"
+
+
+# Metrics
+http_requests = counter("empyre_http_requests_total", "HTTP requests", ["method", "route", "status"])
+http_duration = histogram("empyre_http_request_duration_seconds", "HTTP request duration", ["method", "route"])
+phase_duration = histogram("empyre_phase_duration_seconds", "Time spent per request phase", ["route", "phase"])
+db_queries = counter("empyre_db_queries_total", "Database statements executed", ["op"])
+db_duration = histogram("empyre_db_query_duration_seconds", "Database statement duration", ["op"], DB_BUCKETS)
+llm_requests = counter("empyre_llm_requests_total", "LLM calls", ["model", "flow", "outcome"])
+llm_latency = histogram("empyre_llm_latency_seconds", "LLM call latency", ["model", "flow"])
+llm_tokens = counter("empyre_llm_tokens_total", "LLM tokens", ["model", "flow", "kind"])
+
+
+class Trace:
+    """Per-request timings, filled in by span(), the DB hooks and the LLM client"""
+
+    __slots__ = ("scope", "spans", "db_count", "db_seconds", "llm_calls")
+
+    def __init__(self, scope: Optional[Dict[str, Any]] = None):
+        self.scope = scope or {}
+        self.spans: Dict[str, float] = {}
+        self.db_count = 0
+        self.db_seconds = 0.0
+        self.llm_calls: List[Dict[str, Any]] = []
+
+    @property
+    def route(self) -> str:
+        # Set by the router before the endpoint runs
+        return _route_of(self.scope)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            "spans_ms": {name: round(seconds * 1000, 2) for name, seconds in self.spans.items()},
+            "db": {"queries": self.db_count, "ms": round(self.db_seconds * 1000, 2)},
+            "llm": self.llm_calls,
+        }
+
+
+_current: ContextVar[Optional[Trace]] = ContextVar("empyre_trace", default=None)
+
+
+def current_trace() -> Optional[Trace]:
+    return _current.get()
+
+
+@contextmanager
+def span(phase: str) -> Iterator[None]:
+    """Time a phase of the current request"""
+    if not METRICS_ENABLED:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        trace = _current.get()
+        route = trace.route if trace else "background"
+        phase_duration.observe(elapsed, route, phase)
+        if trace is not None:
+            trace.spans[phase] = trace.spans.get(phase, 0.0) + elapsed
+
+
+def record_llm_call(model: str, flow: str, seconds: float, outcome: str,
+                    prompt_tokens: Optional[int] = None, completion_tokens: Optional[int] = None) -> None:
+    if not METRICS_ENABLED:
+        return
+    llm_requests.inc(model, flow, outcome)
+    llm_latency.observe(seconds, model, flow)
+    if prompt_tokens is not None:
+        llm_tokens.inc(model, flow, "prompt", amount=prompt_tokens)
+    if completion_tokens is not None:
+        llm_tokens.inc(model, flow, "completion", amount=completion_tokens)
+    trace = _current.get()
+    if trace is not None:
+        trace.llm_calls.append({
+            "model": model, "flow": flow, "ms": round(seconds * 1000, 1), "outcome": outcome,
+            "prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+        })
+
+
+def instrument_engine(engine) -> None:
+    """Count and time every statement run through an (async) engine"""
+    if not METRICS_ENABLED:
+        return
+    from sqlalchemy import event
+
+    sync_engine = getattr(engine, "sync_engine", engine)
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("empyre_query_start", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        starts = conn.info.get("empyre_query_start")
+        if not starts:
+            return
+        elapsed = time.perf_counter() - starts.pop()
+        op = statement.lstrip()[:6].upper().rstrip()
+        db_queries.inc(op)
+        db_duration.observe(elapsed, op)
+        trace = _current.get()
+        if trace is not None:
+            trace.db_count += 1
+            trace.db_seconds += elapsed
+
+
+class MetricsMiddleware:
+    """ASGI middleware: per-request Trace, HTTP metrics and optional JSON trace logs"""
+
+    def __init__(self, app, skip_paths: Sequence[str] = ("/metrics",)):
+        self.app = app
+        self.skip_paths = set(skip_paths)
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS_ENABLED or scope["path"] in self.skip_paths:
+            await self.app(scope, receive, send)
+            return
+
+        trace = Trace(scope)
+        token = _current.set(trace)
+        status = {"code": 500}
+        recorded = False
+
+        def record() -> None:
+            # Once per request: at the last body chunk, or on exit if the response never finished
+            nonlocal recorded
+            if recorded:
+                return
+            recorded = True
+            elapsed = time.perf_counter() - start
+            route = trace.route
+            http_requests.inc(scope["method"], route, str(status["code"]))
+            http_duration.observe(elapsed, scope["method"], route)
+            if METRICS_LOG_REQUESTS:
+                trace_logger.info(json.dumps({
+                    "method": scope["method"], "route": route, "status": status["code"],
+                    "ms": round(elapsed * 1000, 2), **trace.as_dict(),
+                }))
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+            # BackgroundTasks run after the last chunk inside the same call; they are not request time
+            if message["type"] == "http.response.body" and not message.get("more_body", False):
+                record()
+
+        start = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            record()
+            _current.reset(token)
+
+
+def _route_of(scope) -> str:
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"